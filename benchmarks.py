@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+"""
+@solis
+
+Benchmarks de las operaciones más costosas de db_export. Se ejecutan con
+    python benchmarks.py; las variables de la sección __main__ controlan qué
+    benchmarks se ejecutan. Si bench_pg es True también se mide la carga en
+    la db postgres de db_export_parameters (en una tabla temporal)
+bench_migrate mide las fases de Migrate con una db sintética creada con
+    fixture_create: una db sqlite que imita a una db access (se lee con el
+    backend sqlite de source_readers), con el número de tablas, la
+    profundidad de las foreign keys, el número de filas y los tipos de las
+    columnas que se quieran y con nombres con acentos y espacios. Con la
+    misma semilla se crea siempre la misma db. Los resultados se añaden a un
+    fichero json con results_dump para comparar ejecuciones
+"""
+from time import perf_counter
+
+# tipos access de las columnas de las tablas sintéticas por defecto; la
+# primary key es siempre una columna COUNTER y la foreign key INTEGER
+FIXTURE_TYPES = ('INTEGER', 'DOUBLE', 'CURRENCY', 'DATETIME', 'BIT',
+                 'VARCHAR', 'LONGCHAR')
+
+
+def float_timestamp_rows(n_rows: int) -> list:
+    """
+    filas sintéticas de una tabla numérica: int4, 2 float8 y 2 timestamptz,
+        con un 5% de nulos
+    """
+    from datetime import datetime, timedelta
+    t0 = datetime(2009, 1, 1)
+    rows = []
+    for i in range(n_rows):
+        row = [i, i * 0.731, i / 7.0, t0 + timedelta(minutes=i),
+               t0 + timedelta(seconds=i * 37)]
+        if i % 20 == 0:
+            row[2] = None
+        rows.append(row)
+    return rows
+
+
+def bench_copy_formats(n_rows: int=200000, file_ini: str=None,
+                       section: str=None) -> dict:
+    """
+    compara el formato texto, fila a fila (Migrate.copy_text_row) y por
+        columnas (value_adapters), y el formato binario de COPY en una tabla
+        float8/timestamptz: tiempo de codificación de las filas y, si se
+        pasan file_ini y section, tiempo de codificación más COPY en
+        postgres. Devuelve un dict con los tiempos en segundos y los bytes
+        de cada formato
+    """
+    from io import BytesIO, StringIO
+    from db_export import Migrate
+    import pg_copy_binary
+    import value_adapters
+
+    pg_types = ['int4', 'float8', 'float8', 'timestamptz', 'timestamptz']
+    rows = float_timestamp_rows(n_rows)
+    results = {'rows': n_rows}
+
+    t = perf_counter()
+    text = ''.join([Migrate.copy_text_row(row) for row in rows])
+    results['text_encode_secs'] = perf_counter() - t
+    results['text_bytes'] = len(text.encode('utf-8'))
+
+    adapters = value_adapters.ColumnAdapters(pg_types)
+    t = perf_counter()
+    text = adapters.copy_text(rows)
+    results['adapters_encode_secs'] = perf_counter() - t
+
+    encoder = pg_copy_binary.BinaryCopyEncoder(pg_types)
+    t = perf_counter()
+    data = pg_copy_binary.copy_data(encoder, rows)
+    results['binary_encode_secs'] = perf_counter() - t
+    results['binary_bytes'] = len(data)
+
+    if file_ini is None:
+        return results
+
+    import psycopg2
+
+    create = "create temp table bench (a int4, b float8, c float8, " +\
+        "d timestamptz, e timestamptz);"
+
+    params = Migrate.con_params_get(file_ini, section)
+    con = psycopg2.connect(**params)
+    try:
+        cur = con.cursor()
+        cur.execute(create)
+        encoder = pg_copy_binary.BinaryCopyEncoder(
+            pg_types, Migrate.session_tz(cur))
+
+        t = perf_counter()
+        text = adapters.copy_text(rows)
+        cur.copy_expert('copy bench from stdin;', StringIO(text))
+        results['text_copy_secs'] = perf_counter() - t
+        cur.execute('truncate bench;')
+
+        t = perf_counter()
+        data = pg_copy_binary.copy_data(encoder, rows)
+        cur.copy_expert('copy bench from stdin with (format binary);',
+                        BytesIO(data))
+        results['binary_copy_secs'] = perf_counter() - t
+        con.rollback()
+    finally:
+        con.close()
+    return results
+
+
+def bench_row_plan(n_rows: int=200000, tz_policy: str='utc') -> dict:
+    """
+    mide, en una tabla de texto, fecha y double, las transformaciones
+        de las filas del bucle de upsert: RowPlan.prepare frente a
+        comprobar el tipo de cada valor para aplicar strip (no_plan) y la
+        conversión de las filas preparadas con ColumnAdapters.param_values
+        (upsert con inserts) y ColumnAdapters.copy_text (upsert con COPY)
+        con la política de zona horaria tz_policy (con 'session'
+        param_values no modifica las filas). Devuelve un dict con los
+        tiempos en segundos y los microsegundos por fila
+    """
+    from datetime import datetime
+    from db_export import RowPlan
+    import value_adapters
+
+    col_names = ['codigo_estacion', 'fecha', 'valor', 'unidad', 'nota']
+    type_names = ['VARCHAR', 'DATETIME', 'DOUBLE', 'VARCHAR', 'LONGCHAR']
+    pg_types = ['varchar', 'timestamptz', 'float8', 'varchar', 'varchar']
+
+    def rows_get():
+        return [[f' E{i % 100:04d} ', datetime(2009, 1, 1), i * 0.5, 'mg/l ',
+                 None] for i in range(n_rows)]
+
+    results = {'rows': n_rows}
+
+    rows = rows_get()
+    t = perf_counter()
+    for row in rows:
+        for i, item in enumerate(row):
+            if isinstance(item, str):
+                row[i] = item.strip()
+    results['no_plan_secs'] = perf_counter() - t
+
+    rows = rows_get()
+    t = perf_counter()
+    plan = RowPlan(col_names, type_names)
+    plan.prepare(rows)
+    results['plan_secs'] = perf_counter() - t
+
+    adapters = value_adapters.ColumnAdapters(pg_types, tz_policy)
+    t = perf_counter()
+    adapters.param_values(rows)
+    results['param_values_secs'] = perf_counter() - t
+
+    rows = plan.prepare(rows_get())
+    t = perf_counter()
+    adapters.copy_text(rows)
+    results['copy_text_secs'] = perf_counter() - t
+
+    for key in ('no_plan', 'plan', 'param_values', 'copy_text'):
+        results[f'{key}_usecs_row'] = results[f'{key}_secs'] * 1e6 / n_rows
+    return results
+
+
+def fixture_values() -> dict:
+    """
+    devuelve un dict {tipo access: función (random.Random, número de fila)
+        que devuelve un valor del tipo tal como se graba en sqlite}; tiene
+        un elemento por cada tipo de Migrate.__access_pg_types
+    """
+    from datetime import datetime, timedelta
+    from uuid import UUID
+
+    t0 = datetime(2009, 1, 1)
+    words = ('análisis', 'Estación', ' pozo ', 'niño', 'año', 'cañada',
+             'Ébano', 'mg/l', 'O"Neil', 'línea\nnueva')
+
+    def text(rnd, i):
+        return f'{rnd.choice(words)} {i:d}'
+
+    def long_text(rnd, i):
+        return ' '.join([rnd.choice(words) for j in range(rnd.randrange(20))])
+
+    def date(rnd, i):
+        item = t0 + timedelta(minutes=i * 7 + rnd.randrange(60))
+        return item.strftime('%Y-%m-%d %H:%M:%S')
+
+    def binary(rnd, i):
+        return bytes([rnd.randrange(256) for j in range(16)])
+
+    return {'BIT': lambda rnd, i: rnd.randrange(2),
+            'BYTE': lambda rnd, i: rnd.randrange(256),
+            'UNSIGNED BYTE': lambda rnd, i: rnd.randrange(256),
+            'SMALLINT': lambda rnd, i: rnd.randrange(-32768, 32768),
+            'SHORT': lambda rnd, i: rnd.randrange(-32768, 32768),
+            'INTEGER': lambda rnd, i: rnd.randrange(-2 ** 31, 2 ** 31),
+            'COUNTER': lambda rnd, i: i,
+            'LONG': lambda rnd, i: rnd.randrange(-2 ** 31, 2 ** 31),
+            'SINGLE': lambda rnd, i: round(rnd.uniform(-1e3, 1e3), 3),
+            'REAL': lambda rnd, i: round(rnd.uniform(-1e3, 1e3), 3),
+            'DOUBLE': lambda rnd, i: rnd.uniform(-1e6, 1e6),
+            'CURRENCY': lambda rnd, i: f'{rnd.randrange(10 ** 8) / 100:.2f}',
+            'NUMERIC': lambda rnd, i: f'{rnd.randrange(10 ** 9) / 1000:.3f}',
+            'DATETIME': date,
+            'VARCHAR': text,
+            'LONGCHAR': long_text,
+            'LONGTEXT': long_text,
+            'GUID': lambda rnd, i: '{' + str(UUID(int=rnd.getrandbits(128),
+                                                  version=4)) + '}',
+            'BINARY': binary,
+            'VARBINARY': binary,
+            'LONGBINARY': binary}
+
+
+def fixture_create(fname: str, n_tables: int=6, fk_depth: int=3,
+                   n_rows: int=10000, types: tuple=FIXTURE_TYPES,
+                   null_ratio: float=0.05, seed: int=1) -> dict:
+    """
+    crea (o sustituye) la db sqlite fname con tablas sintéticas que imitan
+        a una db access y devuelve un dict con los parámetros
+    args
+    n_tables: número de tablas
+    fk_depth: número de niveles de carga; las tablas de un nivel tienen una
+        foreign key a una tabla del nivel anterior (anotada en la tabla
+        MSysRelationships, como en access)
+    n_rows: número de filas de cada tabla
+    types: tipos access de las columnas de datos, una columna por tipo,
+        ver fixture_values
+    null_ratio: proporción de valores nulos en las columnas de datos
+    seed: semilla de los números aleatorios
+    Los nombres de las tablas y de las columnas tienen acentos y espacios
+        para que se utilice Migrate.to_ascii
+    """
+    from os import remove
+    from os.path import isfile
+    from random import Random
+    import sqlite3
+
+    create = 'create table "{}" ({});'
+    insert = 'insert into "{}" values ({});'
+    insert1 = 'insert into MSysRelationships values (?, ?, ?, ?, ?, ?);'
+
+    create1 = \
+    """
+    create table MSysRelationships (szRelationship VARCHAR(255),
+        szObject VARCHAR(255), szColumn VARCHAR(255),
+        szReferencedObject VARCHAR(255), szReferencedColumn VARCHAR(255),
+        icolumn INTEGER);
+    """
+
+    values = fixture_values()
+    unknown = [type_name for type_name in types if type_name not in values]
+    if unknown:
+        raise ValueError(f'tipos no válidos: {", ".join(unknown)}')
+    if n_tables < fk_depth or fk_depth < 1:
+        raise ValueError('n_tables debe ser mayor o igual que fk_depth y ' +\
+                         'fk_depth mayor que 0')
+
+    rnd = Random(seed)
+    if isfile(fname):
+        remove(fname)
+    con = sqlite3.connect(fname)
+    try:
+        cur = con.cursor()
+        cur.execute(create1)
+        # las fk_depth primeras tablas forman una cadena de niveles, el
+        #  resto se reparten al azar entre los niveles
+        levels = list(range(fk_depth)) + \
+            [rnd.randrange(fk_depth) for i in range(n_tables - fk_depth)]
+        names = [f'Tabla {i:02d} análisis nivel {level:d}'
+                 for i, level in enumerate(levels)]
+        cols = [f'Medición {j:02d} {type_name.lower()}'
+                for j, type_name in enumerate(types)]
+        for i, (name, level) in enumerate(zip(names, levels)):
+            columns = ['"Id" COUNTER PRIMARY KEY']
+            parent = None
+            if level > 0:
+                parent = rnd.choice([names[j] for j in range(n_tables)
+                                     if levels[j] == level - 1])
+                columns.append('"Código padre" INTEGER')
+                cur.execute(insert1, (f'{parent}{name}', name,
+                                      'Código padre', parent, 'Id', 0))
+            columns += [f'"{col}" {type_name}'
+                        for col, type_name in zip(cols, types)]
+            cur.execute(create.format(name, ', '.join(columns)))
+            rows = []
+            for k in range(1, n_rows + 1):
+                row = [k]
+                if parent is not None:
+                    row.append(rnd.randrange(1, n_rows + 1))
+                for type_name in types:
+                    if rnd.random() < null_ratio:
+                        row.append(None)
+                    else:
+                        row.append(values[type_name](rnd, k))
+                rows.append(row)
+            placeholders = ', '.join(['?' for item in rows[0]]) if rows \
+                else '?'
+            cur.executemany(insert.format(name, placeholders), rows)
+        con.commit()
+    finally:
+        con.close()
+    return {'n_tables': n_tables, 'fk_depth': fk_depth, 'n_rows': n_rows,
+            'types': list(types), 'null_ratio': null_ratio, 'seed': seed}
+
+
+def bench_migrate(fixture: str, dir_out: str, file_ini: str=None,
+                  section: str=None, workers: int=1,
+                  batch_size: int=10000, binary: bool=False) -> dict:
+    """
+    ejecuta las fases de Migrate con la db fixture (ver fixture_create),
+        leída con el backend sqlite, y devuelve un dict con los segundos de
+        cada fase (phases) y las medidas de metrics de cada fase y tabla
+        (metrics)
+    Sin file_ini se miden structure_to_sqlite, structure_to_sql,
+        tables_input_order y export_data_to_csv (ficheros en dir_out);
+        con file_ini y section además se crean las tablas en postgres y se
+        miden copy_csv_files y upsert con copy. ATENCIÓN: las tablas del
+        fixture se borran y se crean de nuevo en la db de file_ini, que
+        debe ser una db de pruebas
+    args
+    workers: workers de export_data_to_csv, copy_csv_files y upsert
+    batch_size: ver Migrate.upsert
+    binary: ficheros y COPY con el formato binario
+    """
+    from os.path import join
+    import sqlite3
+    from db_export import Migrate, sql_files
+    import metrics
+
+    m = Migrate(fixture, dir_out, file_ini, section, 'sqlite')
+    metrics.reset()
+    phases = {}
+
+    def timed(name, function, *args):
+        t = perf_counter()
+        function(*args)
+        phases[name] = perf_counter() - t
+
+    timed('structure_to_sqlite', m.structure_to_sqlite)
+    timed('structure_to_sql', m.structure_to_sql, '')
+    m.con_s = sqlite3.connect(m.constr_sqlite)
+    try:
+        timed('tables_input_order', m.tables_input_order)
+    finally:
+        m.con_s.close()
+        m.con_s = None
+    timed('export_data_to_csv', m.export_data_to_csv, workers, 0, None,
+          batch_size, binary)
+
+    if file_ini is not None:
+        import psycopg2
+
+        params = Migrate.con_params_get(file_ini, section)
+        con = psycopg2.connect(**params)
+        con.autocommit = True
+        try:
+            cur = con.cursor()
+            for key in ('create_tables', 'create_fk'):
+                fname = join(dir_out, f'{m.base_name}{sql_files[key]}')
+                with open(fname, encoding='utf-8') as f:
+                    cur.execute(f.read())
+            timed('copy_csv_files', m.copy_csv_files, workers)
+            timed('upsert', m.upsert, True, True, batch_size, workers,
+                  False, False, binary)
+        finally:
+            con.close()
+    return {'phases': phases, 'metrics': metrics.get_as_list()}
+
+
+def results_dump(fileName: str, results: dict, **info):
+    """
+    añade results, con la fecha, la versión de python y los datos info
+        (por ejemplo los parámetros del fixture), a la lista de ejecuciones
+        del fichero json fileName
+    """
+    from datetime import datetime
+    from os.path import isfile
+    import json
+    import platform
+
+    runs = []
+    if isfile(fileName):
+        with open(fileName, encoding='utf-8') as f:
+            runs = json.load(f)
+    item = {'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.node()}
+    item.update(info)
+    item.update(results)
+    runs.append(item)
+    with open(fileName, 'w', encoding='utf-8') as f:
+        json.dump(runs, f, ensure_ascii=False, indent=1)
+
+
+def results_compare(fileName: str) -> list:
+    """
+    compara los segundos de cada fase de las 2 últimas ejecuciones del
+        fichero fileName; devuelve una lista de (fase, segundos de la
+        penúltima, segundos de la última, cociente última / penúltima)
+    """
+    import json
+
+    with open(fileName, encoding='utf-8') as f:
+        runs = json.load(f)
+    if len(runs) < 2:
+        return []
+    previous, last = runs[-2]['phases'], runs[-1]['phases']
+    return [(phase, previous[phase], last[phase],
+             last[phase] / previous[phase] if previous[phase] else None)
+            for phase in last if phase in previous]
+
+
+if __name__ == "__main__":
+
+    from os.path import join
+    import db_export_parameters as par
+
+    n_rows: int = 200000
+    bench_pg: bool = False
+    bench_formats: bool = True
+    bench_plan: bool = True
+
+    # bench_phases: fases de Migrate con una db sintética, que se crea en
+    # dir_out; los resultados se añaden a dir_out/_benchmarks.json
+    bench_phases: bool = False
+    fixture_tables: int = 6
+    fixture_depth: int = 3
+    fixture_rows: int = 20000
+
+    if bench_formats:
+        if bench_pg:
+            results = bench_copy_formats(n_rows, par.file_ini, par.section)
+        else:
+            results = bench_copy_formats(n_rows)
+        for key, value in results.items():
+            print(f'{key}: {value}')
+
+    if bench_plan:
+        results = bench_row_plan(n_rows)
+        for key, value in results.items():
+            print(f'{key}: {value}')
+
+    if bench_phases:
+        fixture = join(par.dir_out, 'benchmark_fixture.db')
+        info = fixture_create(fixture, fixture_tables, fixture_depth,
+                              fixture_rows)
+        if bench_pg:
+            results = bench_migrate(fixture, par.dir_out, par.file_ini,
+                                    par.section, par.upsert_workers,
+                                    par.batch_size)
+        else:
+            results = bench_migrate(fixture, par.dir_out)
+        for key, value in results['phases'].items():
+            print(f'{key}: {value:.3f} s')
+        fname = join(par.dir_out, '_benchmarks.json')
+        results_dump(fname, results, fixture=info)
+        for phase, previous, last, ratio in results_compare(fname):
+            print(f'{phase}: {previous:.3f} s -> {last:.3f} s ({ratio:.2f})')
@@ -24,29 +24,108 @@ Para leer las foreign keys debes, en ms access:
 
 PARA EL PROGRAMADOR
 Los nombres de las tablas y las columnas de access se pasan a nombres válidos
-    de postgres utilizando la función to_ascii
+    de postgres utilizando la función to_ascii; si 2 nombres access se
+    traducen al mismo nombre postgres el proceso se detiene antes de escribir
+    el ddl o de cargar los datos, ver identifier_collisions
+
+La db access se lee con un lector de source_readers según el argumento
+    backend de Migrate: con el driver odbc de access (pyodbc, solo en
+    windows), con los programas de mdbtools (linux) o una db sqlite que
+    imita a la db access (pruebas)
 
 LIMITACION DEL MODULO EN LA CARGA DE DATOS CON LA FUNCION py_upsert
 Los valores de las claves primarias y de las columnas en las claves foráneas
     se convierten en minúsculas. En la actualidad esto solo funciona bien si
     las claves foráneas implican a una sola columna
 """
-import pyodbc
+from functools import lru_cache
 import sqlite3
 from traceback import format_exc
 import littleLogging as logging
-
-# molde para fichero FILE_COPYFROM metacomando de psql
-copyfrom = ("\copy {} ({}) ",
+import metrics
+import pg_copy_binary
+import source_readers
+import value_adapters
+
+# molde para fichero FILE_COPYFROM metacomando de psql; los ficheros csv se
+# escriben en utf-8
+copyfrom = (r"\copy {} ({}) ",
             "from '{}' ",
-            "with (format csv, header, delimiter ',', encoding 'LATIN1',",
+            "with (format csv, header, delimiter ',', encoding 'UTF8',",
             " force_null ({}))")
 
+# idem para ficheros csv comprimidos, que se leen con from program
+copyfrom_program = (r"\copy {} ({}) ",
+                    "from program '{} \"{}\"' ",
+                    "with (format csv, header, delimiter ',', ",
+                    "encoding 'UTF8', force_null ({}))")
+
+# idem para ficheros con el formato binario de COPY
+copyfrom_binary = (r"\copy {} ({}) ",
+                   "from '{}' ",
+                   "with (format binary)")
+
+copyfrom_binary_program = (r"\copy {} ({}) ",
+                           "from program '{} \"{}\"' ",
+                           "with (format binary)")
+
+# programa que descomprime un fichero csv en la salida estándar según su
+# extensión
+decompress_programs = {'.gz': 'gzip -dc', '.zst': 'zstd -dc'}
+
+# número de filas access que se leen con fetchmany y se escriben en postgres
+# en cada lote
+BATCH_ROWS = 10000
+
+# tamaño aproximado máximo en bytes de un lote de filas: si profile_tables ha
+# medido el ancho medio de las filas de una tabla, sus lotes tienen como
+# máximo BATCH_BYTES / ancho filas, de modo que las tablas con columnas memo
+# o binarias no llenan la memoria
+BATCH_BYTES = 64 * 1024 * 1024
+
+# bytes aproximados de los valores de ancho fijo según su tipo python, para
+# estimar el ancho medio de las filas en profile_tables; los str y bytes
+# cuentan su longitud
+VALUE_BYTES = {'bool': 1, 'int': 8, 'float': 8, 'Decimal': 16, 'date': 4,
+               'datetime': 8}
+
+# número máximo de nombres access traducidos por to_ascii que se guardan
+TO_ASCII_CACHE_SIZE = 8192
+
+# límite de parámetros de una sentencia postgres y tamaño aproximado máximo
+# en bytes de los valores de cada sentencia insert de varias filas
+PG_MAX_PARAMS = 65535
+VALUES_BYTES = 4 * 1024 * 1024
+
+# tipos access de las primary keys de una columna entera por cuyos rangos se
+# pueden leer las tablas grandes con varias conexiones a la vez, ver
+# RangeReader; cada conexión lee RANGES_PER_WORKER rangos de media, de modo
+# que las claves con huecos se reparten mejor entre las conexiones
+RANGE_KEY_TYPES = ('COUNTER', 'INTEGER', 'LONG', 'SHORT', 'SMALLINT', 'BYTE',
+                   'UNSIGNED BYTE')
+RANGES_PER_WORKER = 4
+
+# tipos propuestos por optimize_types: los tipos access de texto de longitud
+# limitada (como máximo VARCHAR_MAX_SIZE caracteres) pasan a varchar(n), los
+# enteros al tipo entero postgres más estrecho según su ancho en access (ver
+# ACCESS_INTEGER_TYPES; LONG pasa a int4 si su tamaño es de hasta 10 cifras)
+# y CURRENCY, un entero de 64 bits con 4 decimales, a CURRENCY_NUMERIC
+VARCHAR_TYPES = ('CHAR', 'VARCHAR', 'TEXT')
+VARCHAR_MAX_SIZE = 255
+ACCESS_INTEGER_TYPES = {'BYTE': 'int2', 'UNSIGNED BYTE': 'int2',
+                        'SMALLINT': 'int2', 'SHORT': 'int2',
+                        'INTEGER': 'int4', 'COUNTER': 'int4', 'LONG': 'int8'}
+PG_INTEGER_RANGES = (('int2', -2 ** 15, 2 ** 15 - 1),
+                     ('int4', -2 ** 31, 2 ** 31 - 1),
+                     ('int8', -2 ** 63, 2 ** 63 - 1))
+CURRENCY_NUMERIC = 'numeric(19,4)'
+
 # nombres de los ficheros sql según contenido {acción: nombre}
 sql_files =  {'create_tables': '_migrate01.sql',
               'upsert_data': '_migrate02.sql',
               'lower_key_data': '_migrate03.sql',
-              'create_fk': '_migrate04.sql'}
+              'create_fk': '_migrate04.sql',
+              'copy_data': '_migrate05.sql'}
 
 
 class Migrate():
@@ -59,7 +138,7 @@ class Migrate():
 
 
     def __init__(self, dbaccess: str, dir_out: str, file_ini: str,
-                 section: str):
+                 section: str, backend: str='pyodbc'):
         """
         args
         dbaccess: ruta y nombre de la db access a migrar
@@ -67,10 +146,13 @@ class Migrate():
         file_ini: fichero con los datos de la conexión a la db postgres
             donde se van a migrar los datos
         section: sección de file_ini con los datos de la conexión
+        backend: forma de leer la db access, ver source_readers.BACKENDS
         propiedades
-        constr_access: cadena de conexión a la db access
-        constr_sqlite: idem a una db sqlite que crea el programa
-        con_a: conexión a la db access
+        dbaccess: ver args
+        backend: ver args
+        constr_sqlite: cadena de conexión a una db sqlite que crea el
+            programa
+        con_a: lector de la db access, ver source_readers
         con_s: conexión a la db sqlite
         dir_out: var args
         base_name: nombre de la db access sin extensión
@@ -83,10 +165,11 @@ class Migrate():
             raise ValueError(f'No existe {dbaccess}')
         if not isdir(dir_out):
             raise ValueError(f'No existe {dir_out}')
+        if backend not in source_readers.BACKENDS:
+            raise ValueError(f'backend no válido: {backend}')
 
-        self.constr_access = \
-        r'DRIVER={Microsoft Access Driver (*.mdb, *.accdb)};' +\
-        f' DBQ={dbaccess};'
+        self.dbaccess = dbaccess
+        self.backend = backend
 
         head, tail = split(dbaccess)
         name, ext = splitext(tail)
@@ -99,21 +182,34 @@ class Migrate():
         self.section = section
 
 
-    def structure_to_sqlite(self):
+    @metrics.phase('structure_to_sqlite')
+    def structure_to_sqlite(self, incremental: bool=False):
         """
         Lee la estructura de la db access y crea 1 fichero sqlite con la
             información de la estructura (no los datos)
+        args
+        incremental: si False se borra el fichero sqlite y se crea de nuevo;
+            si True se mantiene y solo se actualizan las tablas cuya huella
+            (columnas, tipos, tamaños, primary key y foreign keys) ha
+            cambiado desde la ejecución anterior; estas tablas quedan
+            marcadas en la tabla fingerprints y structure_to_sql puede
+            escribir solo su ddl. Las marcas se acumulan entre ejecuciones
+            hasta que structure_to_sql escribe el ddl, y las tablas que ya
+            no existen en la db access quedan marcadas para escribir su
+            DROP TABLE
         """
         from os import remove
-        try:
-            remove(self.constr_sqlite)
-        except OSError:
-            logging.append('No se ha podido borrar {self.constr_sqlite}')
+        if not incremental:
+            try:
+                remove(self.constr_sqlite)
+            except OSError:
+                logging.append(f'No se ha podido borrar {self.constr_sqlite}')
 
         try:
             self.__open_connections()
             self.__create_tables()
-            self.__populate_tables()
+            self.__populate_tables(incremental)
+            self.__check_identifiers()
             print('Se ha creado la db sqlite; para trasladar los cambios ' +\
                   'a postgres debes ejecutar el fichero sql para crear las' +\
                   'nuevas tablas')
@@ -124,9 +220,16 @@ class Migrate():
             self.__close_connections()
 
 
+    def __open_reader(self):
+        """
+        abre un lector de la db access con su propia conexión
+        """
+        return source_readers.open_reader(self.backend, self.dbaccess)
+
+
     def __open_connections(self, odbc: bool=True, sqlite: bool=True):
         if odbc and self.con_a is None:
-            self.con_a = pyodbc.connect(self.constr_access)
+            self.con_a = self.__open_reader()
         if sqlite and self.con_s is None:
             self.con_s = sqlite3.connect(self.constr_sqlite)
 
@@ -181,7 +284,18 @@ class Migrate():
         FOREIGN KEY(referenced_table) REFERENCES tables(name))
         """
 
-        sqls = (create_table1, create_table2, create_table3)
+        create_table4 = \
+        """
+        create table if not exists fingerprints (
+        table_name TEXT,
+        shape TEXT,
+        fingerprint TEXT,
+        changed INTEGER,
+        PRIMARY KEY (table_name),
+        FOREIGN KEY(table_name) REFERENCES tables(name))
+        """
+
+        sqls = (create_table1, create_table2, create_table3, create_table4)
         cur = self.con_s.cursor()
 
         for sql in sqls:
@@ -191,215 +305,385 @@ class Migrate():
             except:
                 msg = format_exc()
                 logging.append(f'Error al ejecutar\n{sql}\n{msg}')
+        Migrate.__create_column_types(self.con_s)
+        Migrate.__create_stats_tables(self.con_s)
+
+
+    @staticmethod
+    def __create_stats_tables(con):
+        """
+        crea, si no existen, las tablas table_stats y column_stats con los
+            datos de profile_tables en la db sqlite con; se crean también
+            al utilizarlas, por si la db sqlite es anterior a profile_tables
+        """
+        create_table1 = \
+        """
+        create table if not exists table_stats (
+        table_name TEXT,
+        nrows INTEGER,
+        rows_read INTEGER,
+        complete INTEGER,
+        avg_row_bytes REAL,
+        profiled TEXT,
+        PRIMARY KEY (table_name),
+        FOREIGN KEY(table_name) REFERENCES tables(name))
+        """
+
+        create_table2 = \
+        """
+        create table if not exists column_stats (
+        table_name TEXT,
+        col_name TEXT,
+        null_fraction REAL,
+        avg_bytes REAL,
+        max_len INTEGER,
+        min_value,
+        max_value,
+        PRIMARY KEY (table_name, col_name),
+        FOREIGN KEY(table_name, col_name) REFERENCES
+            columns(table_name, col_name))
+        """
 
+        con.execute(create_table1)
+        con.execute(create_table2)
+        con.commit()
 
-    def __populate_tables(self):
+
+    @staticmethod
+    def __create_column_types(con):
+        """
+        crea, si no existe, la tabla column_types con los tipos propuestos
+            por optimize_types en la db sqlite con; se crea también al
+            utilizarla, por si la db sqlite es anterior a optimize_types
+        """
+        create_table = \
+        """
+        create table if not exists column_types (
+        table_name TEXT,
+        col_name TEXT,
+        pg_type_name TEXT,
+        reason TEXT,
+        applied INTEGER,
+        PRIMARY KEY (table_name, col_name),
+        FOREIGN KEY(table_name, col_name) REFERENCES
+            columns(table_name, col_name))
+        """
+
+        con.execute(create_table)
+        con.commit()
+
+
+    def __populate_tables(self, incremental: bool=False):
         """
         lee los datos de estructura de self.db_a a través de su conexión
             con_a y los escribe en self.db_s mediante su conexión abierta
             con_s
-        """
-        cur = self.con_a.cursor()
-        tables = [(row.table_name, row.table_type,
-                  self.__primary_key_get(row.table_name, row.table_type))
-                  for row in cur.tables()
-                  if row.table_type in ('TABLE', 'SYSTEM TABLE')]
-        self.__insert_into_tables(tables)
-        self.__insert_into_columns(tables)
-        self.__insert_into_relationships()
+        El catálogo se lee con el menor número posible de llamadas: una
+            llamada a columns para todas las tablas y una a relationships
+            (con pyodbc una select sobre MSysRelationships); solo la primary
+            key necesita una llamada por tabla, el driver odbc no admite
+            otra forma. Los datos se agrupan en python y se graban con
+            executemany en una única transacción
+        Si incremental es True solo se graban las tablas cuya huella ha
+            cambiado, ver structure_to_sqlite; la huella es un hash sha1 de
+            la huella de las columnas y foreign keys (ver __table_shapes) y
+            de las columnas de la primary key
+        """
+        from hashlib import sha1
+
+        tables = [table for table in self.con_a.tables()
+                  if table[1] in ('TABLE', 'SYSTEM TABLE')]
+        columns = self.__columns_get([table[0] for table in tables])
+        relationships = self.__relationships_get()
+        shapes = Migrate.__table_shapes(tables, columns, relationships)
+        if incremental:
+            stored = self.__fingerprints_get()
+        else:
+            stored = {}
+
+        tables1 = []
+        fingerprints = []
+        for table in tables:
+            shape = shapes[table[0]]
+            pk = self.__primary_key_get(table[0], table[1])
+            fingerprint = sha1(f'{shape}{pk}'.encode('utf-8')).hexdigest()
+            if stored.get(table[0]) != fingerprint:
+                tables1.append((table[0], table[1], pk))
+                fingerprints.append((table[0], shape, fingerprint, 1))
+        removed = [name for name, fingerprint in stored.items()
+                   if fingerprint is not None and name not in shapes]
+
+        changed = {table[0] for table in tables1}
+        columns = [row for row in columns if row[0] in changed]
+        relationships = [row for row in relationships if row[0] in changed]
+        self.__insert_structure(tables1, columns, relationships,
+                                fingerprints, removed)
+        if incremental:
+            names = ', '.join([table[0] for table in tables1])
+            if names:
+                logging.append(f'Tablas nuevas o modificadas: {names}')
+            else:
+                logging.append('No hay tablas nuevas o modificadas')
+            if removed:
+                names = ', '.join(removed)
+                logging.append(f'Tablas eliminadas: {names}')
 
 
     def __primary_key_get(self, table_name, table_type):
-        cur = self.con_a.cursor()
         if table_type == 'TABLE':
-            pk_cols = [row[8] for row in cur.statistics(table_name)
-                       if row[5] is not None and
-                       row[5].upper() == 'PRIMARYKEY']
-            return ', '.join(pk_cols)
+            return ', '.join(self.con_a.primary_key(table_name))
         else:
             return ''
 
 
-    def __insert_into_tables(self, tables):
+    def __columns_get(self, table_names: list) -> list:
         """
-        inserta los nombres de las tablas y su tipo en la tabla tables
+        lee con una sola llamada a columns las columnas de todas las tablas
+            y devuelve las de las tablas table_names como una lista de
+            tuplas con los valores de una fila de la tabla columns
         """
-        insert = \
+        d = Migrate.__access_pg_types()
+        table_names = set(table_names)
+        rows = [row for row in self.con_a.columns()
+                if row[0] in table_names]
+        rows.sort(key=lambda row: (row[0], row[5]))
+        columns = []
+        previous_table = None
+        for row in rows:
+            if row[0] != previous_table:
+                previous_table = row[0]
+                i = 0
+            else:
+                i += 1
+            pg_col_type = d.get(row[3], '')
+            columns.append((row[0], row[1], row[2], row[3], row[4],
+                            pg_col_type, i))
+        return columns
+
+
+    def __relationships_get(self) -> list:
         """
-        insert into tables (name, table_type, primary_key) values (?, ?, ?)
+        lee con una sola llamada las columnas de las foreign keys (con
+            pyodbc el contenido de la tabla MSysRelationShips) y devuelve
+            las foreign keys como una lista de tuplas (tabla, columnas,
+            tabla referenciada, columnas referenciadas)
         """
+        from itertools import groupby
 
-        update = \
-        """update tables set table_type=?, primary_key=? where name=?"""
+        relationships = []
+        for rship, cols in groupby(self.con_a.relationships(),
+                                   key=lambda row: row[0]):
+            cols = [row for row in cols]
+            references_table = cols[0][1]
+            references_cols = ', '.join([row1[2] for row1 in cols])
+            referenced_table = cols[0][3]
+            referenced_cols = ', '.join([row1[4] for row1 in cols])
+            relationships.append((references_table, references_cols,
+                                  referenced_table, referenced_cols))
+        return relationships
 
-        cur = self.con_s.cursor()
-        for table in tables:
-            try:
-                cur.execute(insert, table)
-            except:
-                cur.execute(update, (table[1], table[2], table[0]))
-        self.con_s.commit()
 
-
-    def __insert_into_columns(self, tables):
+    @staticmethod
+    def __table_shapes(tables: list, columns: list,
+                       relationships: list) -> dict:
         """
-        inserta las columnas de las tablas en la tabla columns
+        devuelve un dict {tabla: huella de sus columnas y foreign keys}; la
+            huella es un hash sha1 de las columnas con su tipo y tamaño y de
+            las foreign keys de la tabla
         """
-        insert = \
+        from hashlib import sha1
+        from json import dumps
+
+        items = {table[0]: [table[1], [], []] for table in tables}
+        for row in columns:
+            items[row[0]][1].append(row[1:])
+        for row in relationships:
+            if row[0] in items:
+                items[row[0]][2].append(row[1:])
+        shapes = {}
+        for name, item in items.items():
+            item[2].sort()
+            shapes[name] = sha1(dumps(item).encode('utf-8')).hexdigest()
+        return shapes
+
+
+    def __fingerprints_get(self) -> dict:
         """
-        insert into columns
-        (table_name, col_name, type_i, type_name, column_size, pg_type_name,
-        col_number)
-        values (?, ?, ?, ?, ?, ?, ?);
+        devuelve las huellas grabadas en la db sqlite: dict {tabla: huella
+            completa}; la huella es None en las tablas eliminadas
         """
-        update = \
+        select = \
         """
-        update columns set type_i=?, type_name=?, column_size=?,
-            pg_type_name=?, col_number=?
-        where table_name=? and col_name=?;
+        select table_name, fingerprint
+        from fingerprints;
         """
 
-        d = Migrate.__access_pg_types()
-        cur = self.con_a.cursor()
-        cur_s = self.con_s.cursor()
-        try:
-            for table in tables:
-                for i, row in enumerate(cur.columns(table[0])):
-                    if row.type_name in d:
-                        pg_col_type = d[row.type_name]
-                    else:
-                        pg_col_type = ''
-                    try:
-                        cur_s.execute(insert, (table[0], row.column_name,
-                                               row.sql_data_type, row.type_name,
-                                               row.column_size, pg_col_type,
-                                               i))
-                    except:
-                        cur_s.execute(update, (row.sql_data_type, row.type_name,
-                                               row.column_size, pg_col_type, i,
-                                               table[0], row.column_name))
-            self.con_s.commit()
-        except:
-            msg = format_exc()
-            msg1 = ';'.join(table)
-            raise ValueError(f'\nTabla: {msg1}\n{msg}')
+        cur = self.con_s.cursor()
+        cur.execute(select)
+        return {row[0]: row[1] for row in cur.fetchall()}
 
 
-    def __insert_into_relationships(self):
+    def __insert_structure(self, tables: list, columns: list,
+                           relationships: list, fingerprints: list,
+                           removed: list):
         """
-        inserta las foreign keys en relationships
+        graba en la db sqlite las tablas, columnas y foreign keys leídas de
+            la db access en una sola transacción; antes se borra la
+            estructura grabada de las tablas que se graban y de las tablas
+            removed, que ya no existen en la db access, los tipos
+            propuestos por optimize_types y los datos de profile_tables
+            de estas tablas
+        La columna changed de fingerprints vale 1 si el ddl de la tabla está
+            pendiente de escribir, 2 si structure_to_sql ya lo ha escrito y
+            0 si no ha cambiado; solo se ponen a 0 las marcas con valor 2,
+            de modo que los cambios de varias ejecuciones se acumulan. Las
+            tablas removed se graban en fingerprints sin huella para que
+            structure_to_sql escriba su DROP TABLE
         """
-        select = \
+        delete = \
         """
-        SELECT szObject
-        FROM MSysRelationships
-        GROUP BY szObject
-        ORDER BY szObject;
+        delete from {} where {}=?;
         """
 
         insert = \
         """
-        insert into relationships (references_table, references_cols,
-            referenced_table, referenced_cols)
-        values (?, ?, ?, ?);
+        insert or replace into tables (name, table_type, primary_key)
+        values (?, ?, ?);
         """
-        update = \
+
+        insert1 = \
         """
-        update relationships set referenced_table=?, referenced_cols=?
-        where references_table=? and references_cols=?;
+        insert or replace into columns
+        (table_name, col_name, type_i, type_name, column_size, pg_type_name,
+        col_number)
+        values (?, ?, ?, ?, ?, ?, ?);
         """
 
-        func_iter = self.__relationship_get
-        cur = self.con_a.cursor()
-        cur.execute(select)
-        tables = [table for table in cur.fetchall()]
-        cur = self.con_s.cursor()
-        for table in tables:
-            for items in func_iter(table):
-                try:
-                    cur.execute(insert, items)
-                except:
-                    cur.execute(update, (items[2], items[3], items[0],
-                                         items[1]))
-        self.con_s.commit()
-
-
-    def __relationship_get(self, table: str):
+        insert2 = \
         """
-        lee el contenido de la tabla MSysRelationShips y lo devuelve como
-            un iterator
+        insert or replace into relationships (references_table,
+            references_cols, referenced_table, referenced_cols)
+        values (?, ?, ?, ?);
         """
-        select = \
+
+        insert3 = \
         """
-        select szRelationship
-        from MSysRelationships
-        where szObject=?
-        group by szRelationship
-        order by szRelationship
+        insert or replace into fingerprints (table_name, shape, fingerprint,
+            changed)
+        values (?, ?, ?, ?);
         """
 
-        select1 = \
+        reset = "update fingerprints set changed=0 where changed=2;"
+
+        reset1 = \
         """
-        select szObject, szColumn, szReferencedObject, szReferencedColumn
-        from MSysRelationships
-        where szRelationship=?
-        order by icolumn
+        delete from fingerprints where changed=0 and fingerprint is null;
         """
 
-        cur = self.con_a.cursor()
-        cur.execute(select, table)
-        rships = [row for row in cur.fetchall()]
-        for i, rship in enumerate(rships):
-            cur.execute(select1, (rship[0],))
-            cols = [row for row in cur.fetchall()]
-            references_table = cols[0][0]
-            references_cols = ', '.join([row1[1] for row1 in cols])
-            referenced_table = cols[0][2]
-            referenced_cols = ', '.join([row1[3] for row1 in cols])
-            yield(references_table, references_cols, referenced_table,
-                  referenced_cols)
+        names = [(table[0],) for table in tables] + \
+            [(name,) for name in removed]
+        cur = self.con_s.cursor()
+        try:
+            cur.execute(reset)
+            cur.execute(reset1)
+            for table_name, col_name in (('column_types', 'table_name'),
+                                         ('column_stats', 'table_name'),
+                                         ('table_stats', 'table_name'),
+                                         ('columns', 'table_name'),
+                                         ('relationships',
+                                          'references_table'),
+                                         ('fingerprints', 'table_name'),
+                                         ('tables', 'name')):
+                cur.executemany(delete.format(table_name, col_name), names)
+            cur.executemany(insert, tables)
+            cur.executemany(insert1, columns)
+            cur.executemany(insert2, relationships)
+            cur.executemany(insert3, fingerprints)
+            cur.executemany(insert3, [(name, None, None, 1)
+                                      for name in removed])
+            self.con_s.commit()
+        except:
+            self.con_s.rollback()
+            raise
 
 
-    def structure_to_sql(self, schema: str):
+    @metrics.phase('structure_to_sql')
+    def structure_to_sql(self, schema: str, only_changed: bool=False,
+                         deferred_keys: bool=False, unlogged: bool=False,
+                         optimized_types: bool=False):
         """
         escribe 2 ficheros sql con las instrucciones para crear las tablas
         schema: nombre del esquema; si '' las tablas se crean es el esquema
             public
+        only_changed: si True solo se escriben las tablas marcadas como
+            nuevas o modificadas por structure_to_sqlite desde la última
+            vez que se ejecutó structure_to_sql y las foreign keys que las
+            referencian o que son referenciadas por ellas
+        deferred_keys: si True las tablas se crean sin primary key, de modo
+            que la carga masiva no tiene que mantener los índices; las
+            primary keys se crean en el fichero create_fk, que se ejecuta
+            después de la carga, antes que las foreign keys, que se añaden
+            NOT VALID y se validan después con VALIDATE CONSTRAINT. Las
+            tablas sin primary key no admiten upsert: los datos se cargan
+            con write_copyfrom o copy_csv_files. Las claves se pueden crear
+            también con create_keys, que construye los índices a la vez
+        unlogged: si True las tablas se crean UNLOGGED (sin escribir el
+            WAL durante la carga) y el fichero create_fk empieza con
+            SET LOGGED de cada tabla
+        optimized_types: si True las columnas se crean con los tipos
+            propuestos por optimize_types, que a partir de entonces utilizan
+            también upsert y export_data_to_csv (ver __pg_types); si False
+            con los tipos pg_type_name de la tabla columns
         Los nombres de las tablas se cambian a ascci en minúscula
+        Se escribe DROP TABLE de las tablas eliminadas de la db access y,
+            una vez escritos los ficheros, las tablas marcadas en
+            fingerprints quedan como escritas (ver __insert_structure)
         """
 
         select = \
         """
         select name, primary_key
         from tables
-        where table_type = 'TABLE'
+        where table_type = 'TABLE' {}
         order by name
         """
 
+        changed = \
+        """
+        and name in (select table_name from fingerprints where changed>0)
+        """
+
         select1 = \
         """
-        select col_name, column_size, pg_type_name
-        from columns
-        where table_name=?
-        order by col_number;
+        select c.col_name, c.column_size, {}
+        from columns c
+            left join column_types ct on c.table_name = ct.table_name and
+                c.col_name = ct.col_name
+        where c.table_name=?
+        order by c.col_number;
         """
 
+        update = "update column_types set applied=? where table_name=?;"
+
         select2 = \
         """
-        select references_table, references_cols, referenced_table,
-            referenced_cols
-        from relationships
-        left join tables on relationships.references_table=tables.name
-        where tables.table_type = 'TABLE'
-        order by references_table;
+        select table_name
+        from fingerprints
+        where changed>0 and fingerprint is null
+        order by table_name;
         """
 
+        update1 = "update fingerprints set changed=2 where changed=1;"
+
         from os.path import join
 
         headers = 'BEGIN;\nSET CLIENT_ENCODING TO UTF8;\n' +\
                   'SET STANDARD_CONFORMING_STRINGS TO ON;\n'
         stm = 'DROP TABLE IF EXISTS {} CASCADE;\n'
-        stm1 = 'CREATE TABLE {} (\n'
+        if unlogged:
+            stm1 = 'CREATE UNLOGGED TABLE {} (\n'
+        else:
+            stm1 = 'CREATE TABLE {} (\n'
         stm2 = 'PRIMARY KEY ({}));\n'
         drop_constraint = 'ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}' +\
                           ' CASCADE;\n'
@@ -414,18 +698,37 @@ class Migrate():
         else:
             myschema = schema.strip().lower()
 
+        if only_changed:
+            select = select.format(changed)
+        else:
+            select = select.format('')
+        if optimized_types:
+            select1 = select1.format('coalesce(ct.pg_type_name, ' +\
+                                     'c.pg_type_name)')
+        else:
+            select1 = select1.format('c.pg_type_name')
+
         try:
             self.__open_connections()
+            self.__check_identifiers()
             fo = join(self.dir_out, f'{self.base_name}' +\
                       f'{sql_files["create_tables"]}')
+            Migrate.__create_column_types(self.con_s)
             cur = self.con_s.cursor()
             cur.execute(select)
             tables = [table for table in cur.fetchall()]
+            cur.execute(select2)
+            removed = [row[0] for row in cur.fetchall()]
             with open(fo, 'w') as f:
                 f.write(f'{headers}\n')
                 if myschema:
                     create_schema = create_schema.format(myschema)
                     f.write('{create_schema}\n')
+                for name in removed:
+                    mytable = Migrate.to_ascii(name)
+                    if myschema:
+                        mytable = f'{myschema}.{mytable}'
+                    f.write(stm.format(mytable))
                 for table in tables:
                     pg_table_name = self.to_ascii(table[0])
                     f.write(stm.format(pg_table_name))
@@ -435,7 +738,7 @@ class Migrate():
                             for row in cur.fetchall()]
                     columns = ',\n'.join(rows)
                     f.write(f'{columns}')
-                    if table[1]:
+                    if table[1] and not deferred_keys:
                         f.write(',\n')
                         pk_columns = Migrate.pk_columns(table[1])
                         f.write(stm2.format(pk_columns))
@@ -443,23 +746,38 @@ class Migrate():
                         f.write('\n);')
                     f.write('\n')
                 f.write('COMMIT;\n')
+            cur.executemany(update, [(int(optimized_types), table[0])
+                                     for table in tables])
+            self.con_s.commit()
 
             fo = join(self.dir_out, f'{self.base_name}' + \
                       f'{sql_files["create_fk"]}')
             with open(fo, 'w') as f:
                 f.write(f'{headers}\n')
 
-                cur.execute(select2)
-                for row in cur.fetchall():
-                    f.write(drop_constraint.format(Migrate.to_ascii(row[0]),
-                                                   Migrate.fk_name(row[0],
-                                                                   row[1])))
-                    f.write(add_constraint.format(Migrate.to_ascii(row[0]),
-                                                  Migrate.fk_name(row[0],
-                                                                  row[1]),
-                                                  Migrate.pk_columns(row[1]),
-                                                  Migrate.pk_columns(row[2]),
-                                                  Migrate.pk_columns(row[3])))
+                if deferred_keys or unlogged:
+                    tables_stms, fks = \
+                        self.__key_statements(tables, only_changed,
+                                              deferred_keys, unlogged)
+                    for mytable, stms in tables_stms:
+                        f.write(''.join(stms))
+                    if fks:
+                        f.write('\n')
+                    for fk, stms, validate in fks:
+                        f.write(''.join(stms))
+                    for fk, stms, validate in fks:
+                        f.write(validate)
+                else:
+                    for row in self.__relationships_rows(only_changed):
+                        f.write(drop_constraint.format(
+                            Migrate.to_ascii(row[0]),
+                            Migrate.fk_name(row[0], row[1])))
+                        f.write(add_constraint.format(
+                            Migrate.to_ascii(row[0]),
+                            Migrate.fk_name(row[0], row[1]),
+                            Migrate.pk_columns(row[1]),
+                            Migrate.pk_columns(row[2]),
+                            Migrate.pk_columns(row[3])))
 
                 if myschema:
                     f.write('\n')
@@ -471,6 +789,9 @@ class Migrate():
 
                 f.write('\nCOMMIT;\n')
 
+            cur.execute(update1)
+            self.con_s.commit()
+
         except:
             msg = format_exc()
             logging.append(msg)
@@ -478,374 +799,2325 @@ class Migrate():
             self.__close_connections()
 
 
-    @staticmethod
-    def to_ascii(name: str):
+    def __relationships_rows(self, only_changed: bool=False) -> list:
         """
-        cambia name a un str con caracteres ascii, alguna sustitución
-            adicional y minúscula
+        devuelve las foreign keys de las tablas de tipo TABLE: lista de
+            (references_table, references_cols, referenced_table,
+            referenced_cols); only_changed ver structure_to_sql
         """
-        from unidecode import unidecode
-        replacement_rules = ((' ', '_'), ('-', '_'))
-        name = name.strip()
-        if name[0].isdigit():
-            name = 'd' + name
-        for item in replacement_rules:
-            name = name.replace(item[0], item[1])
-        return unidecode(unidecode(name)).lower()
-
-
-    @staticmethod
-    def pk_columns(pk_cols_str: str) -> str:
+        select = \
         """
-        Sea pk_cols un string formado por una serie de columnas separadas
-            por comas; la función forma una lista de columnas, les aplica la
-            función to_ascii y forma un string con los nuevos nombres de
-            columnas separados por comas
+        select references_table, references_cols, referenced_table,
+            referenced_cols
+        from relationships
+        left join tables on relationships.references_table=tables.name
+        where tables.table_type = 'TABLE' {}
+        order by references_table;
         """
-        pk_columns = pk_cols_str.split(',')
-        return ', '.join([Migrate.to_ascii(col) for col in pk_columns])
 
-
-    @staticmethod
-    def fk_name(table: str, cols: str) -> str:
+        changed = \
         """
-        devuelve el nombre de una foreign key
+        and (references_table in
+            (select table_name from fingerprints where changed>0)
+        or referenced_table in
+            (select table_name from fingerprints where changed>0))
         """
-        mytable = Migrate.to_ascii(table)
-        columns = cols.split(',')
-        columns = '_'.join([Migrate.to_ascii(col) for col in columns])
-        return f'{mytable}_{columns}_fkeys'
+
+        if only_changed:
+            select = select.format(changed)
+        else:
+            select = select.format('')
+        cur = self.con_s.cursor()
+        cur.execute(select)
+        return cur.fetchall()
 
 
-    def export_data_to_csv(self):
+    def __key_statements(self, tables: list, only_changed: bool=False,
+                         primary_keys: bool=True,
+                         unlogged: bool=False) -> tuple:
         """
-        exporta los datos de la db access to csv
+        sentencias para crear las claves una vez cargados los datos;
+            devuelve (tables_stms, fks)
+        tables_stms: lista de (tabla postgres, sentencias de la tabla): SET
+            LOGGED si unlogged y la primary key si primary_keys; las
+            sentencias de tablas distintas se pueden ejecutar a la vez
+        fks: lista de (nombre de la foreign key, sentencias que la borran y
+            la añaden NOT VALID, sentencia VALIDATE CONSTRAINT)
+        args
+        tables: lista de (tabla access, primary key)
+        only_changed: ver structure_to_sql
         """
+        set_logged = 'ALTER TABLE {} SET LOGGED;\n'
+        drop_constraint = 'ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}' +\
+                          ' CASCADE;\n'
+        add_pk = 'ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY ({});\n'
+        add_fk = 'ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY ({})' +\
+        ' REFERENCES {} ({}) ON UPDATE CASCADE NOT VALID;\n'
+        validate = 'ALTER TABLE {} VALIDATE CONSTRAINT {};\n'
+
+        tables_stms = []
+        for table in tables:
+            mytable = Migrate.to_ascii(table[0])
+            stms = []
+            if unlogged:
+                stms.append(set_logged.format(mytable))
+            if primary_keys and table[1]:
+                pk_name = f'{mytable}_pkey'
+                stms.append(drop_constraint.format(mytable, pk_name))
+                stms.append(add_pk.format(mytable, pk_name,
+                                          Migrate.pk_columns(table[1])))
+            if stms:
+                tables_stms.append((mytable, stms))
+
+        fks = []
+        for row in self.__relationships_rows(only_changed):
+            mytable = Migrate.to_ascii(row[0])
+            fk = Migrate.fk_name(row[0], row[1])
+            stms = [drop_constraint.format(mytable, fk),
+                    add_fk.format(mytable, fk, Migrate.pk_columns(row[1]),
+                                  Migrate.pk_columns(row[2]),
+                                  Migrate.pk_columns(row[3]))]
+            fks.append((fk, stms, validate.format(mytable, fk)))
+        return tables_stms, fks
+
+
+    @metrics.phase('create_keys')
+    def create_keys(self, workers: int=1, only_changed: bool=False,
+                    unlogged: bool=False, maintenance_work_mem: str=None):
+        """
+        crea en postgres las primary keys y las foreign keys de las tablas
+            creadas con structure_to_sql y deferred_keys True, una vez
+            cargados los datos. Ejecuta las sentencias del fichero create_fk
+            de ese perfil con workers conexiones:
+            1. SET LOGGED si unlogged y la primary key de cada tabla; los
+                índices de tablas distintas se construyen a la vez
+            2. se añaden las foreign keys NOT VALID, que no leen las tablas,
+                una a una porque bloquean las 2 tablas implicadas
+            3. se validan las foreign keys a la vez con VALIDATE CONSTRAINT,
+                que no impide escribir en las tablas
+            Cada sentencia se ejecuta en su propia transacción; si falla se
+            anota en el log y se continúa con las demás
+        args
+        workers: número de conexiones a postgres
+        only_changed: ver structure_to_sql
+        unlogged: ver structure_to_sql
+        maintenance_work_mem: si no es None valor de maintenance_work_mem
+            en las sesiones (ej. '1GB'); acelera la construcción de los
+            índices
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        import threading
+        import psycopg2
+
+        if workers < 1:
+            raise ValueError('workers debe ser mayor que 0')
+
         select = \
         """
-        select name from tables where table_type='TABLE' order by name;
+        select name, primary_key
+        from tables
+        where table_type = 'TABLE' {}
+        order by name
         """
 
-        select1 = \
+        changed = \
         """
-        select * from "{}";
+        and name in (select table_name from fingerprints where changed>0)
         """
-        import csv
-        from os.path import join
+
+        params = Migrate.con_params_get(self.file_ini, self.section)
+        local = threading.local()
+        lock = threading.Lock()
+        connections = []
+
+        def execute(item):
+            name, stms = item
+            if not hasattr(local, 'con_pg'):
+                con_pg = psycopg2.connect(**params)
+                with lock:
+                    connections.append(con_pg)
+                if maintenance_work_mem:
+                    con_pg.cursor().execute(
+                        "select set_config('maintenance_work_mem', %s, " +\
+                        "false);", (maintenance_work_mem,))
+                    con_pg.commit()
+                local.con_pg = con_pg
+            try:
+                with metrics.table('create_keys', name) as tm:
+                    with tm.stage('write'):
+                        cur_pg = local.con_pg.cursor()
+                        for stm in stms:
+                            cur_pg.execute(stm)
+                        local.con_pg.commit()
+            except psycopg2.Error as er:
+                local.con_pg.rollback()
+                msg = format_exc()
+                logging.append(f'{name}, {er.pgcode}: ' +\
+                               f'{er.diag.message_primary}\n{msg}')
+            except:
+                local.con_pg.rollback()
+                msg = format_exc()
+                logging.append(f'{name}\n{msg}')
 
         try:
-            self.__open_connections()
+            self.__open_connections(odbc=False, sqlite=True)
+            if only_changed:
+                select = select.format(changed)
+            else:
+                select = select.format('')
             cur = self.con_s.cursor()
             cur.execute(select)
-            tables = [table[0] for table in cur.fetchall()]
-
-            cur = self.con_a.cursor()
-            for table in tables:
-                fname = join(self.dir_out, f'{table}.csv')
-                column_names = [row.column_name for row in cur.columns(table)]
-                try:
-                    cur.execute(select1.format(table))
-                except:
-                    msg = format_exc()
-                    logging.append(f'tabla {table}\n{msg}')
-
-                with open(fname, 'w', encoding='utf-8') as csvfile:
-                    writer = csv.writer(csvfile,
-                                        delimiter=',',
-                                        quotechar='"',
-                                        quoting=csv.QUOTE_NONNUMERIC,
-                                        lineterminator='\n')
-                    writer.writerow(column_names)
-                    for row in cur:
-                        Migrate.__strip_str(row)
-                        writer.writerow(row)
-
+            tables = [table for table in cur.fetchall()]
+            tables_stms, fks = self.__key_statements(tables, only_changed,
+                                                     True, unlogged)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(execute, tables_stms))
+                for fk, stms, validate in fks:
+                    execute((fk, stms))
+                list(executor.map(execute,
+                                  [(fk, [validate])
+                                   for fk, stms, validate in fks]))
         except:
             msg = format_exc()
             logging.append(msg)
         finally:
             self.__close_connections()
+            for con in connections:
+                con.close()
 
 
-    def upsert(self, upsert_py: bool=True):
+    @metrics.phase('optimize_types')
+    def optimize_types(self, sample_rows: int=0):
         """
-        Inserta nuevos registros o actualiza los existentes en la db postgres
-            leyendo directamente los datos de la db access
+        propone para cada columna un tipo postgres más ajustado que el de
+            __access_pg_types, lo graba en la tabla column_types de la db
+            sqlite y escribe en dir_out el informe _tipos_columnas.csv con
+            los tipos de todas las columnas para revisarlos; los tipos
+            propuestos no se utilizan hasta que se ejecuta structure_to_sql
+            con optimized_types True
+        args
+        sample_rows: si es mayor que 0 se leen como máximo sample_rows filas
+            de cada tabla y el informe incluye los valores mínimo y máximo,
+            la longitud y la escala máximas de cada columna; los enteros
+            cuyos valores no caben en el tipo de su ancho en access pasan a
+            un tipo más ancho y, si se ha leído la tabla completa, los
+            enteros que no son claves ni COUNTER pasan al tipo entero más
+            estrecho que admite sus valores; los NUMERIC pasan a
+            numeric(p,s) con la precisión y la escala de access, ampliadas
+            si los valores leídos no caben
+        Sin leer los datos se utiliza el column_size de la tabla columns:
+            los textos de hasta VARCHAR_MAX_SIZE caracteres pasan a
+            varchar(column_size), los enteros al tipo más estrecho de su
+            ancho en access (SHORT int2, INTEGER int4, LONG int4 si su
+            tamaño es de hasta 10 cifras e int8 si no) y CURRENCY a
+            CURRENCY_NUMERIC. Los memo (LONGCHAR) se mantienen como varchar
+            sin longitud
         """
+        import csv
         from os.path import join
-        import psycopg2
 
-        FILE = '_tablas_ordenadas_insertar.txt'
+        FILE = '_tipos_columnas.csv'
 
-        select1 = \
+        select = \
         """
-        select * from "{}";
+        select c.table_name, c.col_name, c.type_name, c.column_size,
+            c.pg_type_name
+        from columns c join tables t on c.table_name = t.name
+        where t.table_type = 'TABLE'
+        order by c.table_name, c.col_number;
         """
 
-        insert = "insert into {} ({}) values ({});"
+        select1 = \
+        """
+        select name, primary_key
+        from tables
+        where table_type = 'TABLE';
+        """
 
-        upsert = \
-        "insert into {} ({}) values ({}) on conflict ({}) do " +\
-        "update set {};"
+        select2 = \
+        """
+        select references_table, references_cols, referenced_table,
+            referenced_cols
+        from relationships;
+        """
 
-        upsert1 = \
-        "insert into {} ({}) values ({}) on conflict ({}) do nothing;"
+        insert = \
+        """
+        insert into column_types (table_name, col_name, pg_type_name, reason,
+            applied)
+        values (?, ?, ?, ?, 0);
+        """
 
-        if not upsert_py:
-            print('No se hace nada, upsert_py tiene valor False')
-            return
+        if sample_rows < 0:
+            raise ValueError('sample_rows no puede ser negativo')
 
         try:
-            con_pg = None
-            mytable = ''
-            params = Migrate.con_params_get(self.file_ini, self.section)
-            con_pg = psycopg2.connect(**params)
-            cur_pg = con_pg.cursor()
-
-            self.__open_connections()
+            self.__open_connections(odbc=sample_rows > 0)
+            Migrate.__create_column_types(self.con_s)
             cur = self.con_s.cursor()
-            tables = self.tables_input_order()
-            with open(join(self.dir_out, FILE), 'w') as f:
-                for table in tables:
-                    f.write(f'{table[0]}\n')
-
-            cur = self.con_a.cursor()
-            for table in tables:
-                mytable = Migrate.to_ascii(table[0])
-                print(mytable)
-                cols = [Migrate.to_ascii(row.column_name)
-                        for row in cur.columns(table[0])]
-
-                cols_str = ', '.join(cols)
-                placeholders = ', '.join(['%s' for col in cols])
-                if table[1]:
-                    pk_str = Migrate.primary_key_as_pg(table[1])
-                    cols_2_update_str = Migrate.cols_to_update(table[1], cols)
-                    if cols_2_update_str:
-                        insert0 = upsert.format(mytable, cols_str,
-                                                placeholders, pk_str,
-                                                cols_2_update_str)
-                        on_conflict_update = True
-                    else:
-                        insert0 = upsert1.format(mytable, cols_str,
-                                                 placeholders, pk_str)
-                        on_conflict_update = False
-                else:
-                    insert0 = insert.format(mytable, cols_str, placeholders)
-                cur.execute(select1.format(table[0]))
-                for i, row in enumerate(cur.fetchall()):
-                    Migrate.__strip_str(row)
-                    if table[1]:
-                        uvalues = Migrate.upsert_values(table[1], cols, row,
-                                                        on_conflict_update)
-                    else:
-                        uvalues = row
-                    cur_pg.execute(insert0, uvalues)
+            cur.execute(select1)
+            keys = set()
+            for table, pkeys in cur.fetchall():
+                for col in pkeys.split(','):
+                    keys.add((table, col.strip()))
+            cur.execute(select2)
+            for row in cur.fetchall():
+                for table, cols in ((row[0], row[1]), (row[2], row[3])):
+                    for col in cols.split(','):
+                        keys.add((table, col.strip()))
+            cur.execute(select)
+            columns = cur.fetchall()
+
+            stats = {}
+            scales = {}
+            if sample_rows > 0:
+                for table in sorted({row[0] for row in columns}):
+                    stats[table] = Migrate.__profile_columns(
+                        self.con_a, table, sample_rows)
+                    for row in self.con_a.columns(table):
+                        scales[(table, row[1])] = row[6]
+
+            report = []
+            proposals = []
+            for table, col, type_name, column_size, pg_type in columns:
+                nrows, complete, col_stats = stats.get(table, (0, False, {}))
+                item = col_stats.get(col)
+                new_type, reason = Migrate.optimized_type(
+                    type_name, column_size, pg_type, item,
+                    (table, col) in keys, complete, scales.get((table, col)))
+                if new_type != pg_type:
+                    proposals.append((table, col, new_type, reason))
+                if item is None:
+                    item = {}
+                report.append([table, col, type_name, column_size, pg_type,
+                               new_type, reason, nrows,
+                               int(complete) if sample_rows > 0 else '',
+                               item.get('min', ''), item.get('max', ''),
+                               item.get('max_len', ''),
+                               item.get('scale', '')])
+
+            cur.execute('delete from column_types;')
+            cur.executemany(insert, proposals)
+            self.con_s.commit()
 
-                con_pg.commit()
-        except psycopg2.Error as er:
-            msg = format_exc()
-            msg1 = f'{mytable}, {er.pgcode}: {er.diag.message_primary}\n{msg}'
-            logging.append(msg1)
+            with open(join(self.dir_out, FILE), 'w', newline='',
+                      encoding='utf-8') as f:
+                writer = csv.writer(f, delimiter=',', quotechar='"',
+                                    lineterminator='\n')
+                writer.writerow(['tabla', 'columna', 'tipo_access',
+                                 'column_size', 'tipo_pg', 'tipo_propuesto',
+                                 'motivo', 'filas_leidas', 'tabla_completa',
+                                 'minimo', 'maximo', 'longitud_maxima',
+                                 'escala_maxima'])
+                writer.writerows(report)
+            logging.append(f'{len(proposals):d} columnas de ' +\
+                           f'{len(columns):d} con tipo propuesto, ver {FILE}',
+                           False)
         except:
             msg = format_exc()
             logging.append(msg)
         finally:
             self.__close_connections()
-            if con_pg is not None:
-                con_pg.close()
 
 
     @staticmethod
-    def format_dates(ii: list, row: list):
+    def __profile_columns(cur, table: str, sample_rows: int=0) -> tuple:
+        """
+        lee con el lector cur como máximo sample_rows filas de table (todas
+            si sample_rows es 0) y devuelve (filas leídas, True si se ha
+            leído la tabla completa, dict {columna: dict}) con los valores
+            nulos (nulls) y los bytes aproximados (bytes, ver VALUE_BYTES)
+            de cada columna, la longitud máxima (max_len) de los str y
+            bytes, el mínimo y el máximo (min, max) de los números y las
+            fechas y el número máximo de cifras enteras (digits) y de
+            decimales (scale) de los Decimal
+        """
+        from datetime import date
+        from decimal import Decimal
+
+        column_names = [row[1] for row in cur.columns(table)]
+        source = cur.read(table)
+        stats = [{'nulls': 0, 'bytes': 0} for col in column_names]
+        nrows = 0
+        complete = False
+        while sample_rows <= 0 or nrows < sample_rows:
+            n = BATCH_ROWS
+            if sample_rows > 0:
+                n = min(n, sample_rows - nrows)
+            rows = source.fetchmany(n)
+            if not rows:
+                complete = True
+                break
+            nrows += len(rows)
+            for item, column in zip(stats, zip(*rows)):
+                values = [value for value in column if value is not None]
+                item['nulls'] += len(column) - len(values)
+                if not values:
+                    continue
+                value = values[0]
+                if isinstance(value, (str, bytes, bytearray, memoryview)):
+                    lengths = [len(value) for value in values
+                               if isinstance(value, (str, bytes, bytearray,
+                                                     memoryview))]
+                    item['bytes'] += sum(lengths)
+                    item['max_len'] = max(item.get('max_len', 0),
+                                          max(lengths))
+                    continue
+                item['bytes'] += len(values) * \
+                    VALUE_BYTES.get(type(value).__name__, 8)
+                if isinstance(value, bool):
+                    continue
+                if isinstance(value, (int, float, Decimal, date)):
+                    # una columna con valores de tipos que no se pueden
+                    #  comparar no tiene mínimo ni máximo
+                    try:
+                        item['min'] = min(item.get('min', value),
+                                          min(values))
+                        item['max'] = max(item.get('max', value),
+                                          max(values))
+                    except TypeError:
+                        pass
+                if isinstance(value, Decimal):
+                    for number in values:
+                        if not isinstance(number, Decimal):
+                            number = Decimal(repr(number))
+                        if not number.is_finite():
+                            continue
+                        scale = max(0, -number.as_tuple()[2])
+                        digits = max(0, number.adjusted() + 1)
+                        item['scale'] = max(item.get('scale', 0), scale)
+                        item['digits'] = max(item.get('digits', 0), digits)
+        if not complete and not source.fetchmany(1):
+            complete = True
+        return nrows, complete, dict(zip(column_names, stats))
+
+
+    @metrics.phase('profile_tables')
+    def profile_tables(self, sample_rows: int=0, workers: int=1):
+        """
+        lee los datos de las tablas access y graba en las tablas table_stats
+            y column_stats de la db sqlite el número de filas y el ancho
+            medio aproximado de las filas de cada tabla y, de cada columna,
+            la proporción de nulos, el ancho medio, la longitud máxima de
+            los textos y binarios y el mínimo y el máximo de los números y
+            las fechas (ver __profile_columns)
+        upsert y export_data_to_csv utilizan estos datos: las tablas más
+            grandes se empiezan a cargar antes, el número de filas de cada
+            lote se limita según el ancho de las filas (ver BATCH_BYTES) y
+            no se cuentan las filas de las tablas pequeñas para decidir si
+            se leen por rangos
+        args
+        sample_rows: si es mayor que 0 de cada tabla se leen como máximo sus
+            sample_rows primeras filas, y los datos de las columnas son los
+            de esta muestra; el número de filas de la tabla se cuenta
+            siempre (ver source_readers.SourceReader.count). Si es 0 se
+            leen las tablas completas
+        workers: número de tablas que se leen a la vez, cada una con su
+            propio lector de la db access
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from datetime import date, datetime
+        import threading
+
+        select = \
         """
-        cambia los tipos fecha a yyyy-mm-dd HH:MM:SS válidos para postgres
+        select name
+        from tables
+        where table_type='TABLE'
+        order by name;
         """
-        from datetime import datetime, date
-        for i in ii:
-            if isinstance(row[i], datetime):
-                row[i] = row[i].strftime('%Y-%m-%d %H:%M:%S')
-            elif isinstance(row[i], date):
-                row[i] = row[i].strftime('%Y-%m-%d 00:00:00')
 
-
-    def tables_input_order(self) -> list:
+        insert = \
         """
-        devuelva las tablas en el order de carga de acuerdo a las foreign
-            keys
+        insert or replace into table_stats (table_name, nrows, rows_read,
+            complete, avg_row_bytes, profiled)
+        values (?, ?, ?, ?, ?, ?);
         """
-        MAXITER =25
+
+        insert1 = \
+        """
+        insert or replace into column_stats (table_name, col_name,
+            null_fraction, avg_bytes, max_len, min_value, max_value)
+        values (?, ?, ?, ?, ?, ?, ?);
+        """
+
+        if sample_rows < 0:
+            raise ValueError('sample_rows no puede ser negativo')
+        if workers < 1:
+            raise ValueError('workers debe ser mayor que 0')
+
+        local = threading.local()
+        lock = threading.Lock()
+        connections = []
+
+        def profile(table):
+            if not hasattr(local, 'cur'):
+                reader = self.__open_reader()
+                with lock:
+                    connections.append(reader)
+                local.cur = reader
+            tm = metrics.TableMetrics('profile_tables', table)
+            try:
+                with tm.stage('fetch'):
+                    nread, complete, stats = Migrate.__profile_columns(
+                        local.cur, table, sample_rows)
+                    nrows = nread if complete else local.cur.count(table)
+                tm.add(rows_read=nread)
+                return nrows, nread, complete, stats
+            except:
+                msg = format_exc()
+                logging.append(f'tabla {table}\n{msg}')
+                return None
+            finally:
+                tm.close()
+
+        def sqlite_value(value):
+            if value is None or isinstance(value, (int, float)):
+                return value
+            if isinstance(value, (date, datetime)):
+                return value.isoformat(' ')
+            return str(value)
+
+        try:
+            self.__open_connections(odbc=False, sqlite=True)
+            Migrate.__create_stats_tables(self.con_s)
+            cur = self.con_s.cursor()
+            cur.execute(select)
+            tables = [row[0] for row in cur.fetchall()]
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(profile, tables))
+
+            profiled = datetime.now().isoformat(' ', 'seconds')
+            table_rows = []
+            column_rows = []
+            for table, result in zip(tables, results):
+                if result is None:
+                    continue
+                nrows, nread, complete, stats = result
+                row_bytes = sum([item['bytes'] for item in stats.values()])
+                table_rows.append((table, nrows, nread, int(complete),
+                                   row_bytes / nread if nread else None,
+                                   profiled))
+                for col, item in stats.items():
+                    column_rows.append(
+                        (table, col,
+                         item['nulls'] / nread if nread else None,
+                         item['bytes'] / nread if nread else None,
+                         item.get('max_len'),
+                         sqlite_value(item.get('min')),
+                         sqlite_value(item.get('max'))))
+            names = [(row[0],) for row in table_rows]
+            cur.executemany('delete from column_stats where table_name=?;',
+                            names)
+            cur.executemany(insert, table_rows)
+            cur.executemany(insert1, column_rows)
+            self.con_s.commit()
+            logging.append(f'profile_tables: {len(table_rows):d} tablas ' +\
+                           f'de {len(tables):d}, ' +\
+                           f'{sum([row[1] for row in table_rows]):d} filas',
+                           False)
+        except:
+            msg = format_exc()
+            logging.append(msg)
+        finally:
+            self.__close_connections()
+            for con in connections:
+                con.close()
+
+
+    def __table_stats(self) -> dict:
+        """
+        devuelve los datos de profile_tables de cada tabla: dict {tabla:
+            (número de filas, ancho medio de las filas en bytes)}; vacío si
+            no se ha ejecutado profile_tables
+        """
+        select = \
+        """
+        select table_name, nrows, avg_row_bytes
+        from table_stats;
+        """
+
+        Migrate.__create_stats_tables(self.con_s)
+        cur = self.con_s.cursor()
+        cur.execute(select)
+        return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+
+    @staticmethod
+    def batch_rows(batch_size: int, stats: tuple=None) -> int:
+        """
+        número de filas de los lotes de una tabla: batch_size o, si los
+            datos de profile_tables de la tabla (stats, ver __table_stats)
+            indican que un lote ocuparía más de BATCH_BYTES, menos filas
+        """
+        if stats is None or not stats[1]:
+            return batch_size
+        return max(1, min(batch_size, int(BATCH_BYTES // stats[1])))
+
+
+    @staticmethod
+    def optimized_type(type_name: str, column_size: int, pg_type: str,
+                       stats: dict=None, is_key: bool=False,
+                       complete: bool=True,
+                       decimal_digits: int=None) -> tuple:
+        """
+        devuelve (tipo postgres propuesto, motivo) para una columna, ver
+            optimize_types
+        args
+        type_name, column_size, pg_type: tipo access, tamaño y tipo postgres
+            de la columna en la tabla columns
+        stats: valores leídos de la columna, ver __profile_columns, o None
+        is_key: True si la columna forma parte de una primary o foreign key
+        complete: True si stats son los valores de la tabla completa; si
+            False los valores solo sirven para ensanchar el tipo
+        decimal_digits: número de decimales de la columna en access o None
+            si no se conoce
+        """
+        if type_name in VARCHAR_TYPES:
+            if column_size and 0 < column_size <= VARCHAR_MAX_SIZE:
+                return f'varchar({column_size:d})', 'longitud en access'
+            return 'varchar', 'longitud desconocida'
+        if type_name in ACCESS_INTEGER_TYPES:
+            new_type = ACCESS_INTEGER_TYPES[type_name]
+            reason = 'ancho en access'
+            if new_type == 'int8' and column_size and column_size <= 10:
+                new_type = 'int4'
+            if stats and 'min' in stats:
+                int_types = [item[0] for item in PG_INTEGER_RANGES]
+                fits = [int_type for int_type, low, high in PG_INTEGER_RANGES
+                        if low <= stats['min'] and stats['max'] <= high]
+                if not fits:
+                    return 'numeric', 'valores leídos'
+                if int_types.index(fits[0]) > int_types.index(new_type):
+                    new_type = fits[0]
+                    reason = 'valores leídos'
+                elif fits[0] != new_type and complete and not is_key and \
+                    type_name != 'COUNTER':
+                    new_type = fits[0]
+                    reason = 'valores leídos'
+            return new_type, reason
+        if type_name == 'CURRENCY':
+            return CURRENCY_NUMERIC, 'currency de access'
+        if type_name == 'NUMERIC' and decimal_digits is not None and \
+            column_size:
+            # la escala no se reduce a la de los valores leídos: las filas
+            #  no leídas o las cargas posteriores se redondearían
+            scale = decimal_digits
+            precision = column_size
+            reason = 'precisión y escala en access'
+            if stats and 'digits' in stats:
+                if stats['scale'] > scale:
+                    scale = stats['scale']
+                    reason = 'valores leídos'
+                if stats['digits'] + scale > precision:
+                    precision = stats['digits'] + scale
+                    reason = 'valores leídos'
+            if precision <= 1000:
+                return f'numeric({precision:d},{scale:d})', reason
+        return pg_type, ''
+
+
+    @staticmethod
+    @lru_cache(maxsize=TO_ASCII_CACHE_SIZE)
+    def to_ascii(name: str):
+        """
+        cambia name a un str con caracteres ascii, alguna sustitución
+            adicional y minúscula
+        Cada nombre se traduce una sola vez: el resultado se guarda en una
+            cache lru de TO_ASCII_CACHE_SIZE nombres
+        """
+        from unidecode import unidecode
+        replacement_rules = ((' ', '_'), ('-', '_'))
+        name = name.strip()
+        if name[0].isdigit():
+            name = 'd' + name
+        for item in replacement_rules:
+            name = name.replace(item[0], item[1])
+        return unidecode(name).lower()
+
+
+    def identifier_collisions(self) -> list:
+        """
+        devuelve los nombres de tablas y columnas de la db sqlite de
+            estructura que to_ascii traduce al mismo identificador postgres:
+            lista de (tabla o '' si son nombres de tablas, identificador
+            postgres, lista de nombres access)
+        """
+        select = \
+        """
+        select name
+        from tables
+        where table_type = 'TABLE'
+        order by name;
+        """
+
+        select1 = \
+        """
+        select c.table_name, c.col_name
+        from columns c
+        join tables t on c.table_name = t.name
+        where t.table_type = 'TABLE'
+        order by c.table_name, c.col_number;
+        """
+
+        cur = self.con_s.cursor()
+        names = {}
+        cur.execute(select)
+        for row in cur.fetchall():
+            names.setdefault(('', Migrate.to_ascii(row[0])),
+                             []).append(row[0])
+        cur.execute(select1)
+        for row in cur.fetchall():
+            names.setdefault((row[0], Migrate.to_ascii(row[1])),
+                             []).append(row[1])
+        return [(key[0], key[1], access_names)
+                for key, access_names in names.items()
+                if len(access_names) > 1]
+
+
+    def __check_identifiers(self):
+        """
+        lanza ValueError si hay nombres access que se traducen al mismo
+            identificador postgres, ver identifier_collisions
+        """
+        collisions = self.identifier_collisions()
+        if not collisions:
+            return
+        msgs = []
+        for table, pg_name, access_names in collisions:
+            names = ', '.join(access_names)
+            if table:
+                msgs.append(f'columnas de {table}: {names} -> {pg_name}')
+            else:
+                msgs.append(f'tablas: {names} -> {pg_name}')
+        raise ValueError('Hay nombres access que se traducen al mismo ' +\
+                         'identificador postgres; cámbialos en access\n' +\
+                         '\n'.join(msgs))
+
+
+    @staticmethod
+    def pk_columns(pk_cols_str: str) -> str:
+        """
+        Sea pk_cols un string formado por una serie de columnas separadas
+            por comas; la función forma una lista de columnas, les aplica la
+            función to_ascii y forma un string con los nuevos nombres de
+            columnas separados por comas
+        """
+        pk_columns = pk_cols_str.split(',')
+        return ', '.join([Migrate.to_ascii(col) for col in pk_columns])
+
+
+    @staticmethod
+    def fk_name(table: str, cols: str) -> str:
+        """
+        devuelve el nombre de una foreign key
+        """
+        mytable = Migrate.to_ascii(table)
+        columns = cols.split(',')
+        columns = '_'.join([Migrate.to_ascii(col) for col in columns])
+        return f'{mytable}_{columns}_fkeys'
+
+
+    @metrics.phase('export_data_to_csv')
+    def export_data_to_csv(self, workers: int=1, chunk_rows: int=0,
+                           compression: str=None,
+                           batch_size: int=BATCH_ROWS, binary: bool=False,
+                           lower_keys: bool=False, range_rows: int=0,
+                           range_workers: int=1, tz_policy: str='session'):
+        """
+        exporta los datos de la db access to csv
+        args
+        workers: número de tablas que se exportan a la vez, cada una con su
+            propio lector de la db access
+        chunk_rows: si es mayor que 0 cada tabla se divide en ficheros de
+            como máximo chunk_rows filas, {tabla}_0001.csv, {tabla}_0002.csv...
+            cada uno con su cabecera; si es 0 se escribe un fichero por tabla
+        compression: None, 'gzip' o 'zstd'; si no es None los ficheros se
+            escriben comprimidos con extensión .gz o .zst; zstd requiere el
+            paquete zstandard
+        batch_size: número de filas que se leen de access en cada fetchmany
+        binary: si True en vez de ficheros csv se escriben ficheros .bin con
+            el formato binario de COPY de postgres, codificados con los tipos
+            pg_type_name de la db sqlite (ver pg_copy_binary)
+        lower_keys: si True los valores de las columnas de texto de las
+            primary y foreign keys se escriben en minúsculas, ver upsert
+        range_rows, range_workers: las tablas de más de range_rows filas se
+            leen por rangos de la primary key con range_workers conexiones
+            a la vez, ver upsert; las filas no se escriben en el orden de la
+            clave
+        tz_policy: zona horaria de las fechas access, ver value_adapters;
+            con 'session' las fechas de los ficheros csv se escriben sin
+            zona horaria y las de los ficheros binarios se interpretan en
+            la zona horaria local
+        Si se ha ejecutado profile_tables las tablas más grandes se exportan
+            antes y el tamaño de los lotes se ajusta al ancho de las filas,
+            ver upsert
+        Los valores se escriben con los adaptadores de value_adapters según
+            los pg_type_name de la db sqlite: los bytea en hexadecimal, los
+            numeric con todas sus cifras
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        import threading
+
+        select = \
+        """
+        select name, primary_key
+        from tables
+        where table_type='TABLE'
+        order by name;
+        """
+
+        if workers < 1:
+            raise ValueError('workers debe ser mayor que 0')
+        if chunk_rows < 0:
+            raise ValueError('chunk_rows no puede ser negativo')
+        Migrate.__csv_opener(compression, binary)
+        value_adapters.policy_tz(tz_policy)
+
+        local = threading.local()
+        lock = threading.Lock()
+        connections = []
+
+        def export(table):
+            if not hasattr(local, 'cur'):
+                reader = self.__open_reader()
+                with lock:
+                    connections.append(reader)
+                local.cur = reader
+            try:
+                return self.__export_table(local.cur, table[0], chunk_rows,
+                                           compression, batch_size, binary,
+                                           pg_types.get(table[0]),
+                                           lower.get(Migrate.to_ascii(
+                                               table[0]), ()),
+                                           table[1], range_rows,
+                                           range_workers, tz_policy,
+                                           stats.get(table[0]))
+            except:
+                msg = format_exc()
+                logging.append(f'tabla {table[0]}\n{msg}')
+                return None
+
+        try:
+            self.__open_connections(odbc=False, sqlite=True)
+            cur = self.con_s.cursor()
+            cur.execute(select)
+            tables = [table for table in cur.fetchall()]
+            pg_types = self.__pg_types()
+            stats = self.__table_stats()
+            tables.sort(key=lambda table: -stats.get(table[0], (0,))[0])
+            lower = self.__lower_columns() if lower_keys else {}
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(export, tables)
+                files = {table[0]: files1
+                         for table, files1 in zip(tables, results)
+                         if files1 is not None}
+            self.__csv_files_save(files)
+        except:
+            msg = format_exc()
+            logging.append(msg)
+        finally:
+            self.__close_connections()
+            for con in connections:
+                con.close()
+
+
+    def __csv_files_save(self, files: dict):
+        """
+        graba en la tabla csv_files de la db sqlite los ficheros escritos
+            por export_data_to_csv, {tabla: [(fichero, número de filas)]};
+            se sustituyen los ficheros grabados de esas tablas en
+            exportaciones anteriores
+        """
+        from os.path import basename
 
         create_table = \
         """
-        create table tables (
-        name TEXT,
-        primary_key TEXT,
-        id INTEGER,
-        PRIMARY KEY (name))"""
+        create table if not exists csv_files (
+        table_name TEXT,
+        file_name TEXT,
+        n_rows INTEGER,
+        PRIMARY KEY (file_name),
+        FOREIGN KEY(table_name) REFERENCES tables(name))
+        """
+
+        delete = "delete from csv_files where table_name=?;"
+
+        insert = \
+        """
+        insert or replace into csv_files (table_name, file_name, n_rows)
+        values (?, ?, ?);
+        """
+
+        cur = self.con_s.cursor()
+        try:
+            cur.execute(create_table)
+            cur.executemany(delete, [(table,) for table in files])
+            cur.executemany(insert, [(table, basename(item[0]), item[1])
+                                     for table, files1 in files.items()
+                                     for item in files1])
+            self.con_s.commit()
+        except:
+            self.con_s.rollback()
+            raise
+
+
+    def __csv_files_get(self) -> list:
+        """
+        devuelve los ficheros csv de la última exportación agrupados por
+            niveles de carga (ver tables_load_levels): lista de niveles, cada
+            nivel es una lista de (tabla en postgres, columnas en postgres
+            separadas por comas, fichero csv) con los ficheros de las tablas
+            del nivel
+        """
+        select = \
+        """
+        select file_name
+        from csv_files
+        where table_name=?
+        order by file_name;
+        """
+
+        select1 = \
+        """
+        select col_name
+        from columns
+        where table_name=?
+        order by col_number;
+        """
+
+        cur = self.con_s.cursor()
+        levels = []
+        for level in self.tables_load_levels():
+            items = []
+            for table in level:
+                cur.execute(select1, (table[0],))
+                cols_str = ', '.join([Migrate.to_ascii(row[0])
+                                      for row in cur.fetchall()])
+                cur.execute(select, (table[0],))
+                for row in cur.fetchall():
+                    items.append((Migrate.to_ascii(table[0]), cols_str,
+                                  row[0]))
+            levels.append(items)
+        return levels
+
+
+    def write_copyfrom(self):
+        """
+        escribe un script psql con un metacomando \\copy por cada fichero
+            csv o binario escrito por export_data_to_csv, en el orden de
+            carga de las tablas de acuerdo a las foreign keys; los ficheros
+            comprimidos se leen con from program. Las rutas de los ficheros
+            son relativas, psql debe ejecutarse desde el directorio donde
+            están los ficheros csv
+        """
+        from os.path import join, splitext
+
+        stm = ''.join(copyfrom)
+        stm1 = ''.join(copyfrom_program)
+        stm2 = ''.join(copyfrom_binary)
+        stm3 = ''.join(copyfrom_binary_program)
+
+        try:
+            self.__open_connections(odbc=False, sqlite=True)
+            levels = self.__csv_files_get()
+            fo = join(self.dir_out, f'{self.base_name}' +\
+                      f'{sql_files["copy_data"]}')
+            with open(fo, 'w', encoding='utf-8') as f:
+                f.write('\\set ON_ERROR_STOP on\n')
+                f.write('BEGIN;\n\n')
+                for items in levels:
+                    for mytable, cols_str, file_name in items:
+                        csv_file = file_name.replace("'", "''")
+                        ext = splitext(file_name)[1]
+                        binary = Migrate.__is_binary_file(file_name)
+                        if ext in decompress_programs and binary:
+                            f.write(stm3.format(mytable, cols_str,
+                                                decompress_programs[ext],
+                                                csv_file))
+                        elif ext in decompress_programs:
+                            f.write(stm1.format(mytable, cols_str,
+                                                decompress_programs[ext],
+                                                csv_file, cols_str))
+                        elif binary:
+                            f.write(stm2.format(mytable, cols_str, csv_file))
+                        else:
+                            f.write(stm.format(mytable, cols_str, csv_file,
+                                               cols_str))
+                        f.write('\n')
+                f.write('\nCOMMIT;\n')
+        except:
+            msg = format_exc()
+            logging.append(msg)
+        finally:
+            self.__close_connections()
+
+
+    @metrics.phase('copy_csv_files')
+    def copy_csv_files(self, workers: int=1):
+        """
+        carga en postgres los ficheros csv escritos por export_data_to_csv
+            con COPY ... FROM STDIN, equivalente a ejecutar el script de
+            write_copyfrom. Los ficheros de las tablas de un mismo nivel de
+            carga se copian a la vez con workers conexiones; cada fichero se
+            copia en su propia transacción. Si un fichero no se puede cargar
+            se anota el error en el log y se continúa con los demás; al
+            terminar se anotan los ficheros que no se han cargado
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from os.path import join
+        import threading
+        import psycopg2
+
+        copy = \
+        "copy {} ({}) from stdin with (format csv, header, " +\
+        "delimiter ',', encoding 'UTF8', force_null ({}));"
+
+        copy_binary = "copy {} ({}) from stdin with (format binary);"
+
+        if workers < 1:
+            raise ValueError('workers debe ser mayor que 0')
+
+        params = Migrate.con_params_get(self.file_ini, self.section)
+        local = threading.local()
+        lock = threading.Lock()
+        connections = []
+
+        def copy_file(item):
+            """
+            devuelve True si se ha cargado el fichero
+            """
+            mytable, cols_str, file_name = item
+            if not hasattr(local, 'con_pg'):
+                con_pg = psycopg2.connect(**params)
+                with lock:
+                    connections.append(con_pg)
+                local.con_pg = con_pg
+            logging.append(file_name)
+            try:
+                if Migrate.__is_binary_file(file_name):
+                    sql = copy_binary.format(mytable, cols_str)
+                else:
+                    sql = copy.format(mytable, cols_str, cols_str)
+                with Migrate.__csv_reader(join(self.dir_out,
+                                               file_name)) as f:
+                    cur_pg = local.con_pg.cursor()
+                    cur_pg.copy_expert(sql, f)
+                local.con_pg.commit()
+                return True
+            except psycopg2.Error as er:
+                local.con_pg.rollback()
+                msg = format_exc()
+                logging.append(f'{file_name}, {er.pgcode}: ' +\
+                               f'{er.diag.message_primary}\n{msg}')
+            except:
+                local.con_pg.rollback()
+                msg = format_exc()
+                logging.append(f'{file_name}\n{msg}')
+            return False
+
+        try:
+            self.__open_connections(odbc=False, sqlite=True)
+            levels = self.__csv_files_get()
+            failed = []
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for items in levels:
+                    # list obliga a esperar al nivel antes de seguir
+                    results = list(executor.map(copy_file, items))
+                    failed += [item[2] for item, ok in zip(items, results)
+                               if not ok]
+            if failed:
+                logging.append('No se han podido cargar los ficheros ' +\
+                               f'siguientes: {", ".join(failed)}')
+        except psycopg2.Error as er:
+            msg = format_exc()
+            msg1 = f'{er.pgcode}: {er.diag.message_primary}\n{msg}'
+            logging.append(msg1)
+        except:
+            msg = format_exc()
+            logging.append(msg)
+        finally:
+            self.__close_connections()
+            for con in connections:
+                con.close()
+
+
+    @staticmethod
+    def __is_binary_file(fname: str) -> bool:
+        """
+        True si fname es un fichero con el formato binario de COPY
+        """
+        for ext in decompress_programs:
+            if fname.endswith(ext):
+                fname = fname[:-len(ext)]
+        return fname.endswith('.bin')
+
+
+    @staticmethod
+    def __csv_reader(fname: str):
+        """
+        abre un fichero csv, comprimido o no según su extensión, en modo
+            binario para lectura
+        """
+        if fname.endswith('.gz'):
+            import gzip
+            return gzip.open(fname, 'rb')
+        elif fname.endswith('.zst'):
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError('La lectura de ficheros zstd requiere el ' +\
+                                 'paquete zstandard')
+            return zstandard.open(fname, 'rb')
+        return open(fname, 'rb')
+
+
+    def __export_table(self, cur, table: str, chunk_rows: int,
+                       compression: str, batch_size: int,
+                       binary: bool=False, pg_types: list=None,
+                       lower_cols=(), pkeys: str='', range_rows: int=0,
+                       range_workers: int=1, tz_policy: str='session',
+                       stats: tuple=None) -> list:
+        """
+        exporta una tabla access a uno o varios ficheros csv, ver
+            export_data_to_csv, y devuelve una lista de (fichero, número de
+            filas); si binary es True se escriben ficheros con el formato
+            binario de COPY; pg_types son los pg_type_name de las columnas,
+            ver __adapter_types; los valores de las columnas lower_cols
+            (nombres postgres) se pasan a minúsculas; pkeys es la primary
+            key de la tabla, ver __read_ranges; stats son los datos de
+            profile_tables de la tabla o None, ver __table_stats
+        """
+        import csv
+        from os.path import getsize, join
+
+        opener, ext = Migrate.__csv_opener(compression, binary)
+        column_names, type_names = Migrate.__column_types(cur, table)
+        plan = RowPlan(column_names, type_names,
+                       lower_idx=[i for i, col in enumerate(column_names)
+                                  if Migrate.to_ascii(col) in lower_cols])
+        pg_types = Migrate.__adapter_types(pg_types, type_names)
+        adapters = value_adapters.ColumnAdapters(pg_types, tz_policy)
+        if binary:
+            encoder = pg_copy_binary.BinaryCopyEncoder(pg_types, adapters.tz)
+        batch_size = Migrate.batch_rows(batch_size, stats)
+        read_ranges = Migrate.__read_ranges(cur, table, pkeys, column_names,
+                                            type_names, range_rows,
+                                            range_workers, stats and stats[0])
+        reader = None
+        if read_ranges is None:
+            batches = Migrate.__fetch_batches(cur.read(table), batch_size)
+        else:
+            reader = RangeReader(self.__open_reader, table, read_ranges[0],
+                                 read_ranges[1], range_workers, batch_size)
+            batches = reader.batches()
+
+        files = []
+
+        def open_next():
+            if chunk_rows:
+                fname = join(self.dir_out,
+                             f'{table}_{len(files) + 1:04d}{ext}')
+            else:
+                fname = join(self.dir_out, f'{table}{ext}')
+            fo = opener(fname)
+            files.append([fname, 0])
+            if binary:
+                fo.write(pg_copy_binary.HEADER)
+                return fo, lambda rows: fo.write(encoder.encode_rows(rows))
+            writer = csv.writer(fo,
+                                delimiter=',',
+                                quotechar='"',
+                                quoting=csv.QUOTE_NONNUMERIC,
+                                lineterminator='\n')
+            writer.writerow(column_names)
+            return fo, writer.writerows
+
+        def close(fo):
+            if binary:
+                fo.write(pg_copy_binary.TRAILER)
+            fo.close()
+
+        fo = None
+        tm = metrics.TableMetrics('export_data_to_csv', table)
+        try:
+            for rows in tm.iterate(batches, 'fetch'):
+                tm.add(rows_read=len(rows))
+                while rows:
+                    if fo is None:
+                        fo, write_rows = open_next()
+                    if chunk_rows:
+                        n = chunk_rows - files[-1][1]
+                    else:
+                        n = len(rows)
+                    chunk, rows = rows[:n], rows[n:]
+                    with tm.stage('transform'):
+                        plan.prepare(chunk)
+                        if not binary:
+                            adapters.csv_values(chunk)
+                    with tm.stage('write'):
+                        write_rows(chunk)
+                    files[-1][1] += len(chunk)
+                    if chunk_rows and files[-1][1] == chunk_rows:
+                        close(fo)
+                        fo = None
+            if not files:
+                # tabla sin filas, se escribe solo la cabecera
+                fo, write_rows = open_next()
+            if fo is not None:
+                close(fo)
+                fo = None
+            tm.add(rows_written=sum([item[1] for item in files]),
+                   nbytes=sum([getsize(item[0]) for item in files]))
+        finally:
+            if reader is not None:
+                reader.close()
+            if fo is not None:
+                fo.close()
+            tm.close()
+        return [tuple(item) for item in files]
+
+
+    @staticmethod
+    def __csv_opener(compression: str, binary: bool=False) -> tuple:
+        """
+        devuelve (función que abre un fichero para escritura, extensión del
+            fichero) según el tipo de compresión: None, 'gzip' o 'zstd'; si
+            binary es False el fichero es un csv que se abre en modo texto,
+            si es True es un fichero COPY binario
+        """
+        if binary:
+            ext = '.bin'
+            mode = 'wb'
+            kwargs = {}
+        else:
+            ext = '.csv'
+            mode = 'wt'
+            kwargs = {'encoding': 'utf-8', 'newline': ''}
+        if compression is None:
+            return (lambda fname: open(fname, mode, **kwargs), ext)
+        elif compression == 'gzip':
+            import gzip
+            return (lambda fname: gzip.open(fname, mode, **kwargs),
+                    f'{ext}.gz')
+        elif compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError('La compresión zstd requiere el paquete ' +\
+                                 'zstandard')
+            return (lambda fname: zstandard.open(fname, mode, **kwargs),
+                    f'{ext}.zst')
+        else:
+            raise ValueError(f'compression no válido: {compression}')
+
+
+    def __pg_types(self) -> dict:
+        """
+        devuelve un dict {tabla: lista de pg_type_name de sus columnas en el
+            orden de las columnas}; si el ddl de la tabla se ha escrito con
+            los tipos de optimize_types (ver structure_to_sql) se devuelven
+            estos tipos
+        """
+        select = \
+        """
+        select c.table_name, coalesce(ct.pg_type_name, c.pg_type_name)
+        from columns c
+            left join column_types ct on c.table_name = ct.table_name and
+                c.col_name = ct.col_name and ct.applied = 1
+        order by c.table_name, c.col_number;
+        """
+
+        Migrate.__create_column_types(self.con_s)
+        cur = self.con_s.cursor()
+        cur.execute(select)
+        pg_types = {}
+        for row in cur.fetchall():
+            pg_types.setdefault(row[0], []).append(row[1])
+        return pg_types
+
+
+    @staticmethod
+    def __adapter_types(pg_types: list, type_names: list) -> list:
+        """
+        devuelve los tipos postgres de las columnas de una tabla con los que
+            se adaptan sus valores: pg_types (ver __pg_types) o, si la db
+            sqlite no tiene la tabla o no coincide el número de columnas,
+            los tipos que corresponden a los tipos access type_names
+        """
+        if pg_types is not None and len(pg_types) == len(type_names):
+            return pg_types
+        access_types = Migrate.__access_pg_types()
+        return [access_types.get(type_name) for type_name in type_names]
+
+
+    @metrics.phase('upsert')
+    def upsert(self, upsert_py: bool=True, copy: bool=False,
+               batch_size: int=BATCH_ROWS, workers: int=1,
+               delta: bool=False, delta_deletes: bool=False,
+               binary: bool=False, checkpoint: bool=False,
+               quarantine: bool=False, lower_keys: bool=False,
+               range_rows: int=0, range_workers: int=1,
+               tz_policy: str='session'):
+        """
+        Inserta nuevos registros o actualiza los existentes en la db postgres
+            leyendo directamente los datos de la db access
+        Las tablas se leen por lotes de batch_size filas con fetchmany; cada
+            lote se transforma y se escribe en postgres antes de leer el
+            siguiente, de modo que la memoria utilizada no depende del tamaño
+            de las tablas
+        args
+        upsert_py: si False no se hace nada
+        copy: si True los datos de cada tabla se cargan con COPY ... FROM
+            STDIN en una tabla temporal y se fusionan con la tabla de destino
+            con una única sentencia insert ... select ... on conflict; si
+            False se ejecutan sentencias insert ... on conflict de varias
+            filas (ver values_page_size), más lentas pero útiles para
+            localizar las filas que dan problemas: si una sentencia falla
+            se divide hasta encontrar las filas que fallan, que se anotan en
+            el log y no se cargan. Con delta True no se guarda el hash de
+            estas filas, que se envían de nuevo en la siguiente ejecución
+        batch_size: número de filas de cada lote
+        workers: número de tablas que se cargan simultáneamente; si es mayor
+            que 1 cada tabla se carga en cuanto se han cargado todas las
+            tablas a las que referencian sus foreign keys, ver
+            __upsert_parallel
+        delta: si True solo se envían a postgres las filas nuevas o
+            modificadas desde la ejecución anterior; para ello se guarda en
+            la db sqlite un hash de cada fila, ver DeltaStore. Si se quiere
+            volver a enviar todas las filas hay que ejecutar delta_reset
+        delta_deletes: si True y delta es True se borran en postgres las
+            filas que ya no existen en la db access
+        binary: si True y copy es True las filas se envían con el formato
+            binario de COPY, codificadas con los tipos pg_type_name de la db
+            sqlite (ver pg_copy_binary); las tablas de postgres deben tener
+            exactamente esos tipos
+        checkpoint: si True se hace commit en postgres de cada lote y se
+            anota en un diario en la db sqlite, ver CheckpointJournal; si la
+            ejecución se interrumpe, la siguiente salta las tablas ya
+            cargadas y reanuda la tabla en curso a partir del último lote;
+            si la tabla no tiene primary key se vacía y se carga de nuevo.
+            Con delta True el commit se hace por tabla y una tabla
+            interrumpida se lee de nuevo desde el principio
+        quarantine: si True las filas que postgres rechaza no detienen la
+            carga de la tabla: con copy True cada lote se carga dentro de un
+            savepoint y, si falla, se vuelve a enviar con inserts de varias
+            filas que se dividen hasta aislar las filas que fallan (ver
+            __insert_rows); estas filas se escriben, con el SQLSTATE y el
+            mensaje de error, en el fichero _rechazadas_{tabla}.csv de
+            dir_out
+        lower_keys: si True los valores de las columnas de texto de las
+            primary y foreign keys se pasan a minúsculas (y se les aplica
+            strip) al cargarlos, de modo que no hace falta ejecutar después
+            column_contents_2lowercase, que reescribe todas las filas
+        range_rows: si es mayor que 0 las tablas de más de range_rows filas
+            cuya primary key (tables.primary_key de la db sqlite) es una
+            columna entera (ver RANGE_KEY_TYPES) se dividen en rangos de la
+            clave que se leen con range_workers conexiones a access a la
+            vez, ver RangeReader; los lotes se escriben en postgres en el
+            orden en que se leen. Las demás tablas, y las tablas que se
+            cargan con checkpoint True sin delta, que necesitan leerse en
+            orden, se leen con un solo cursor
+        range_workers: número de conexiones a access con las que se lee por
+            rangos cada tabla; con workers mayor que 1 se pueden abrir hasta
+            workers * range_workers conexiones
+        tz_policy: zona horaria de las fechas access, ver value_adapters;
+            con 'session' (por defecto) las fechas se interpretan en la zona
+            horaria de la sesión de postgres en todos los formatos
+        Los valores se convierten por columnas con los adaptadores de
+            value_adapters según los pg_type_name de la db sqlite
+        Si se ha ejecutado profile_tables, con workers mayor que 1 las tablas
+            más grandes se empiezan a cargar antes, los lotes de las tablas
+            con filas anchas tienen menos de batch_size filas (ver
+            batch_rows) y no se cuentan las filas de las tablas pequeñas
+            para decidir si se leen por rangos
+        Si falla la carga de una tabla se anota en el log y se continúa con
+            las tablas que no dependen de ella. Al terminar se escribe en
+            dir_out el fichero _upsert_resumen.csv con las filas leídas,
+            enviadas, aceptadas y rechazadas de cada tabla
+        """
+        from os.path import join
+        import psycopg2
+
+        FILE = '_tablas_ordenadas_insertar.txt'
+        FILE_SUMMARY = '_upsert_resumen.csv'
+
+        if not upsert_py:
+            print('No se hace nada, upsert_py tiene valor False')
+            return
+        if batch_size < 1:
+            raise ValueError('batch_size debe ser mayor que 0')
+        if workers < 1:
+            raise ValueError('workers debe ser mayor que 0')
+        if range_workers < 1:
+            raise ValueError('range_workers debe ser mayor que 0')
+        value_adapters.policy_tz(tz_policy)
+
+        try:
+            con_pg = None
+            mytable = ''
+            params = Migrate.con_params_get(self.file_ini, self.section)
+
+            self.__open_connections()
+            self.__check_identifiers()
+            tables = self.tables_input_order()
+            with open(join(self.dir_out, FILE), 'w') as f:
+                for table in tables:
+                    f.write(f'{table[0]}\n')
+
+            options = {'copy': copy, 'batch_size': batch_size,
+                       'delta': delta, 'delta_deletes': delta_deletes,
+                       'binary': binary and copy, 'checkpoint': checkpoint,
+                       'quarantine': quarantine, 'lower': {},
+                       'range_rows': range_rows,
+                       'range_workers': range_workers,
+                       'tz_policy': tz_policy,
+                       'pg_types': self.__pg_types(),
+                       'stats': self.__table_stats()}
+            if lower_keys:
+                options['lower'] = self.__lower_columns()
+            if workers > 1:
+                summary = self.__upsert_parallel(tables, params, options,
+                                                 workers)
+            else:
+                con_pg = psycopg2.connect(**params)
+                summary = self.__upsert_sequential(tables, con_pg, options)
+            Migrate.__upsert_summary_write(join(self.dir_out, FILE_SUMMARY),
+                                           tables, summary)
+            loaded = all([summary[table[0]][0] in ('cargada', 'ya cargada')
+                          for table in tables])
+            if checkpoint and loaded:
+                CheckpointJournal.reset(self.constr_sqlite)
+        except psycopg2.Error as er:
+            msg = format_exc()
+            msg1 = f'{mytable}, {er.pgcode}: {er.diag.message_primary}\n{msg}'
+            logging.append(msg1)
+        except:
+            msg = format_exc()
+            logging.append(msg)
+        finally:
+            self.__close_connections()
+            if con_pg is not None:
+                con_pg.close()
+
+
+    def __upsert_sequential(self, tables: list, con_pg,
+                            options: dict) -> dict:
+        """
+        upsert de las tablas una a una en el orden de tables; si falla la
+            carga de una tabla se anota en el log y no se cargan las tablas
+            que dependen de ella. Devuelve el resumen de la carga, ver
+            __upsert_summary_write
+        args
+        tables: lista de (tabla, primary key) en el orden de carga
+        con_pg: conexión a la db postgres
+        options: ver __upsert_table
+        """
+        import psycopg2
+
+        parents = self.tables_parents()
+        cur = self.con_a
+        failed = set()
+        not_loaded = []
+        summary = {}
+        for table in tables:
+            if parents.get(table[0], set()) & failed:
+                failed.add(table[0])
+                not_loaded.append(table[0])
+                summary[table[0]] = ('no cargada', None)
+                continue
+            mytable = Migrate.to_ascii(table[0])
+            summary[table[0]] = ('error', None)
+            try:
+                counts = self.__upsert_table(cur, con_pg, table, options)
+                summary[table[0]] = Migrate.__table_status(counts)
+            except psycopg2.Error as er:
+                con_pg.rollback()
+                failed.add(table[0])
+                msg = format_exc()
+                logging.append(f'{mytable}, {er.pgcode}: ' +\
+                               f'{er.diag.message_primary}\n{msg}')
+            except:
+                con_pg.rollback()
+                failed.add(table[0])
+                msg = format_exc()
+                logging.append(f'{mytable}\n{msg}')
+
+        if not_loaded:
+            logging.append('No se han cargado las tablas siguientes porque ' +\
+                           'no se han podido cargar las tablas a las que ' +\
+                           f'referencian: {", ".join(not_loaded)}')
+        return summary
+
+
+    @staticmethod
+    def __table_status(counts: dict) -> tuple:
+        """
+        estado de una tabla en el resumen de la carga a partir de lo que
+            devuelve __upsert_table
+        """
+        if counts is None:
+            return 'ya cargada', None
+        return 'cargada', counts
+
+
+    @staticmethod
+    def __upsert_summary_write(fname: str, tables: list, summary: dict):
+        """
+        escribe en fname un fichero csv con el estado de la carga de cada
+            tabla (cargada, ya cargada según el diario de checkpoint, error o
+            no cargada porque falló una tabla a la que referencia) y las
+            filas leídas, enviadas, aceptadas y rechazadas
+        args
+        fname: fichero de salida
+        tables: lista de (tabla, primary key) en el orden de carga
+        summary: dict {tabla: (estado, dict con las filas rows, sent y
+            rejected o None)}
+        """
+        import csv
+
+        with open(fname, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, delimiter=',', quotechar='"',
+                                lineterminator='\n')
+            writer.writerow(['tabla', 'estado', 'filas_leidas',
+                             'filas_enviadas', 'filas_aceptadas',
+                             'filas_rechazadas'])
+            for table in tables:
+                status, counts = summary.get(table[0], ('no cargada', None))
+                if counts is None:
+                    writer.writerow([table[0], status, '', '', '', ''])
+                else:
+                    writer.writerow([table[0], status, counts['rows'],
+                                     counts['sent'],
+                                     counts['sent'] - counts['rejected'],
+                                     counts['rejected']])
+
+
+    def __upsert_table(self, cur, con_pg, table: tuple, options: dict):
+        """
+        upsert de los datos de una tabla; ver upsert
+        args
+        cur: lector de la db access, ver source_readers
+        con_pg: conexión a la db postgres; se hace commit al terminar
+        table: (nombre de la tabla access, primary key)
+        options: dict con los argumentos copy, batch_size, delta,
+            delta_deletes, binary, checkpoint, quarantine, range_rows,
+            range_workers y tz_policy de upsert; pg_types son los tipos de
+            las columnas, ver __pg_types; stats los datos de profile_tables,
+            ver __table_stats; lower es un dict
+            {tabla: set de columnas} con las columnas que se pasan a
+            minúsculas, ver __lower_columns
+        Devuelve un dict con las filas leídas (rows), enviadas a postgres
+            (sent) y rechazadas (rejected) o None si la tabla ya se había
+            cargado según el diario de checkpoint
+        """
+        from os.path import join
+        from time import perf_counter
+        import psycopg2
+
+        insert = "insert into {} ({}) values %s;"
+
+        upsert = \
+        "insert into {} ({}) values %s on conflict ({}) do " +\
+        "update set {};"
+
+        upsert1 = \
+        "insert into {} ({}) values %s on conflict ({}) do nothing;"
+
+        copy = options['copy']
+        stats = options['stats'].get(table[0])
+        batch_size = Migrate.batch_rows(options['batch_size'], stats)
+        cur_pg = con_pg.cursor()
+        mytable = Migrate.to_ascii(table[0])
+        print(mytable)
+
+        journal = None
+        state = None
+        if options['checkpoint']:
+            journal = CheckpointJournal(self.constr_sqlite, table[0])
+            state = journal.state()
+            if state is not None and state[3]:
+                journal.close()
+                logging.append(f'{mytable}: ya cargada según ' +\
+                               'upsert_checkpoints', False)
+                return None
+            if state is not None and options['delta']:
+                # con delta los hashes de la tabla solo se guardan al
+                #  terminarla, la tabla se lee de nuevo desde el principio
+                state = None
+        column_names, type_names = Migrate.__column_types(cur, table[0])
+        cols = [Migrate.to_ascii(col) for col in column_names]
+
+        cols_str = ', '.join(cols)
+        if table[1]:
+            pk_str = Migrate.primary_key_as_pg(table[1])
+            cols_2_update_str = Migrate.cols_to_update(table[1], cols,
+                                                       excluded=True)
+            if cols_2_update_str:
+                insert0 = upsert.format(mytable, cols_str, pk_str,
+                                        cols_2_update_str)
+            else:
+                insert0 = upsert1.format(mytable, cols_str, pk_str)
+        else:
+            insert0 = insert.format(mytable, cols_str)
+        lower_cols = options['lower'].get(mytable, ())
+        plan = RowPlan(cols, type_names,
+                       lower_idx=[i for i, col in enumerate(cols)
+                                  if col in lower_cols])
+
+        pg_types = Migrate.__adapter_types(
+            options['pg_types'].get(table[0]), type_names)
+        session_tz = None
+        if options['binary'] and options['tz_policy'] == 'session':
+            session_tz = Migrate.session_tz(cur_pg)
+        adapters = value_adapters.ColumnAdapters(pg_types,
+                                                 options['tz_policy'],
+                                                 session_tz)
+        if options['binary']:
+            encoder = pg_copy_binary.BinaryCopyEncoder(pg_types, adapters.tz)
+
+        store = None
+        if options['delta']:
+            if table[1]:
+                pk_columns = Migrate.primary_key_as_pg(table[1]).split(', ')
+                pk_idx = [cols.index(col) for col in pk_columns]
+            else:
+                pk_idx = None
+            store = DeltaStore(self.constr_sqlite, table[0], pk_idx)
+
+        # con checkpoint y sin delta se hace commit de cada lote; las tablas
+        #  con primary key se leen en su orden y se reanudan a partir de la
+        #  última clave cargada (primary key de una columna) o saltando las
+        #  filas ya cargadas; las tablas sin primary key se leen sin orden,
+        #  access no garantiza que sea el mismo en cada lectura, y se vacían
+        #  y se cargan de nuevo
+        by_chunks = journal is not None and store is None
+        key_idx = None
+        skip = 0
+        chunk = 0
+        nrows = 0
+        if by_chunks and table[1]:
+            pk_names = [col.strip() for col in table[1].split(',')]
+            if len(pk_names) == 1:
+                key_idx = cols.index(Migrate.to_ascii(pk_names[0]))
+        if state is not None and not table[1]:
+            cur_pg.execute(f'truncate {mytable};')
+            journal.clear()
+            logging.append(f'{mytable}: tabla sin primary key, se vacía y ' +\
+                           'se carga de nuevo')
+            state = None
+        if state is not None:
+            chunk, nrows = state[0], state[1]
+            logging.append(f'{mytable}: se reanuda la carga a partir de ' +\
+                           f'la fila {nrows:d}')
+
+        read_ranges = None
+        if not by_chunks:
+            read_ranges = Migrate.__read_ranges(cur, table[0], table[1],
+                                                column_names, type_names,
+                                                options['range_rows'],
+                                                options['range_workers'],
+                                                stats and stats[0])
+
+        tm = metrics.TableMetrics('upsert', mytable)
+        reader = None
+        rejects = None
+        if options['quarantine']:
+            rejects = RejectFile(join(self.dir_out,
+                                      f'_rechazadas_{mytable}.csv'), cols,
+                                 append=state is not None)
+
+        try:
+            if read_ranges is not None:
+                reader = RangeReader(self.__open_reader, table[0],
+                                     read_ranges[0], read_ranges[1],
+                                     options['range_workers'],
+                                     batch_size)
+            elif key_idx is not None and state is not None and \
+                state[2] is not None:
+                source = cur.read(table[0], pk_names, pk_names[0],
+                                  after=state[2])
+            elif by_chunks and table[1]:
+                source = cur.read(table[0], pk_names)
+                skip = nrows
+            else:
+                source = cur.read(table[0])
+            while skip > 0:
+                n = len(source.fetchmany(min(skip, batch_size)))
+                if n == 0:
+                    break
+                skip -= n
+
+            stage = None
+            nsent = 0
+            nrejected = 0
+            if reader is not None:
+                batches = reader.batches()
+            else:
+                batches = Migrate.__fetch_batches(source,
+                                                  batch_size)
+            for rows in tm.iterate(batches, 'fetch'):
+                nrows += len(rows)
+                tm.add(rows_read=len(rows))
+                logging.append(f'{mytable}: {len(rows):d} filas en ' +\
+                               f'curso, {nrows:d} filas leídas', False)
+                if key_idx is not None:
+                    last_key = rows[-1][key_idx]
+                with tm.stage('transform'):
+                    plan.prepare(rows)
+                    if store is not None:
+                        rows = store.filter(rows)
+                t_write = perf_counter()
+                rejected = []
+                if rows:
+                    nsent += len(rows)
+                    if copy and stage is None:
+                        stage = Migrate.__copy_stage(cur_pg, table[1],
+                                                     mytable)
+                    if copy and rejects is not None:
+                        # el lote se fusiona dentro de un savepoint; si
+                        #  falla se envía de nuevo con inserts
+                        cur_pg.execute('savepoint _batch;')
+                        try:
+                            if options['binary']:
+                                nbytes = Migrate.__copy_rows_binary(
+                                    cur_pg, stage, cols_str, encoder, rows)
+                            else:
+                                nbytes = Migrate.__copy_rows(
+                                    cur_pg, stage, cols_str, adapters, rows)
+                            if stage != mytable:
+                                Migrate.__copy_merge(cur_pg, table[1],
+                                                     mytable, stage, cols)
+                                cur_pg.execute(f'truncate {stage};')
+                            cur_pg.execute('release savepoint _batch;')
+                            tm.add(nbytes=nbytes)
+                        except psycopg2.Error:
+                            cur_pg.execute('rollback to savepoint _batch;')
+                            cur_pg.execute('release savepoint _batch;')
+                            page_size = Migrate.values_page_size(
+                                len(cols), rows, batch_size)
+                            rejected = Migrate.__insert_rows(
+                                cur_pg, insert0, adapters.param_values(rows),
+                                page_size, mytable, rejects)
+                    elif options['binary']:
+                        tm.add(nbytes=Migrate.__copy_rows_binary(
+                            cur_pg, stage, cols_str, encoder, rows))
+                    elif copy:
+                        tm.add(nbytes=Migrate.__copy_rows(cur_pg, stage,
+                                                          cols_str, adapters,
+                                                          rows))
+                    else:
+                        page_size = Migrate.values_page_size(
+                            len(cols), rows, batch_size)
+                        rejected = Migrate.__insert_rows(
+                            cur_pg, insert0, adapters.param_values(rows),
+                            page_size, mytable, rejects)
+                    if rejected:
+                        nrejected += len(rejected)
+                        if store is not None:
+                            store.reject(rejected)
+                if by_chunks:
+                    if stage is not None:
+                        Migrate.__copy_merge(cur_pg, table[1], mytable,
+                                             stage, cols)
+                        stage = None
+                    con_pg.commit()
+                    chunk += 1
+                    journal.save(chunk, nrows,
+                                 last_key if key_idx is not None else None)
+                tm.secs['write'] += perf_counter() - t_write
+
+            t_write = perf_counter()
+            if stage is not None:
+                Migrate.__copy_merge(cur_pg, table[1], mytable, stage, cols)
+            if nrejected:
+                logging.append(f'{mytable}: {nrejected:d} filas no se han ' +\
+                               'podido cargar')
+            if store is not None:
+                ndeleted = 0
+                if options['delta_deletes']:
+                    ndeleted = Migrate.__delete_rows(cur_pg, mytable, cols,
+                                                     store)
+                logging.append(f'{mytable}: {nsent:d} filas nuevas o ' +\
+                               f'modificadas de {nrows:d}, {ndeleted:d} ' +\
+                               'filas borradas')
+            con_pg.commit()
+            tm.secs['write'] += perf_counter() - t_write
+            tm.add(rows_written=nsent - nrejected)
+            if store is not None:
+                store.commit()
+            if journal is not None:
+                journal.save(chunk + 1, nrows, None, True)
+            return {'rows': nrows, 'sent': nsent, 'rejected': nrejected}
+        finally:
+            if reader is not None:
+                reader.close()
+            tm.close()
+            if store is not None:
+                store.close()
+            if journal is not None:
+                journal.close()
+            if rejects is not None:
+                rejects.close()
+
+
+    @staticmethod
+    def __delete_rows(cur_pg, mytable: str, cols: list,
+                      store) -> int:
+        """
+        borra en mytable las filas que ya no existen en la db access según
+            store (DeltaStore) y devuelve el número de filas borradas
+        """
+        from psycopg2.extras import execute_batch
+
+        delete = "delete from {} where ({}) = ({});"
+
+        delete1 = \
+        "delete from {} where ctid in (select ctid from {} " +\
+        "where ({}) is not distinct from ({}) limit %s);"
+
+        deleted = store.deleted()
+        if not deleted:
+            return 0
+        if store.pk_idx is not None:
+            pk_cols = ', '.join([cols[i] for i in store.pk_idx])
+            placeholders = ', '.join(['%s' for i in store.pk_idx])
+            execute_batch(cur_pg, delete.format(mytable, pk_cols,
+                                                placeholders), deleted)
+            return len(deleted)
+        cols_str = ', '.join(cols)
+        placeholders = ', '.join(['%s' for col in cols])
+        execute_batch(cur_pg, delete1.format(mytable, mytable, cols_str,
+                                             placeholders),
+                      [row + [n] for row, n in deleted])
+        return sum([n for row, n in deleted])
+
+
+    def delta_reset(self):
+        """
+        borra los hashes de las filas guardados por upsert con delta True,
+            de modo que en la siguiente ejecución se envían todas las filas
+        """
+        try:
+            self.__open_connections(odbc=False, sqlite=True)
+            DeltaStore.create_tables(self.con_s)
+            cur = self.con_s.cursor()
+            cur.execute('delete from row_hashes;')
+            cur.execute('delete from row_multisets;')
+            self.con_s.commit()
+        finally:
+            self.__close_connections()
+
+
+    def checkpoints_reset(self):
+        """
+        borra el diario de upsert con checkpoint True, de modo que la
+            siguiente ejecución empieza de nuevo por la primera tabla
+        """
+        CheckpointJournal.reset(self.constr_sqlite)
+
+
+    def __upsert_parallel(self, tables: list, params: dict, options: dict,
+                          workers: int) -> dict:
+        """
+        upsert de las tablas con un pool de workers hilos; cada hilo abre su
+            propio lector de access y su conexión a postgres. Las foreign
+            keys definen un grafo de dependencias entre las tablas: una tabla
+            se empieza a cargar en cuanto se ha hecho commit de todas las
+            tablas a las que referencia, de modo que las tablas
+            independientes se cargan a la vez; de las tablas que se pueden
+            cargar se envían antes las que tienen más filas según
+            profile_tables. Si la carga de una tabla falla se anota en el log
+            y no se cargan las tablas que dependen de ella; el resto
+            continúa. Devuelve el resumen de la carga, ver
+            __upsert_summary_write
+        args
+        tables: lista de (tabla, primary key) en el orden de carga
+        params: parámetros de la conexión a postgres
+        options: ver __upsert_table
+        workers: ver upsert
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, \
+            FIRST_COMPLETED
+        import threading
+        import psycopg2
+
+        parents = self.tables_parents()
+        local = threading.local()
+        lock = threading.Lock()
+        connections = []
+
+        def load(table):
+            if not hasattr(local, 'cur'):
+                reader = self.__open_reader()
+                con_pg = psycopg2.connect(**params)
+                with lock:
+                    connections.extend((reader, con_pg))
+                local.cur = reader
+                local.con_pg = con_pg
+            try:
+                return self.__upsert_table(local.cur, local.con_pg, table,
+                                           options)
+            except:
+                local.con_pg.rollback()
+                raise
+
+        stats = options['stats']
+        pending = sorted(tables,
+                         key=lambda table: -stats.get(table[0], (0,))[0])
+        loaded = set()
+        running = {}
+        summary = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                while True:
+                    for table in [table for table in pending
+                                  if parents.get(table[0], set()) <= loaded]:
+                        pending.remove(table)
+                        running[executor.submit(load, table)] = table
+                    if not running:
+                        break
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        table = running.pop(future)
+                        mytable = Migrate.to_ascii(table[0])
+                        summary[table[0]] = ('error', None)
+                        try:
+                            summary[table[0]] = \
+                                Migrate.__table_status(future.result())
+                            loaded.add(table[0])
+                        except psycopg2.Error as er:
+                            msg = format_exc()
+                            logging.append(f'{mytable}, {er.pgcode}: ' +\
+                                           f'{er.diag.message_primary}\n{msg}')
+                        except:
+                            msg = format_exc()
+                            logging.append(f'{mytable}\n{msg}')
+        finally:
+            for con in connections:
+                con.close()
+
+        if pending:
+            not_loaded = ', '.join([table[0] for table in pending])
+            logging.append('No se han cargado las tablas siguientes porque ' +\
+                           'no se han podido cargar las tablas a las que ' +\
+                           f'referencian: {not_loaded}')
+        return summary
+
+
+    def tables_parents(self) -> dict:
+        """
+        devuelve un dict {tabla: set de tablas a las que referencian sus
+            foreign keys} con las tablas de tipo TABLE; no se incluyen las
+            autoreferencias
+        """
+        return self.__tables_graph()[0]
+
+
+    def __tables_graph(self) -> tuple:
+        """
+        lee relationships y devuelve el grafo de dependencias entre las tablas
+            de tipo TABLE: (dict {tabla: set de tablas a las que referencia},
+            set de tablas con autoreferencias)
+        """
+        select = \
+        """
+        select r.references_table, r.referenced_table
+        from relationships r
+        left join tables t1 on r.references_table = t1.name
+        left join tables t2 on r.referenced_table = t2.name
+        where t1.table_type = 'TABLE' and t2.table_type = 'TABLE';
+        """
+
+        cur = self.con_s.cursor()
+        cur.execute(select)
+        parents = {}
+        self_references = set()
+        for row in cur.fetchall():
+            if row[0] == row[1]:
+                self_references.add(row[0])
+            else:
+                parents.setdefault(row[0], set()).add(row[1])
+        return parents, self_references
+
+
+    @staticmethod
+    def __read_ranges(cur, table: str, pkeys: str, column_names: list,
+                      type_names: list, range_rows: int,
+                      workers: int, known_rows: int=None) -> tuple:
+        """
+        si la tabla tiene más de range_rows filas y su primary key pkeys es
+            una columna entera (ver RANGE_KEY_TYPES) devuelve (columna de la
+            clave, lista de rangos (desde, hasta) de la clave) para leerla
+            con RangeReader; en otro caso devuelve None y la tabla se lee
+            con un solo cursor
+        args
+        cur: lector de la db access; si no puede leer rangos (RANGES
+            False) se devuelve None
+        column_names, type_names: ver __column_types
+        workers: número de conexiones con las que se lee la tabla
+        known_rows: número de filas de la tabla según profile_tables o None;
+            si no es mayor que range_rows no se cuentan las filas
+        """
+        if range_rows <= 0 or workers < 2 or not pkeys or not cur.RANGES:
+            return None
+        if known_rows is not None and known_rows <= range_rows:
+            return None
+        pk_names = [col.strip() for col in pkeys.split(',')]
+        if len(pk_names) > 1 or pk_names[0] not in column_names:
+            return None
+        key = pk_names[0]
+        if type_names[column_names.index(key)] not in RANGE_KEY_TYPES:
+            return None
+        nrows, kmin, kmax = cur.key_range(table, key)
+        if nrows <= range_rows or kmin is None:
+            return None
+        kmin, kmax = int(kmin), int(kmax)
+        n = min(workers * RANGES_PER_WORKER, kmax - kmin + 1)
+        width = -(-(kmax - kmin + 1) // n)
+        ranges = [(lo, min(lo + width - 1, kmax))
+                  for lo in range(kmin, kmax + 1, width)]
+        logging.append(f'{table}: {nrows:d} filas, se lee en ' +\
+                       f'{len(ranges):d} rangos de {key} con {workers:d} ' +\
+                       'conexiones', False)
+        return key, ranges
+
+
+    @staticmethod
+    def __fetch_batches(cur, batch_size: int):
+        """
+        iterator que devuelve las filas pendientes de leer en cur en listas
+            de como máximo batch_size filas
+        """
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+    @staticmethod
+    def values_page_size(ncols: int, rows: list, batch_size: int) -> int:
+        """
+        número de filas de cada sentencia insert ... values de varias filas:
+            como máximo batch_size, no más de PG_MAX_PARAMS valores y unos
+            VALUES_BYTES bytes según el ancho medio de una muestra de rows
+        """
+        sample = rows[:100]
+        width = 1
+        if sample:
+            width = max(1, sum([len(str(item)) + 2 for row in sample
+                                for item in row]) // len(sample))
+        return max(1, min(batch_size, PG_MAX_PARAMS // max(1, ncols),
+                          VALUES_BYTES // width))
 
-        insert = \
-        "insert into tables (name, primary_key, id) " +\
-        "values (?, ?, ?)"
 
-        select = \
-        "select DISTINCT name, primary_key " +\
-        "from tables t " +\
-        "left join relationships r on r.references_table = name " +\
-        "where table_type='TABLE' and r.references_table is null " +\
-        "order by name;"
+    @staticmethod
+    def __insert_rows(cur_pg, insert0: str, rows: list, page_size: int,
+                      mytable: str, rejects=None) -> list:
+        """
+        ejecuta insert0 (insert ... values %s) con execute_values en
+            páginas de page_size filas, cada una dentro de un savepoint. Si
+            una página falla se divide en 2 mitades hasta localizar las filas
+            que fallan, que se anotan en el log -o en rejects (RejectFile)
+            si no es None- y se descartan; el resto de las filas se cargan.
+            Devuelve una lista con las posiciones en rows de las filas
+            descartadas, vacía si se han cargado todas
+        """
+        import psycopg2
+        from psycopg2.extras import execute_values
+
+        # cada página con la posición en rows de su primera fila
+        pages = [(i, rows[i: i + page_size]) for i in range(0, len(rows),
+                                                            page_size)]
+        pages.reverse()
+        rejected = []
+        while pages:
+            start, page = pages.pop()
+            cur_pg.execute('savepoint _rows;')
+            try:
+                execute_values(cur_pg, insert0, page, page_size=len(page))
+            except psycopg2.Error as er:
+                cur_pg.execute('rollback to savepoint _rows;')
+                if len(page) > 1:
+                    half = len(page) // 2
+                    pages.append((start + half, page[half:]))
+                    pages.append((start, page[:half]))
+                else:
+                    rejected.append(start)
+                    if rejects is not None:
+                        rejects.write(er.pgcode, er.diag.message_primary,
+                                      page[0])
+                    else:
+                        logging.append(f'{mytable}, {er.pgcode}: ' +\
+                                       f'{er.diag.message_primary}\n' +\
+                                       f'{page[0]}', False)
+            cur_pg.execute('release savepoint _rows;')
+        return rejected
 
-        select1 = \
-        "select DISTINCT name, primary_key " +\
-        "from tables t " +\
-        "left join relationships r on r.references_table = name " +\
-        "where table_type='TABLE' and r.references_table is not null " +\
-        "order by name;"
 
-        select2 = \
-        """select r.referenced_table
-        from tables t
-        left join relationships r on r.references_table = t.name
-        where t.name = ?
-        order by r.referenced_table;"""
-
-        select3 = \
-        "select name " +\
-        "from tables t " +\
-        "where name=?;"
-
-        select4 = \
-        "select name, primary_key " +\
-        "from tables " +\
-        "order by id;"
-
-        con_mem = sqlite3.connect(':memory:')
-        cur_mem = con_mem.cursor()
-        cur_mem.execute(create_table)
+    @staticmethod
+    def __copy_stage(cur_pg, pkeys: str, mytable: str) -> str:
+        """
+        crea la tabla temporal en la que se copian los datos de mytable antes
+            de fusionarlos y devuelve su nombre; si la tabla no tiene
+            primary key no se crea y se devuelve mytable, los datos se copian
+            directamente sobre ella
+        args
+        cur_pg: cursor postgres
+        pkeys: primary key de la tabla en access (columnas separadas por
+            comas) o '' si no tiene
+        mytable: nombre de la tabla en postgres
+        """
+        create_stage = \
+        "create temp table {} (like {} including defaults) on commit drop;"
 
-        cur = self.con_s.cursor()
-        cur.execute(select)
-        tables = [(table[0], table[1], i)
-                  for i, table in enumerate(cur.fetchall())]
-        for table in tables:
-            cur_mem.execute(insert, table)
-        con_mem.commit()
-        n = len(tables) - 1
+        if not pkeys:
+            return mytable
+        stage = f'_stg_{mytable}'
+        cur_pg.execute(create_stage.format(stage, mytable))
+        return stage
 
-        cur.execute(select1)
-        tables2add = [table for table in cur.fetchall()]
 
-        not_added_tables = []
-        i = 0
-        while True:
-            i += 1
-            if i > MAXITER:
-                raise ValueError('tables_input_order, se ha alcanzado ' +\
-                                 'el número máx. de iterecciones ' +\
-                                 f'{MAXITER:d}')
-            for t2add in tables2add:
-                cur.execute(select2, (t2add[0],))
-                tt = [item for item in cur.fetchall()]
-                to_insert = True
-                for tt1 in tt:
-                    tinserted = cur_mem.execute(select3, (tt1[0],)).fetchall()
-                    if not tinserted:
-                        not_added_tables.append(t2add)
-                        to_insert = False
-                        break
-                if to_insert:
-                    n += 1
-                    cur_mem.execute(insert, (t2add[0], t2add[1], n))
-                    con_mem.commit()
-            if not_added_tables:
-                tables2add = [t1 for t1 in not_added_tables]
-                not_added_tables = []
-            else:
-                break
-        tables = [table for table in cur_mem.execute(select4).fetchall()]
-        return tables
+    @staticmethod
+    def __copy_rows(cur_pg, stage: str, cols_str: str, adapters,
+                    rows: list):
+        """
+        copia rows en la tabla stage con COPY ... FROM STDIN y devuelve el
+            número de caracteres enviados; adapters es un
+            value_adapters.ColumnAdapters
+        """
+        from io import StringIO
+
+        copy = "copy {} ({}) from stdin;"
+
+        text = adapters.copy_text(rows)
+        cur_pg.copy_expert(copy.format(stage, cols_str), StringIO(text))
+        return len(text)
 
 
     @staticmethod
-    def primary_key_as_pg(pkeys: str) -> str:
+    def __copy_rows_binary(cur_pg, stage: str, cols_str: str, encoder,
+                           rows: list):
         """
-        transforma la expresión access de las primary key a postgres
+        copia rows en la tabla stage con COPY ... FROM STDIN en formato
+            binario y devuelve el número de bytes enviados; encoder es un
+            pg_copy_binary.BinaryCopyEncoder
         """
-        pk_columns = [Migrate.to_ascii(col) for col in pkeys.split(',')]
-        return ', '.join(pk_columns)
+        from io import BytesIO
+
+        copy = "copy {} ({}) from stdin with (format binary);"
+
+        data = pg_copy_binary.copy_data(encoder, rows)
+        cur_pg.copy_expert(copy.format(stage, cols_str), BytesIO(data))
+        return len(data)
 
 
     @staticmethod
-    def cols_to_update(pkeys: str, col_names: list) -> str:
+    def session_tz(cur_pg):
         """
-        columnas para actualizar con parámetros
+        devuelve la zona horaria (tzinfo) de la sesión postgres o None (zona
+            horaria local) si no se puede obtener
         """
-        pk_columns = [Migrate.to_ascii(col) for col in pkeys.split(',')]
-        ucolumns = [f'{col_name} = %s' for col_name in col_names
-                    if col_name not in pk_columns]
-        return ', '.join(ucolumns)
+        from zoneinfo import ZoneInfo
+
+        cur_pg.execute('show timezone;')
+        name = cur_pg.fetchone()[0]
+        try:
+            return ZoneInfo(name)
+        except Exception:
+            logging.append(f'No se reconoce la zona horaria {name}, se ' +\
+                           'utiliza la zona horaria local', False)
+            return None
 
 
     @staticmethod
-    def update_where_columns(pkeys: str, col_names: list) -> str:
+    def __copy_merge(cur_pg, pkeys: str, mytable: str, stage: str,
+                     cols: list):
         """
-        condición where: columnas con parameters
+        fusiona los datos copiados en la tabla temporal stage con mytable
+            con una única sentencia insert ... select ... on conflict
         """
-        pk_columns = [Migrate.to_ascii(col) for col in pkeys.split(',')]
-        kcolumns = [f'{col_name} = %s' for col_name in col_names
-                    if col_name in pk_columns]
-        return ', '.join(kcolumns)
+        merge = \
+        "insert into {} ({}) select {} from {} on conflict ({}) do " +\
+        "update set {};"
+
+        merge1 = \
+        "insert into {} ({}) select {} from {} on conflict ({}) do nothing;"
+
+        if not pkeys:
+            return
+        cols_str = ', '.join(cols)
+        pk_str = Migrate.primary_key_as_pg(pkeys)
+        cols_2_update_str = Migrate.cols_to_update(pkeys, cols, excluded=True)
+        if cols_2_update_str:
+            cur_pg.execute(merge.format(mytable, cols_str, cols_str, stage,
+                                        pk_str, cols_2_update_str))
+        else:
+            cur_pg.execute(merge1.format(mytable, cols_str, cols_str, stage,
+                                         pk_str))
 
 
     @staticmethod
-    def sort_row(pkeys: str, col_names: list, row: list) -> list:
+    def copy_text_row(row: list) -> str:
         """
-        reordena las columnas devueltas por la select para adecuarlas a un
-            update de una tabla con primary keys
+        devuelve row como una línea en el formato text de la sentencia COPY
+            de postgres: columnas separadas por tabuladores, null como \\N
+            y los caracteres especiales escapados con \\; el tipo de cada
+            valor se comprueba en cada fila, en los lotes de filas de una
+            tabla es más rápido value_adapters.ColumnAdapters.copy_text
+        """
+        values = [value_adapters.COPY_NULL if item is None
+                  else value_adapters.text_value(item) for item in row]
+        return '\t'.join(values) + '\n'
+
+
+    def tables_input_order(self) -> list:
+        """
+        devuelva las tablas en el order de carga de acuerdo a las foreign
+            keys: lista de (nombre de la tabla, primary key)
+        """
+        return [table for level in self.tables_load_levels()
+                for table in level]
+
+
+    def tables_load_levels(self) -> list:
+        """
+        devuelve las tablas agrupadas en niveles de carga: lista de niveles,
+            cada nivel es una lista de (nombre de la tabla, primary key).
+            Las tablas de un nivel solo referencian a tablas de los niveles
+            anteriores, por lo que pueden cargarse en cualquier orden o a la
+            vez. El orden se calcula en una pasada sobre relationships con el
+            algoritmo de Kahn
+        Las autoreferencias no impiden la carga y se anotan en el log; si las
+            foreign keys forman ciclos se lanza ValueError con las tablas
+            implicadas
+        """
+        select = \
+        """
+        select name, primary_key
+        from tables
+        where table_type='TABLE'
+        order by name;
         """
-        pk_columns = [Migrate.to_ascii(col) for col in pkeys.split(',')]
-        kcolumns = [row[i] for i, col_name in enumerate(col_names)
-                    if col_name in pk_columns]
-        ucolumns = [row[i] for i, col_name in enumerate(col_names)
-                    if col_name not in pk_columns]
-        return ucolumns + kcolumns
+
+        cur = self.con_s.cursor()
+        cur.execute(select)
+        tables = {row[0]: (row[0], row[1]) for row in cur.fetchall()}
+        parents, self_references = self.__tables_graph()
+
+        if self_references:
+            names = ', '.join(sorted(self_references))
+            logging.append(f'Tablas con autoreferencias: {names}', False)
+
+        children = {}
+        n_parents = {}
+        for name in tables:
+            n_parents[name] = len(parents.get(name, ()))
+            for parent in parents.get(name, ()):
+                children.setdefault(parent, []).append(name)
+
+        levels = []
+        level = [name for name in tables if n_parents[name] == 0]
+        while level:
+            levels.append([tables[name] for name in level])
+            next_level = []
+            for name in level:
+                for child in children.get(name, ()):
+                    n_parents[child] -= 1
+                    if n_parents[child] == 0:
+                        next_level.append(child)
+            level = sorted(next_level)
+
+        remaining = {name for name in tables if n_parents[name] > 0}
+        if remaining:
+            # se descartan las tablas que solo dependen de un ciclo sin
+            #  formar parte de él
+            in_cycles = set(remaining)
+            while True:
+                leaves = {name for name in in_cycles
+                          if not in_cycles.intersection(
+                              children.get(name, ()))}
+                if not leaves:
+                    break
+                in_cycles -= leaves
+            names = ', '.join(sorted(in_cycles))
+            names1 = ', '.join(sorted(remaining - in_cycles))
+            raise ValueError('tables_input_order, las foreign keys forman ' +\
+                             f'ciclos entre las tablas: {names}; tablas ' +\
+                             f'que dependen de ellas: {names1}')
+        return levels
 
 
     @staticmethod
-    def upsert_values(pkeys: str, col_names: list, row: list,
-                      on_conflict_update: bool) -> list:
+    def primary_key_as_pg(pkeys: str) -> str:
         """
-        Forma la lista de valores para la sentencia upsert
+        transforma la expresión access de las primary key a postgres
         """
         pk_columns = [Migrate.to_ascii(col) for col in pkeys.split(',')]
-        data2insert = [row[i] for i, col_name in enumerate(col_names)]
-        if not on_conflict_update:
-            return data2insert
-        data2update = [row[i] for i, col_name in enumerate(col_names)
-                       if col_name not in pk_columns]
-        return data2insert + data2update
+        return ', '.join(pk_columns)
 
 
     @staticmethod
-    def __strip_str(row: list):
+    def cols_to_update(pkeys: str, col_names: list,
+                       excluded: bool=False) -> str:
         """
-        str to utf-8
+        columnas para actualizar con parámetros
+        excluded: si True en vez de parámetros se toman los valores de la
+            fila propuesta para la inserción (excluded.col_name)
         """
-        for i, item in enumerate(row):
-            if isinstance(item, str):
-                row[i] = item.strip()
+        pk_columns = [Migrate.to_ascii(col) for col in pkeys.split(',')]
+        if excluded:
+            ucolumns = [f'{col_name} = excluded.{col_name}'
+                        for col_name in col_names
+                        if col_name not in pk_columns]
+        else:
+            ucolumns = [f'{col_name} = %s' for col_name in col_names
+                        if col_name not in pk_columns]
+        return ', '.join(ucolumns)
+
+
+    @staticmethod
+    def __column_types(cur, table: str) -> tuple:
+        """
+        devuelve (nombres de las columnas de table en access, tipos access de
+            las columnas); los tipos que no se conocen se devuelven como None,
+            ver RowPlan
+        """
+        access_types = Migrate.__access_pg_types()
+        column_names = []
+        type_names = []
+        for row in cur.columns(table):
+            column_names.append(row[1])
+            type_name = row[3].upper() if row[3] else ''
+            if type_name in access_types or type_name in RowPlan.TEXT_TYPES:
+                type_names.append(type_name)
+            else:
+                type_names.append(None)
+        return column_names, type_names
 
 
-    def column_contents_2lowercase(self, pyupdate: bool, sqlupdate: bool):
+    @metrics.phase('column_contents_2lowercase')
+    def column_contents_2lowercase(self, pyupdate: bool, sqlupdate: bool,
+                                   only_changed: bool=False):
         """
         Convierte a minúscula los contenidos de las columnas que son claves
             primarias o ajenas y ejecuta también la función trim
+        Si los datos se han cargado con lower_keys True (ver upsert) no es
+            necesario; con only_changed True solo se actualizan las filas
+            cuyo valor cambia, c <> lower(trim(c)), y no se reescriben las
+            demás
         """
         from os.path import join
         import psycopg2
 
         update = "UPDATE {} SET {} = lower(trim({}));"
 
+        update1 = \
+        "UPDATE {} SET {} = lower(trim({})) WHERE {} <> lower(trim({}));"
+
         if not pyupdate and not sqlupdate:
             print('No se hace nada, pyupdate y sqlupdate tienen valor False')
             return
@@ -863,14 +3135,22 @@ class Migrate():
                 fo = join(self.dir_out, f'{self.base_name}' + \
                           f'{sql_files["lower_key_data"]}')
                 fo = open(fo, 'w')
-                fo.write('BEGUIN;\n\n')
+                fo.write('BEGIN;\n\n')
 
             tables = self.table_columns_2_lower()
             for row in tables:
                 print(row[0])
-                ustm = update.format(row[0], row[1], row[1])
+                if only_changed:
+                    ustm = update1.format(row[0], row[1], row[1], row[1],
+                                          row[1])
+                else:
+                    ustm = update.format(row[0], row[1], row[1])
                 if pyupdate:
-                    cur_pg.execute(ustm)
+                    with metrics.table('column_contents_2lowercase',
+                                       f'{row[0]}.{row[1]}') as tm:
+                        with tm.stage('write'):
+                            cur_pg.execute(ustm)
+                        tm.add(rows_written=cur_pg.rowcount)
                 if sqlupdate:
                     fo.write(f'{ustm}\n')
             if pyupdate:
@@ -897,6 +3177,23 @@ class Migrate():
         devuelve una lista con las tablas y columnas cuyos contenidos se
             pasarán a minúsculas
         """
+        try:
+            self.__open_connections(odbc=False, sqlite=True)
+            return self.__key_text_columns()
+        except:
+            msg = format_exc()
+            logging.append(msg)
+            raise ValueError(msg)
+        finally:
+            self.__close_connections()
+
+
+    def __key_text_columns(self) -> list:
+        """
+        lee en la db sqlite de estructura las columnas de texto de las
+            primary y foreign keys: lista de (tabla, columna) con los nombres
+            de postgres
+        """
 
         select1 = \
         """
@@ -917,25 +3214,28 @@ class Migrate():
         """
         valid_types = ('varchar', 'text')
 
-        try:
-            self.__open_connections(odbc=False, sqlite=True)
+        cur = self.con_s.cursor()
+        cur.execute(select1)
+        tables1 = [(self.to_ascii(row[0]), self.to_ascii(row[1]))
+                   for row in cur.fetchall() if row[2] in valid_types]
 
-            cur = self.con_s.cursor()
-            cur.execute(select1)
-            tables1 = [(self.to_ascii(row[0]), self.to_ascii(row[1]))
-                       for row in cur.fetchall() if row[2] in valid_types]
+        cur.execute(select2)
+        tables2 = [(self.to_ascii(row[0]), self.to_ascii(row[1]))
+                   for row in cur.fetchall() if row[2] in valid_types]
 
-            cur.execute(select2)
-            tables2 = [(self.to_ascii(row[0]), self.to_ascii(row[1]))
-                       for row in cur.fetchall() if row[2] in valid_types]
+        return tables1 + tables2
 
-            return tables1 + tables2
-        except:
-            msg = format_exc()
-            logging.append(msg)
-            raise ValueError(msg)
-        finally:
-            self.__close_connections()
+
+    def __lower_columns(self) -> dict:
+        """
+        devuelve las columnas que se pasan a minúsculas en la carga con
+            lower_keys True: dict {tabla: set de columnas}, nombres de
+            postgres
+        """
+        lower = {}
+        for table, col in self.__key_text_columns():
+            lower.setdefault(table, set()).add(col)
+        return lower
 
 
     @staticmethod
@@ -988,11 +3288,567 @@ class Migrate():
         return db
 
 
-#def write_copyfrom(table_name, sfield_names, dir_out, fo):
-#    """
-#    writes \copy .. from psql metacommand one for each table
-#    """
-#    stm = ''.join(copyfrom)
-#    csv_file = csv_file_name_get(dir_out, table_name)
-#    stm1 = stm.format(table_name, sfield_names, csv_file, sfield_names)
-#    fo.write('{}\n\n'.format(stm1))
+class RowPlan():
+    """
+    Plan de transformación de las filas de una tabla, compilado una sola vez
+        a partir de los metadatos de sus columnas: posiciones de las
+        columnas de texto a las que se aplica strip o que se pasan a
+        minúsculas. Sustituye en el bucle de filas a la comprobación del
+        tipo de cada valor
+    """
+
+    # tipos access cuyos valores son str
+    TEXT_TYPES = ('CHAR', 'VARCHAR', 'LONGCHAR', 'LONGTEXT', 'TEXT')
+
+    def __init__(self, col_names: list, type_names: list,
+                 lower_idx: list=()):
+        """
+        args
+        col_names: nombres de las columnas en postgres
+        type_names: tipos access de las columnas, ver
+            source_readers.SourceReader.columns;
+            None si el tipo es desconocido
+        lower_idx: posiciones de las columnas de texto cuyos valores se
+            pasan a minúsculas además de aplicarles strip, ver
+            Migrate.table_columns_2_lower
+        """
+        self.lower_idx = tuple(lower_idx)
+        self.strip_idx = tuple([i for i, type_name in enumerate(type_names)
+                                if type_name in RowPlan.TEXT_TYPES and
+                                i not in self.lower_idx])
+        # tipos desconocidos: se comprueba el tipo de cada valor
+        self.check_idx = tuple([i for i, type_name in enumerate(type_names)
+                                if type_name is None])
+
+
+    def prepare(self, rows: list) -> list:
+        """
+        aplica strip a los str y, si procede, pasa a minúsculas las columnas
+            lower_idx de rows (modifica las filas) y devuelve rows
+        """
+        strip_idx = self.strip_idx
+        check_idx = self.check_idx
+        lower_idx = self.lower_idx
+        for row in rows:
+            for i in strip_idx:
+                item = row[i]
+                if item is not None:
+                    row[i] = item.strip()
+            for i in lower_idx:
+                item = row[i]
+                if isinstance(item, str):
+                    row[i] = item.strip().lower()
+            for i in check_idx:
+                item = row[i]
+                if isinstance(item, str):
+                    row[i] = item.strip()
+        return rows
+
+
+class RangeReader():
+    """
+    Lee una tabla access dividida en rangos de su primary key con varias
+        conexiones a la vez. Cada hilo abre su lector y lee los rangos
+        pendientes con fetchmany; los lotes se pasan por una cola de
+        tamaño limitado, de modo que la memoria no depende del tamaño de la
+        tabla, y batches los devuelve en el orden en que llegan
+    """
+
+    def __init__(self, open_reader, table: str, key: str,
+                 ranges: list, workers: int, batch_size: int):
+        """
+        args
+        open_reader: función sin argumentos que abre un lector de la db
+            access, ver source_readers
+        table: nombre de la tabla access
+        key: columna de la primary key
+        ranges: lista de (desde, hasta), ambos incluidos, ver
+            Migrate.__read_ranges
+        workers: número de conexiones
+        batch_size: número de filas de cada lote
+        """
+        from queue import Queue
+        import threading
+
+        self.open_reader = open_reader
+        self.table = table
+        self.key = key
+        self.ranges = list(ranges)
+        self.workers = max(1, min(workers, len(self.ranges)))
+        self.batch_size = batch_size
+        self.queue = Queue(maxsize=2 * self.workers)
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+
+
+    def __put(self, item):
+        """
+        pone item en la cola salvo que se haya llamado a close
+        """
+        from queue import Full
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+
+    def __read(self):
+        """
+        hilo de lectura: lee rangos hasta que no quedan; al terminar pone
+            None en la cola y, si hay un error, antes la excepción
+        """
+        con_a = None
+        try:
+            con_a = self.open_reader()
+            while not self.stop.is_set():
+                with self.lock:
+                    if not self.ranges:
+                        break
+                    lo, hi = self.ranges.pop(0)
+                source = con_a.read(self.table, key=self.key, lo=lo, hi=hi)
+                while not self.stop.is_set():
+                    rows = source.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    self.__put(rows)
+        except Exception as er:
+            self.__put(er)
+        finally:
+            if con_a is not None:
+                con_a.close()
+            self.__put(None)
+
+
+    def batches(self):
+        """
+        iterator que devuelve los lotes de filas de todos los rangos; si un
+            hilo falla se lanza su excepción
+        """
+        import threading
+
+        self.threads = [threading.Thread(target=self.__read,
+                                         name=f'RangeReader_{i:d}',
+                                         daemon=True)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        running = len(self.threads)
+        try:
+            while running:
+                item = self.queue.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            self.close()
+
+
+    def close(self):
+        """
+        detiene los hilos de lectura y espera a que terminen
+        """
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class DeltaStore():
+    """
+    Guarda en la db sqlite de estructura un hash de cada fila cargada de una
+        tabla y permite seleccionar, al leer de nuevo la tabla, las filas
+        nuevas o modificadas y obtener las que han desaparecido
+    En las tablas con primary key se guarda {primary key: hash de la fila}
+        en row_hashes; en las tablas sin primary key se guarda el multiset de
+        hashes de las filas, con el número de repeticiones de cada hash y el
+        contenido de la fila, en row_multisets
+    Los hashes de la ejecución en curso se guardan en tablas temporales de
+        la conexión y solo se trasladan a row_hashes o row_multisets con
+        commit, que debe ejecutarse después del commit en postgres; las
+        filas que postgres rechaza se anulan con reject, de modo que se
+        envían de nuevo en la siguiente ejecución. Cada
+        tabla usa su propia conexión a la db sqlite, por lo que pueden
+        cargarse varias tablas a la vez
+    """
+
+    def __init__(self, constr_sqlite: str, table_name: str,
+                 pk_idx: list=None):
+        """
+        args
+        constr_sqlite: fichero de la db sqlite de estructura
+        table_name: nombre de la tabla access
+        pk_idx: posiciones en la fila de las columnas de la primary key;
+            None si la tabla no tiene primary key
+        """
+        self.table_name = table_name
+        self.pk_idx = pk_idx
+        # claves o hashes de las filas devueltas por la última llamada a
+        #  filter, ver reject
+        self.batch = []
+        self.con = sqlite3.connect(constr_sqlite, timeout=600)
+        self.con.execute('pragma journal_mode=wal;')
+        DeltaStore.create_tables(self.con)
+        cur = self.con.cursor()
+        if pk_idx is not None:
+            cur.execute('create temp table _batch (pk TEXT, hash TEXT);')
+            cur.execute('create temp table _seen (pk TEXT PRIMARY KEY, ' +\
+                        'hash TEXT);')
+        else:
+            cur.execute('create temp table _seen (hash TEXT PRIMARY KEY, ' +\
+                        'row TEXT);')
+            cur.execute('select hash, n, row from row_multisets ' +\
+                        'where table_name=?;', (table_name,))
+            self.stored = {row[0]: (row[1], row[2])
+                           for row in cur.fetchall()}
+            self.seen = {}
+
+
+    @staticmethod
+    def create_tables(con):
+        """
+        crea, si no existen, las tablas de hashes en la db sqlite con
+        """
+        create_table1 = \
+        """
+        create table if not exists row_hashes (
+        table_name TEXT,
+        pk TEXT,
+        hash TEXT,
+        PRIMARY KEY (table_name, pk))
+        """
+
+        create_table2 = \
+        """
+        create table if not exists row_multisets (
+        table_name TEXT,
+        hash TEXT,
+        n INTEGER,
+        row TEXT,
+        PRIMARY KEY (table_name, hash))
+        """
+
+        con.execute(create_table1)
+        con.execute(create_table2)
+        con.commit()
+
+
+    @staticmethod
+    def to_json(values) -> str:
+        """
+        serializa una lista de valores de una fila; los valores que no son
+            json se guardan con su representación en postgres
+        """
+        from json import dumps
+
+        def default(item):
+            if isinstance(item, (bytes, bytearray, memoryview)):
+                return '\\x' + bytes(item).hex()
+            return str(item)
+
+        return dumps(values, default=default, ensure_ascii=False)
+
+
+    @staticmethod
+    def row_hash(row) -> str:
+        """
+        hash de los valores de una fila
+        """
+        from hashlib import blake2b
+        return blake2b(repr(tuple(row)).encode('utf-8'),
+                       digest_size=16).hexdigest()
+
+
+    def filter(self, rows: list) -> list:
+        """
+        registra los hashes de rows y devuelve las filas nuevas o modificadas
+        """
+        hashes = [DeltaStore.row_hash(row) for row in rows]
+        cur = self.con.cursor()
+        self.batch = []
+        if self.pk_idx is None:
+            new_rows = []
+            new_items = []
+            for row, hash1 in zip(rows, hashes):
+                n = self.seen.get(hash1, 0) + 1
+                self.seen[hash1] = n
+                if n == 1:
+                    new_items.append((hash1, DeltaStore.to_json(list(row))))
+                if n > self.stored.get(hash1, (0, ''))[0]:
+                    new_rows.append(row)
+                    self.batch.append(hash1)
+            cur.executemany('insert into _seen (hash, row) values (?, ?);',
+                            new_items)
+            self.con.commit()
+            return new_rows
+
+        keys = [DeltaStore.to_json([row[i] for i in self.pk_idx])
+                for row in rows]
+        cur.execute('delete from _batch;')
+        cur.executemany('insert into _batch (pk, hash) values (?, ?);',
+                        zip(keys, hashes))
+        cur.execute('select b.pk, h.hash from _batch b ' +\
+                    'join row_hashes h on h.table_name=? and h.pk=b.pk;',
+                    (self.table_name,))
+        stored = {row[0]: row[1] for row in cur.fetchall()}
+        cur.execute('insert or replace into _seen select pk, hash ' +\
+                    'from _batch;')
+        self.con.commit()
+        new_rows = []
+        for row, key, hash1 in zip(rows, keys, hashes):
+            if stored.get(key) != hash1:
+                new_rows.append(row)
+                self.batch.append(key)
+        return new_rows
+
+
+    def reject(self, idx: list):
+        """
+        anula el registro de las filas en las posiciones idx de la última
+            llamada a filter, que postgres ha rechazado: en las tablas con
+            primary key se guarda su clave sin hash, de modo que no se
+            consideran borradas, y en las tablas sin primary key se
+            descuentan del multiset
+        """
+        if self.pk_idx is None:
+            for i in idx:
+                self.seen[self.batch[i]] -= 1
+            return
+        cur = self.con.cursor()
+        cur.executemany('update _seen set hash=null where pk=?;',
+                        [(self.batch[i],) for i in idx])
+        self.con.commit()
+
+
+    def deleted(self) -> list:
+        """
+        devuelve las filas registradas en la ejecución anterior que no se
+            han leído en la actual: en las tablas con primary key, lista con
+            los valores de la primary key de cada fila; en las tablas sin
+            primary key, lista de (valores de la fila, número de filas
+            iguales que hay que borrar)
+        """
+        from json import loads
+
+        if self.pk_idx is None:
+            return [(loads(item[1]), item[0] - self.seen.get(hash1, 0))
+                    for hash1, item in self.stored.items()
+                    if item[0] > self.seen.get(hash1, 0)]
+        cur = self.con.cursor()
+        cur.execute('select pk from row_hashes where table_name=? and ' +\
+                    'pk not in (select pk from _seen);', (self.table_name,))
+        return [loads(row[0]) for row in cur.fetchall()]
+
+
+    def commit(self):
+        """
+        sustituye los hashes guardados de la tabla por los de la ejecución
+            en curso
+        """
+        cur = self.con.cursor()
+        try:
+            # el bloqueo de escritura se toma al principio para que espere a
+            #  los workers que están grabando los hashes de otras tablas
+            cur.execute('begin immediate;')
+            if self.pk_idx is None:
+                cur.execute('delete from row_multisets where table_name=?;',
+                            (self.table_name,))
+                cur.execute('select hash, row from _seen;')
+                cur.executemany('insert into row_multisets ' +\
+                                '(table_name, hash, n, row) ' +\
+                                'values (?, ?, ?, ?);',
+                                [(self.table_name, row[0],
+                                  self.seen[row[0]], row[1])
+                                 for row in cur.fetchall()
+                                 if self.seen[row[0]] > 0])
+            else:
+                cur.execute('delete from row_hashes where table_name=? ' +\
+                            'and pk not in (select pk from _seen);',
+                            (self.table_name,))
+                cur.execute('insert or replace into row_hashes ' +\
+                            '(table_name, pk, hash) ' +\
+                            'select ?, pk, hash from _seen;',
+                            (self.table_name,))
+            self.con.commit()
+        except:
+            self.con.rollback()
+            raise
+
+
+    def close(self):
+        self.con.close()
+
+
+class RejectFile():
+    """
+    Fichero csv con las filas de una tabla que postgres ha rechazado en
+        upsert con quarantine True: SQLSTATE, mensaje de error y valores de
+        la fila. El fichero se crea con la primera fila rechazada
+    """
+
+    def __init__(self, fname: str, col_names: list, append: bool=False):
+        """
+        args
+        fname: fichero de salida
+        col_names: nombres de las columnas de la tabla
+        append: si True se añaden las filas a las de una ejecución anterior
+            (carga reanudada con checkpoint); si False se borra el fichero
+            de una ejecución anterior
+        """
+        from os import remove
+        from os.path import isfile
+        self.fname = fname
+        self.col_names = col_names
+        self.fo = None
+        self.writer = None
+        self.append = append and isfile(fname)
+        if not append and isfile(fname):
+            remove(fname)
+
+
+    def write(self, pgcode: str, message: str, row):
+        import csv
+        if self.fo is None:
+            self.fo = open(self.fname, 'a' if self.append else 'w',
+                           newline='', encoding='utf-8')
+            self.writer = csv.writer(self.fo, delimiter=',', quotechar='"',
+                                     quoting=csv.QUOTE_NONNUMERIC,
+                                     lineterminator='\n')
+            if not self.append:
+                self.writer.writerow(['sqlstate', 'error'] + self.col_names)
+        self.writer.writerow([pgcode, message] + list(row))
+
+
+    def close(self):
+        if self.fo is not None:
+            self.fo.close()
+            self.fo = None
+
+
+class CheckpointJournal():
+    """
+    Diario de la carga de una tabla con upsert y checkpoint True: en la
+        tabla upsert_checkpoints de la db sqlite de estructura se anota cada
+        lote de filas del que se ha hecho commit en postgres (número de
+        lote, filas leídas y última clave) y el final de la carga de la
+        tabla. Una ejecución posterior de upsert salta las tablas terminadas
+        y reanuda las tablas a medias; cuando upsert termina sin errores se
+        borra el diario
+    El diario se escribe después del commit en postgres, por lo que si el
+        proceso se interrumpe entre ambos se vuelve a enviar un lote, que no
+        tiene efecto en las tablas con primary key; las tablas sin primary
+        key no se reanudan, se vacían y se cargan de nuevo
+    """
+
+    def __init__(self, constr_sqlite: str, table_name: str):
+        """
+        args
+        constr_sqlite: fichero de la db sqlite de estructura
+        table_name: nombre de la tabla access
+        """
+        self.table_name = table_name
+        self.con = sqlite3.connect(constr_sqlite, timeout=600)
+        CheckpointJournal.create_tables(self.con)
+
+
+    @staticmethod
+    def create_tables(con):
+        """
+        crea, si no existe, la tabla del diario en la db sqlite con
+        """
+        create_table1 = \
+        """
+        create table if not exists upsert_checkpoints (
+        table_name TEXT,
+        chunk INTEGER,
+        rows INTEGER,
+        last_key TEXT,
+        finished INTEGER,
+        PRIMARY KEY (table_name, chunk))
+        """
+
+        con.execute(create_table1)
+        con.commit()
+
+
+    def state(self) -> tuple:
+        """
+        devuelve el último lote anotado de la tabla: (número de lote, filas
+            leídas, última clave o None, True si la carga ha terminado) o
+            None si no hay ninguno
+        """
+        from json import loads
+
+        select = \
+        """
+        select chunk, rows, last_key, finished
+        from upsert_checkpoints
+        where table_name = ?
+        order by chunk desc
+        limit 1;
+        """
+
+        cur = self.con.cursor()
+        cur.execute(select, (self.table_name,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        last_key = loads(row[2]) if row[2] is not None else None
+        return row[0], row[1], last_key, bool(row[3])
+
+
+    def save(self, chunk: int, rows: int, last_key=None,
+             finished: bool=False):
+        """
+        anota un lote; last_key solo se guarda si es un int o un str, los
+            otros tipos no se pueden pasar de nuevo a access como parámetro
+        """
+        from json import dumps
+
+        insert = \
+        """
+        insert or replace into upsert_checkpoints
+        (table_name, chunk, rows, last_key, finished)
+        values (?, ?, ?, ?, ?);
+        """
+
+        if isinstance(last_key, bool) or \
+            not isinstance(last_key, (int, str)):
+            last_key = None
+        else:
+            last_key = dumps(last_key)
+        self.con.execute(insert, (self.table_name, chunk, rows, last_key,
+                                  int(finished)))
+        self.con.commit()
+
+
+    def clear(self):
+        """
+        borra el diario de la tabla
+        """
+        self.con.execute('delete from upsert_checkpoints where ' +\
+                         'table_name = ?;', (self.table_name,))
+        self.con.commit()
+
+
+    @staticmethod
+    def reset(constr_sqlite: str):
+        """
+        borra el diario de todas las tablas
+        """
+        con = sqlite3.connect(constr_sqlite, timeout=600)
+        try:
+            CheckpointJournal.create_tables(con)
+            con.execute('delete from upsert_checkpoints;')
+            con.commit()
+        finally:
+            con.close()
+
+
+    def close(self):
+        self.con.close()
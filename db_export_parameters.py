@@ -10,6 +10,12 @@ también se explica el significado de cada parámetro
 # ruta de la base de datos Access a migrar
 db: str = r'H:\off\db\analiticas_masub\PH_09_15_y_15_21\BD_FIC_AGBAR_2009_2013\PERIODO_AGBAR_FEDERICO_para_exportar.mdb'
 
+# source_backend
+# forma de leer la db access: 'pyodbc' driver odbc de access (solo windows);
+# 'mdbtools' programas mdb-tables, mdb-schema y mdb-export de mdbtools
+# (linux); 'sqlite' db sqlite que imita a la db access (pruebas)
+source_backend: str = 'pyodbc'
+
 # directorio de resultados (debe existir)
 dir_out: str = r'H:\off\db\analiticas_masub\PH_09_15_y_15_21\BD_FIC_AGBAR_2009_2013\export2psql'
 
@@ -23,3 +29,98 @@ schema_name: str = 'tmp'
 file_ini = 'pgdb.ini'
 section = 'ipa'
 
+# _________________PERFIL DE LOS DATOS_______________________
+
+# profile_sample_rows
+# número máximo de filas de cada tabla que lee profile_tables para calcular
+# los datos de sus columnas (el número de filas de la tabla se cuenta
+# siempre); si es 0 se leen las tablas completas
+profile_sample_rows: int = 100000
+
+# profile_workers
+# número de tablas que profile_tables lee a la vez, cada una con su propia
+# conexión a la db access
+profile_workers: int = 1
+
+# _________________TIPOS DE LAS COLUMNAS_______________________
+
+# types_sample_rows
+# número máximo de filas de cada tabla que lee optimize_types para proponer
+# los tipos de las columnas; si es 0 solo se utiliza el tamaño de las
+# columnas en access
+types_sample_rows: int = 0
+
+# _________________CARGA DE DATOS_______________________
+
+# batch_size
+# número de filas que se leen de cada tabla access y se escriben en postgres
+# en cada lote; la memoria utilizada en upsert depende de este valor y no del
+# tamaño de las tablas
+batch_size: int = 10000
+
+# upsert_workers
+# número de tablas que se cargan a la vez en upsert, cada una con su propia
+# conexión a access y a postgres; una tabla empieza a cargarse cuando se han
+# cargado las tablas a las que referencian sus foreign keys
+upsert_workers: int = 1
+
+# range_rows
+# si es mayor que 0 las tablas de más de range_rows filas cuya primary key es
+# una columna entera (por ejemplo un autonumérico COUNTER) se leen por rangos
+# de la clave con range_workers conexiones a access a la vez, tanto en upsert
+# como en la exportación a csv; las demás tablas se leen con una sola conexión
+range_rows: int = 0
+
+# range_workers
+# número de conexiones a access con las que se lee por rangos cada tabla
+# grande
+range_workers: int = 4
+
+# datetime_tz
+# zona horaria de las fechas de la db access (access no la guarda), ver
+# value_adapters: 'session' las fechas se cargan sin zona horaria y postgres
+# las interpreta en la zona horaria de su sesión; 'local' zona horaria del
+# equipo que ejecuta la migración; 'utc'; o un nombre de zona como
+# 'Europe/Madrid'. Salvo con 'session' las fechas se envían con su desfase
+# respecto a UTC y el resultado no depende de la sesión de postgres
+datetime_tz: str = 'session'
+
+# _________________EXPORTACIÓN A CSV_______________________
+
+# csv_workers
+# número de tablas que se exportan a la vez, cada una con su propia conexión
+# a la db access
+csv_workers: int = 1
+
+# csv_chunk_rows
+# si es mayor que 0 las tablas se dividen en ficheros csv de como máximo
+# csv_chunk_rows filas; si es 0 se escribe un fichero por tabla
+csv_chunk_rows: int = 0
+
+# csv_compression
+# None: ficheros csv sin comprimir; 'gzip': ficheros .csv.gz; 'zstd':
+# ficheros .csv.zst (requiere el paquete zstandard)
+csv_compression: str = None
+
+# csv_binary
+# si True en vez de ficheros csv se escriben ficheros .bin con el formato
+# binario de COPY de postgres, más rápidos de escribir y de cargar en tablas
+# con muchas columnas numéricas o de fecha
+csv_binary: bool = False
+
+# copy_workers
+# número de conexiones a postgres con las que copy_csv_files carga a la vez
+# los ficheros csv de las tablas de un mismo nivel de carga
+copy_workers: int = 1
+
+# _________________CREACIÓN DE CLAVES_______________________
+
+# keys_workers
+# número de conexiones a postgres con las que create_keys construye a la vez
+# las primary keys de tablas distintas y valida las foreign keys
+keys_workers: int = 1
+
+# maintenance_work_mem
+# si no es None valor de maintenance_work_mem de las sesiones de create_keys
+# (ej. '1GB'); con más memoria los índices se construyen más rápido
+maintenance_work_mem: str = None
@@ -5,81 +5,170 @@ Created on Fri Aug 30 19:02:42 2019
 Módulo para almacenar mensajes durante la ejecución de un script
 Los mensajes se dan de alta con la función append. Los mensajes se graban a
     un fichero de texto con la función dump.
+Los mensajes se acumulan en memoria y, cuando hay max_rows mensajes o
+    ocupan más de max_bytes caracteres, se pasan a un hilo que los graba en
+    el fichero en segundo plano, de modo que append no espera a que se
+    escriba el fichero. dump graba los mensajes pendientes y espera a que el
+    hilo termine de escribir
 module variables
-    __messages. Lista destrings donde se almacenan los mensajes
+    __messages. Lista de (instante, mensaje) donde se almacenan los mensajes
+        pendientes de grabar
     __fileNameWihoutExtension. Nombre de fichero de texto donde se grabarán
         los mensajes
     __FILE_EXTENSION. Extensión del fichero log
-    __nwrites. Controla el número de veces que se ejecuta dump con éxito
+    __nwrites. Controla el número de veces que se han pasado mensajes al
+        hilo de escritura
     max_rows. Número máximo de elementos en __messages. Si al hacer un append
-        tiene 100 elementos, el programa hace un dump y borra los mensajes
-        grabados (control para logs potencialmente de muchos elementos)
+        tiene max_rows elementos, se pasan al hilo de escritura y se borran
+        de __messages (control para logs potencialmente de muchos elementos)
+    max_bytes. Número máximo de caracteres de los mensajes de __messages;
+        si se supera se pasan al hilo de escritura
+    json_lines. Si True el fichero log se graba en formato json lines, un
+        objeto {"time": ..., "message": ...} por línea, con extensión .jsonl
 """
 from datetime import datetime
+from queue import Queue
+from threading import Lock, Thread
+from time import time
 
 __messages = []
 __fileNameWihoutExtension = 'app'
 __FILE_EXTENSION = '.log'
 __nwrites = 0
 max_rows = 100
+max_bytes = 1 << 20
+json_lines = False
+
+__nbytes = 0
+__lock = Lock()
+__queue = Queue()
+__writer = None
+# último segundo formateado y su texto, para no llamar a strftime en cada
+#  append
+__second = (None, '')
 
 
 def get_as_list() -> list:
     """
-    devuelve el valor de __messages
+    devuelve los mensajes pendientes de grabar
     """
-    return __messages
+    with __lock:
+        messages = list(__messages)
+    if not messages:
+        return []
+    date = datetime.fromtimestamp(messages[0][0]).strftime('%Y-%m-%d')
+    return [date] + [__format(t, message) for t, message in messages]
 
 
 def get_as_str() -> str:
     """
-    devuelve el valor de __messages as str
+    devuelve los mensajes pendientes de grabar as str
     """
-    return '\n'.join(__messages)
+    return '\n'.join(get_as_list())
 
 
 def file_name_get():
 	"""
 	devuelve el nombre del fichero log
 	"""
-	return __fileNameWihoutExtension + __FILE_EXTENSION
+	return __fileNameWihoutExtension + __extension()
 
 
 def append(message: str, toScreen: bool=True):
     """
     append message in __messages
     """
-    global __messages
-    now = datetime.now()
-    if not __messages:
-        date = now.strftime('%Y-%m-%d')
-        __messages.append(f'{date}')
-
-    if len(__messages) == max_rows:
-        dump()
-        __messages = []
-
-    time = now.strftime('%HH:%MM:%SS')
-    __messages.append(f'{time}: {message}')
+    global __messages, __nbytes
+    with __lock:
+        __messages.append((time(), message))
+        __nbytes += len(message)
+        if len(__messages) >= max_rows or __nbytes > max_bytes:
+            __flush()
     if toScreen:
         print(message)
 
 
-def dump(fileName: str=__fileNameWihoutExtension, mode: str='w'):
+def dump(fileName: str=None, mode: str='w'):
+    """
+    graba __messages en el fichero fileName (sin extensión; si None el
+        último utilizado, app por defecto) y espera a que se hayan escrito
+        todos los mensajes
+    """
+    global __fileNameWihoutExtension
+
+    with __lock:
+        if fileName is not None:
+            __fileNameWihoutExtension = fileName
+        __flush()
+    __queue.join()
+
+
+def __extension() -> str:
+    if json_lines:
+        return '.jsonl'
+    return __FILE_EXTENSION
+
+
+def __format(t: float, message: str) -> str:
     """
-    graba __messages en el fichero fileName
+    línea del fichero log en formato texto
     """
-    global __nwrites
+    global __second
+    second = int(t)
+    cached = __second
+    if cached[0] != second:
+        cached = (second,
+                  datetime.fromtimestamp(second).strftime('%HH:%MM:%SS'))
+        __second = cached
+    return f'{cached[1]}: {message}'
 
-    if fileName is not None:
-        __fileName = fileName
 
+def __flush():
+    """
+    pasa los mensajes de __messages al hilo de escritura; se ejecuta con
+        __lock adquirido
+    """
+    global __messages, __nbytes, __nwrites, __writer
+
+    if not __messages and __nwrites > 0:
+        return
+    if __writer is None:
+        __writer = Thread(target=__write, name='littleLogging', daemon=True)
+        __writer.start()
     if __nwrites == 0:
         mode = 'w'
     else:
         mode = 'a'
-
-    with open(f'{__fileName}{__FILE_EXTENSION}', mode) as f:
-        for message in __messages:
-            f.write(f'{message}\n')
+    __queue.put((__fileNameWihoutExtension + __extension(), mode,
+                 json_lines, __messages))
+    __messages = []
+    __nbytes = 0
     __nwrites += 1
+
+
+def __write():
+    """
+    hilo de escritura: graba en el fichero log los mensajes que recibe en
+        __queue
+    """
+    import json
+
+    while True:
+        fname, mode, as_json, messages = __queue.get()
+        try:
+            with open(fname, mode, encoding='utf-8') as f:
+                if as_json:
+                    for t, message in messages:
+                        item = {'time': datetime.fromtimestamp(t).isoformat(),
+                                'message': message}
+                        f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                elif messages:
+                    date = datetime.fromtimestamp(messages[0][0])
+                    if mode == 'w':
+                        f.write(f'{date.strftime("%Y-%m-%d")}\n')
+                    f.write(''.join([f'{__format(t, message)}\n'
+                                     for t, message in messages]))
+        except OSError as er:
+            print(f'littleLogging: no se ha podido grabar {fname}: {er}')
+        finally:
+            __queue.task_done()
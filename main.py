@@ -15,19 +15,100 @@ import littleLogging as logging
 # existente
 create_db_structure: bool = False
 
+# incremental_structure
+# si True create_db_structure no crea de nuevo el fichero sqlite, solo
+# actualiza las tablas cuya estructura ha cambiado desde la ejecución
+# anterior, y write_sql solo escribe el ddl de esas tablas
+incremental_structure: bool = False
+
+# profile_tables
+# si True lee los datos de la db access y graba en la db sqlite el número de
+# filas y el ancho medio de las filas de cada tabla y los nulos, longitudes,
+# mínimos y máximos de cada columna; upsert_py y write_data_to_csv los
+# utilizan para ordenar las tablas y ajustar el tamaño de los lotes
+profile_tables: bool = False
+
+# optimize_types
+# si True propone para cada columna un tipo postgres más ajustado según su
+# tamaño en access (varchar(n), el entero más estrecho, numeric(19,4) para
+# CURRENCY) y, si par.types_sample_rows es mayor que 0, según sus datos, y
+# escribe el informe _tipos_columnas.csv en dir_out para revisarlo
+# optimized_types
+# si True write_sql crea las columnas con los tipos propuestos por
+# optimize_types, que utilizan también la carga de datos
+optimize_types: bool = False
+optimized_types: bool = False
+
 # write_sql
 # si True escribe la estructura de las tablas en 2 ficheros sql que deben ser
 # ejecutados
 write_sql: bool = False
 
+# deferred_keys
+# si True write_sql crea las tablas sin primary key y las claves primarias y
+# ajenas se crean en el fichero de las foreign keys, que se ejecuta después
+# de la carga (las foreign keys se añaden NOT VALID y después se validan);
+# la carga se hace con write_copy_sql o copy_csv_py, no con upsert_py
+# unlogged_tables
+# si True write_sql crea las tablas UNLOGGED y el fichero de las foreign keys
+# las pasa a LOGGED después de la carga
+deferred_keys: bool = False
+unlogged_tables: bool = False
+
+# create_keys_py
+# si True, después de la carga, crea desde python las claves del perfil
+# deferred_keys con par.keys_workers conexiones a la vez, en lugar de
+# ejecutar el fichero de las foreign keys
+create_keys_py: bool = False
+
 # write_data_to_csv
 # si True graba los datos de cada tabla en un fichero csv
 write_data_to_csv: bool = False
 
+# write_copy_sql
+# si True escribe un script psql con un \copy por cada fichero csv escrito
+# con write_data_to_csv, en el orden de carga de las tablas
+write_copy_sql: bool = False
+
+# copy_csv_py
+# si True carga en postgres los ficheros csv escritos con write_data_to_csv,
+# igual que el script de write_copy_sql pero desde python
+copy_csv_py: bool = False
+
 # py_upsert
 # Si Truw ejecuta un upsert de los datos en la db access en la db postgres
 upsert_py: bool = False
 
+# upsert_copy
+# si True el upsert de upsert_py carga cada tabla con COPY en una tabla
+# temporal y la fusiona con la tabla de destino (mucho más rápido); si False
+# se ejecuta un insert por fila, útil para localizar las filas con problemas
+upsert_copy: bool = True
+
+# upsert_binary
+# si True y upsert_copy es True los datos se envían con el formato binario
+# de COPY en vez del formato texto
+upsert_binary: bool = False
+
+# upsert_delta
+# si True upsert_py solo envía a postgres las filas nuevas o modificadas
+# desde la ejecución anterior (se guarda un hash de cada fila en la db
+# sqlite); si además upsert_delta_deletes es True se borran en postgres las
+# filas que ya no existen en la db access
+upsert_delta: bool = False
+upsert_delta_deletes: bool = False
+
+# upsert_checkpoint
+# si True upsert_py hace commit de cada lote de filas y lo anota en un diario
+# en la db sqlite; si la ejecución se interrumpe, al ejecutarlo de nuevo se
+# saltan las tablas ya cargadas y se reanuda la tabla en curso
+upsert_checkpoint: bool = False
+
+# upsert_quarantine
+# si True las filas que postgres rechaza en upsert_py se escriben, con el
+# error, en los ficheros _rechazadas_{tabla}.csv y la carga continúa
+upsert_quarantine: bool = False
+
 # keys2lower. Convierte las contenidos de las columnas implicadas en las
 # claves primarias o ajenas en minúsculas (2 opciones):
 # keys2lower_py si True la conversón se hece directamente con python
@@ -35,41 +116,98 @@ upsert_py: bool = False
 keys2lower_py: bool = False
 keys2lower_sql: bool = False
 
+# keys2lower_only_changed
+# si True keys2lower solo actualiza las filas cuyo valor cambia (reejecuciones)
+keys2lower_only_changed: bool = False
+
+# lower_keys_in_load
+# si True upsert_py y write_data_to_csv escriben en minúsculas y con trim los
+# contenidos de las columnas de texto de las claves primarias o ajenas, de
+# modo que cada fila se escribe una sola vez y no hace falta keys2lower
+lower_keys_in_load: bool = False
+
+# metrics_profile
+# al terminar se graban en dir_out/_metrics.json los tiempos, filas y bytes
+# de cada fase y de cada tabla (ver el módulo metrics); si metrics_profile es
+# True además se ejecuta cProfile con cada tabla y se graban las estadísticas
+# en dir_out/{fase}_{tabla}.prof
+metrics_profile: bool = False
+
 
 if __name__ == "__main__":
 
     try:
+        from os.path import join
         from time import time
         import db_export_parameters as par
         from db_export import Migrate as msa
+        import metrics
 
         startTime = time()
+        if metrics_profile:
+            metrics.profile_dir = par.dir_out
 
-        migrate = msa(par.db, par.dir_out, par.file_ini, par.section)
+        migrate = msa(par.db, par.dir_out, par.file_ini, par.section,
+                      par.source_backend)
 
         if create_db_structure:
-            migrate.structure_to_sqlite()
+            migrate.structure_to_sqlite(incremental_structure)
             logging.append('Se ejecutó structure_to_sqlite', False)
 
+        if profile_tables:
+            migrate.profile_tables(par.profile_sample_rows,
+                                   par.profile_workers)
+            logging.append('Se ejecutó profile_tables', False)
+
+        if optimize_types:
+            migrate.optimize_types(par.types_sample_rows)
+            logging.append('Se ejecutó optimize_types', False)
+
         if write_sql:
-            migrate.structure_to_sql(par.schema_name)
+            migrate.structure_to_sql(par.schema_name, incremental_structure,
+                                     deferred_keys, unlogged_tables,
+                                     optimized_types)
             logging.append('Se ejecutó structure_to_sql', False)
 
         if write_data_to_csv:
-            migrate.export_data_to_csv()
+            migrate.export_data_to_csv(par.csv_workers, par.csv_chunk_rows,
+                                       par.csv_compression, par.batch_size,
+                                       par.csv_binary, lower_keys_in_load,
+                                       par.range_rows, par.range_workers,
+                                       par.datetime_tz)
             logging.append('Se ejecutó export_data_to_csv', False)
 
+        if write_copy_sql:
+            migrate.write_copyfrom()
+            logging.append('Se ejecutó write_copyfrom', False)
+
+        if copy_csv_py:
+            migrate.copy_csv_files(par.copy_workers)
+            logging.append('Se ejecutó copy_csv_files', False)
+
         if upsert_py:
-            migrate.upsert(upsert_py)
+            migrate.upsert(upsert_py, upsert_copy, par.batch_size,
+                           par.upsert_workers, upsert_delta,
+                           upsert_delta_deletes, upsert_binary,
+                           upsert_checkpoint, upsert_quarantine,
+                           lower_keys_in_load, par.range_rows,
+                           par.range_workers, par.datetime_tz)
             logging.append('Se ejecutó upsert', False)
 
         if keys2lower_py or keys2lower_sql:
-            migrate.column_contents_2lowercase(keys2lower_py, keys2lower_sql)
+            migrate.column_contents_2lowercase(keys2lower_py, keys2lower_sql,
+                                               keys2lower_only_changed)
             logging.append('Se ejecutó column_contents_2lowercase', False)
 
+        if create_keys_py:
+            migrate.create_keys(par.keys_workers, incremental_structure,
+                                unlogged_tables, par.maintenance_work_mem)
+            logging.append('Se ejecutó create_keys', False)
+
 
         xtime = time() - startTime
         print(f'The script took {xtime:.2f} secs')
+        metrics.dump(join(par.dir_out, '_metrics.json'))
 
     except Exception as e:
         import traceback
@@ -78,4 +216,4 @@ if __name__ == "__main__":
         logging.append(msg)
     finally:
         logging.dump()
-        print('Se ha generado el fichero app.log')
+        print(f'Se ha generado el fichero {logging.file_name_get()}')
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+@solis
+
+Módulo para medir la ejecución de las fases de db_export.Migrate
+Cada método de Migrate decorado con phase es una fase, que se mide con el
+    nombre que recibe phase (structure_to_sqlite, upsert, create_keys...), y
+    cada tabla de una fase se mide con table, que devuelve un TableMetrics;
+    en él se acumula el tiempo de las etapas fetch (lectura de access),
+    transform (transformación de las filas en python) y write (escritura en
+    postgres o en los ficheros), las filas leídas y escritas y los bytes
+    escritos. Con esta información se puede saber si el cuello de botella es
+    odbc, python o postgres
+Las medidas se graban con dump en un fichero json o csv según su extensión
+Si profile_dir no es None el trabajo de cada tabla se ejecuta con cProfile y
+    las estadísticas se graban en profile_dir/{fase}_{tabla}.prof; se pueden
+    ver con python -m pstats fichero.prof
+module variables
+    _records. Lista de dict con las medidas de las fases y de las tablas
+    profile_dir. Directorio de los ficheros de cProfile; None si no se
+        utiliza cProfile
+"""
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+# etapas de la carga de una tabla
+STAGES = ('fetch', 'transform', 'write')
+
+_records = []
+_lock = Lock()
+profile_dir = None
+
+
+class TableMetrics():
+    """
+    Medidas del trabajo de una fase con una tabla
+    """
+
+    def __init__(self, phase: str, table: str):
+        self.phase = phase
+        self.table = table
+        self.secs = {stage: 0. for stage in STAGES}
+        self.rows_read = 0
+        self.rows_written = 0
+        self.bytes = 0
+        self.profiler = None
+        self.start = perf_counter()
+        if profile_dir is not None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # hay otro profiler activo
+                self.profiler = None
+
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        acumula en la etapa name el tiempo del bloque with
+        """
+        t = perf_counter()
+        try:
+            yield
+        finally:
+            self.secs[name] += perf_counter() - t
+
+
+    def iterate(self, iterable, name: str='fetch'):
+        """
+        iterator que devuelve los elementos de iterable acumulando en la
+            etapa name el tiempo de obtener cada uno
+        """
+        iterator = iter(iterable)
+        while True:
+            t = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.secs[name] += perf_counter() - t
+                return
+            self.secs[name] += perf_counter() - t
+            yield item
+
+
+    def add(self, rows_read: int=0, rows_written: int=0, nbytes: int=0):
+        self.rows_read += rows_read
+        self.rows_written += rows_written
+        self.bytes += nbytes
+
+
+    def close(self):
+        """
+        termina la medida y la guarda
+        """
+        secs = perf_counter() - self.start
+        if self.profiler is not None:
+            from os.path import join
+            self.profiler.disable()
+            self.profiler.dump_stats(join(profile_dir,
+                                          f'{self.phase}_{self.table}.prof'))
+            self.profiler = None
+        record = {'phase': self.phase, 'table': self.table, 'secs': secs,
+                  'rows_read': self.rows_read,
+                  'rows_written': self.rows_written, 'bytes': self.bytes,
+                  'rows_per_sec': self.rows_read / secs if secs > 0 else 0.}
+        for stage in STAGES:
+            record[f'{stage}_secs'] = self.secs[stage]
+        with _lock:
+            _records.append(record)
+
+
+@contextmanager
+def table(phase: str, table: str):
+    """
+    mide el trabajo de la fase phase con la tabla table; devuelve un
+        TableMetrics
+    """
+    metrics = TableMetrics(phase, table)
+    try:
+        yield metrics
+    finally:
+        metrics.close()
+
+
+@contextmanager
+def phase(name: str):
+    """
+    mide el tiempo total de la fase name; en la medida las filas y los
+        tiempos de las etapas son la suma de los de sus tablas
+    """
+    with _lock:
+        first = len(_records)
+    t = perf_counter()
+    try:
+        yield
+    finally:
+        secs = perf_counter() - t
+        with _lock:
+            tables = [record for record in _records[first:]
+                      if record['phase'] == name]
+            record = {'phase': name, 'table': '', 'secs': secs}
+            for key in ('rows_read', 'rows_written', 'bytes'):
+                record[key] = sum([item[key] for item in tables])
+            record['rows_per_sec'] = \
+                record['rows_read'] / secs if secs > 0 else 0.
+            for stage in STAGES:
+                record[f'{stage}_secs'] = sum([item[f'{stage}_secs']
+                                               for item in tables])
+            _records.append(record)
+
+
+def get_as_list() -> list:
+    """
+    devuelve una copia de las medidas
+    """
+    with _lock:
+        return [dict(record) for record in _records]
+
+
+def reset():
+    """
+    borra las medidas
+    """
+    with _lock:
+        _records.clear()
+
+
+def dump(fileName: str):
+    """
+    graba las medidas en fileName; si la extensión es .csv en formato csv,
+        en otro caso en formato json
+    """
+    records = get_as_list()
+    if fileName.lower().endswith('.csv'):
+        import csv
+        fields = ['phase', 'table', 'secs', 'rows_read', 'rows_written',
+                  'bytes', 'rows_per_sec'] +\
+            [f'{stage}_secs' for stage in STAGES]
+        with open(fileName, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=fields,
+                                    lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        import json
+        with open(fileName, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False, indent=1)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+@solis
+
+Codifica filas leídas de la db access en el formato binario de la sentencia
+    COPY de postgres (COPY ... WITH (FORMAT binary)); los tipos de las
+    columnas son los pg_type_name de la tabla columns de la db sqlite de
+    estructura
+El formato binario evita formatear y volver a interpretar como texto los
+    números y las fechas; las columnas de ancho fijo se empaquetan con
+    struct.pack y, si todas las columnas de la tabla son de ancho fijo, las
+    filas sin nulos de un lote se empaquetan con una sola llamada
+Ver https://www.postgresql.org/docs/current/sql-copy.html
+"""
+from datetime import datetime, timezone
+from decimal import Decimal
+from struct import Struct
+
+# cabecera y final de un fichero o flujo COPY binario
+HEADER = b'PGCOPY\n\xff\r\n\x00' + Struct('>ii').pack(0, 0)
+TRAILER = Struct('>h').pack(-1)
+
+# valor nulo: longitud -1
+NULL = Struct('>i').pack(-1)
+
+# formato struct de los tipos de ancho fijo
+FIXED_FORMATS = {'boolean': '?',
+                 'int2': 'h',
+                 'int4': 'i',
+                 'int8': 'q',
+                 'float4': 'f',
+                 'float8': 'd',
+                 'timestamptz': 'q'}
+
+# origen de los timestamp de postgres
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+_NAIVE_EPOCH = datetime(2000, 1, 1)
+# segundos entre 1970-01-01 y 2000-01-01
+_UNIX_PG_SECS = 946684800
+
+_int4 = Struct('>i')
+_numeric_header = Struct('>hhHh')
+_structs = {}
+
+
+def batch_struct(fmt: str, n: int) -> Struct:
+    """
+    devuelve (y guarda para reutilizarlo) el Struct que empaqueta n veces
+        el formato fmt
+    """
+    key = (fmt, n)
+    st = _structs.get(key)
+    if st is None:
+        if len(_structs) > 64:
+            _structs.clear()
+        st = Struct('>' + fmt * n)
+        _structs[key] = st
+    return st
+
+
+def timestamp_value(item, tz=None) -> int:
+    """
+    microsegundos desde 2000-01-01 UTC; los datetime sin zona horaria se
+        interpretan en la zona tz o, si tz es None, en la zona horaria local
+    """
+    if not isinstance(item, datetime):
+        item = datetime(item.year, item.month, item.day)
+    if item.tzinfo is not None:
+        td = item - PG_EPOCH
+        return (td.days * 86400 + td.seconds) * 1000000 + td.microseconds
+    # se evita astimezone, que es mucho más lento que calcular el desfase
+    td = item - _NAIVE_EPOCH
+    secs = td.days * 86400 + td.seconds
+    if tz is None:
+        offset = round(secs + _UNIX_PG_SECS + td.microseconds / 1000000 -
+                       item.timestamp())
+    else:
+        offset = tz.utcoffset(item)
+        offset = offset.days * 86400 + offset.seconds
+    return (secs - offset) * 1000000 + td.microseconds
+
+
+def numeric_bytes(item) -> bytes:
+    """
+    codifica un número en el formato binario del tipo numeric: dígitos en
+        base 10000, peso del primer dígito, signo y escala
+    """
+    if not isinstance(item, Decimal):
+        item = Decimal(str(item))
+    if item.is_nan():
+        return _numeric_header.pack(0, 0, 0xC000, 0)
+    if not item.is_finite():
+        raise ValueError(f'numeric no admite el valor {item}')
+    sign, digits, exp = item.as_tuple()
+    digits = ''.join([str(d) for d in digits])
+    if exp > 0:
+        digits += '0' * exp
+        exp = 0
+    dscale = -exp
+    if len(digits) < dscale:
+        digits = digits.zfill(dscale)
+    int_part = digits[:len(digits) - dscale]
+    frac_part = digits[len(digits) - dscale:]
+    int_part = int_part.zfill((len(int_part) + 3) // 4 * 4)
+    frac_part = frac_part.ljust((len(frac_part) + 3) // 4 * 4, '0')
+    groups = [int(int_part[i:i + 4]) for i in range(0, len(int_part), 4)]
+    weight = len(groups) - 1
+    groups += [int(frac_part[i:i + 4]) for i in range(0, len(frac_part), 4)]
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+    header = _numeric_header.pack(len(groups), weight, 0x4000 if sign else 0,
+                                  dscale)
+    return header + batch_struct('H', len(groups)).pack(*groups)
+
+
+def text_bytes(item) -> bytes:
+    if not isinstance(item, str):
+        item = str(item)
+    return item.encode('utf-8')
+
+
+def bytea_bytes(item):
+    """
+    los str (GUID) se codifican en utf-8; los bytes se pasan como
+        memoryview, sin copiarlos
+    """
+    if isinstance(item, str):
+        return item.encode('utf-8')
+    view = memoryview(item)
+    if view.format != 'B':
+        view = view.cast('B')
+    return view
+
+
+# codificadores de los tipos de ancho variable
+VARIABLE_ENCODERS = {'numeric': numeric_bytes,
+                     'varchar': text_bytes,
+                     'text': text_bytes,
+                     'bytea': bytea_bytes}
+
+
+class BinaryCopyEncoder():
+    """
+    Codifica las filas de una tabla en el formato COPY binario
+    """
+
+    def __init__(self, pg_types: list, tz=None):
+        """
+        args
+        pg_types: tipo postgres de cada columna de la fila (pg_type_name,
+            sin contar los modificadores como varchar(n) o numeric(p,s));
+            los tipos desconocidos se codifican como texto
+        tz: zona horaria (tzinfo) de los datetime sin zona; si None se
+            utiliza la zona horaria local
+        """
+        self.pg_types = [pg_type.lower().split('(')[0] if pg_type
+                         else 'varchar' for pg_type in pg_types]
+        self.tz = tz
+        self.fixed = all([pg_type in FIXED_FORMATS
+                          for pg_type in self.pg_types])
+        self.timestamps = [i for i, pg_type in enumerate(self.pg_types)
+                           if pg_type == 'timestamptz']
+        self.row_fmt = 'h' + ''.join(['i' + FIXED_FORMATS[pg_type]
+                                      for pg_type in self.pg_types
+                                      if pg_type in FIXED_FORMATS])
+        self.encoders = []
+        for pg_type in self.pg_types:
+            if pg_type in FIXED_FORMATS:
+                fmt = FIXED_FORMATS[pg_type]
+                st = Struct('>i' + fmt)
+                size = Struct('>' + fmt).size
+                self.encoders.append((True, st, size))
+            else:
+                self.encoders.append((False,
+                                      VARIABLE_ENCODERS.get(pg_type,
+                                                            text_bytes),
+                                      None))
+        self.row_header = Struct('>h').pack(len(self.pg_types))
+
+
+    def __values(self, row) -> list:
+        """
+        valores de una fila con los timestamp convertidos a microsegundos
+        """
+        if not self.timestamps:
+            return row
+        row = list(row)
+        for i in self.timestamps:
+            if row[i] is not None:
+                row[i] = timestamp_value(row[i], self.tz)
+        return row
+
+
+    def encode_row(self, row) -> bytes:
+        """
+        codifica una fila
+        """
+        parts = [self.row_header]
+        for item, (fixed, encoder, size) in zip(self.__values(row),
+                                                self.encoders):
+            if item is None:
+                parts.append(NULL)
+            elif fixed:
+                parts.append(encoder.pack(size, item))
+            else:
+                b = encoder(item)
+                parts.append(_int4.pack(len(b)))
+                parts.append(b)
+        return b''.join(parts)
+
+
+    def encode_rows(self, rows: list) -> bytes:
+        """
+        codifica un lote de filas; si todas las columnas son de ancho fijo
+            las filas consecutivas sin nulos se empaquetan con una sola
+            llamada a struct.pack
+        """
+        if not self.fixed:
+            return b''.join([self.encode_row(row) for row in rows])
+
+        ncols = len(self.pg_types)
+        sizes = [encoder[2] for encoder in self.encoders]
+        parts = []
+        run = []
+        for row in rows:
+            if None in row:
+                if run:
+                    parts.append(self.__pack_run(run, ncols, sizes))
+                    run = []
+                parts.append(self.encode_row(row))
+            else:
+                run.append(row)
+        if run:
+            parts.append(self.__pack_run(run, ncols, sizes))
+        return b''.join(parts)
+
+
+    def __pack_run(self, rows: list, ncols: int, sizes: list) -> bytes:
+        values = []
+        for row in rows:
+            values.append(ncols)
+            for size, item in zip(sizes, self.__values(row)):
+                values.append(size)
+                values.append(item)
+        return batch_struct(self.row_fmt, len(rows)).pack(*values)
+
+
+
+def copy_data(encoder: BinaryCopyEncoder, rows: list) -> bytes:
+    """
+    devuelve un flujo COPY binario completo -cabecera, filas y final- con
+        las filas rows
+    """
+    return HEADER + encoder.encode_rows(rows) + TRAILER
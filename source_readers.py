@@ -0,0 +1,682 @@
+# -*- coding: utf-8 -*-
+"""
+@solis
+
+Lectores de la db de origen de db_export.Migrate. Un lector da acceso al
+    catálogo de la db (tablas, columnas, primary keys y foreign keys) y a
+    las filas de sus tablas, de modo que Migrate no depende de la forma de
+    leer la db access:
+    pyodbc. Driver odbc de access (Microsoft Access Driver); solo funciona
+        en windows con el driver ACE instalado
+    mdbtools. Programas mdb-tables, mdb-schema y mdb-export de mdbtools
+        (versión 1.0 o posterior); permite leer la db access en linux
+    sqlite. db sqlite con tablas que imitan a las de la db access: los
+        tipos declarados de las columnas son tipos access (COUNTER,
+        VARCHAR(50), DATETIME...); las foreign keys se leen de la tabla
+        MSysRelationships si existe o de las foreign keys de sqlite. Sirve
+        para hacer pruebas sin la db access
+Los lectores se crean con open_reader; cada lector tiene su propia conexión
+    y no se debe compartir entre hilos
+Los tipos de las columnas se devuelven con los nombres del driver odbc de
+    access (los de Migrate.__access_pg_types) y las filas como secuencias
+    mutables (listas o filas de pyodbc) con los valores convertidos a los
+    tipos python que devuelve pyodbc
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from decimal import Decimal
+
+BACKENDS = ('pyodbc', 'mdbtools', 'sqlite')
+
+ACCESS_DRIVER = '{Microsoft Access Driver (*.mdb, *.accdb)}'
+
+# código odbc y tamaño de los tipos access, ver SourceReader.columns
+SQL_DATA_TYPES = {'BIT': -7, 'BYTE': -6, 'SMALLINT': 5, 'INTEGER': 4,
+                  'COUNTER': 4, 'LONG': -5, 'REAL': 7, 'DOUBLE': 8,
+                  'CURRENCY': 2, 'NUMERIC': 2, 'DATETIME': 93,
+                  'VARCHAR': 12, 'LONGCHAR': -1, 'BINARY': -2,
+                  'LONGBINARY': -4, 'GUID': -11}
+COLUMN_SIZES = {'BIT': 1, 'BYTE': 3, 'SMALLINT': 5, 'INTEGER': 10,
+                'COUNTER': 10, 'LONG': 19, 'REAL': 24, 'DOUBLE': 53,
+                'CURRENCY': 19, 'NUMERIC': 28, 'DATETIME': 19,
+                'VARCHAR': 255, 'LONGCHAR': 1073741823, 'BINARY': 510,
+                'LONGBINARY': 1073741823, 'GUID': 36}
+
+# tipos de mdb-schema (backend access) y de sqlite -> tipos access
+MDB_TYPES = {'Boolean': 'BIT', 'Byte': 'BYTE', 'Integer': 'SMALLINT',
+             'Long Integer': 'INTEGER', 'Currency': 'CURRENCY',
+             'Single': 'REAL', 'Double': 'DOUBLE', 'DateTime': 'DATETIME',
+             'Binary': 'BINARY', 'Text': 'VARCHAR', 'OLE': 'LONGBINARY',
+             'Memo/Hyperlink': 'LONGCHAR', 'Replication ID': 'GUID',
+             'Numeric': 'NUMERIC'}
+SQLITE_TYPES = {'INT': 'INTEGER', 'BIGINT': 'LONG', 'TEXT': 'LONGCHAR',
+                'REAL': 'DOUBLE', 'FLOAT': 'DOUBLE', 'BLOB': 'LONGBINARY',
+                'BOOLEAN': 'BIT', 'DATE': 'DATETIME', 'TIMESTAMP': 'DATETIME',
+                'DECIMAL': 'NUMERIC'}
+
+# formato de las fechas y marca de los nulos en la salida de mdb-export
+MDB_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+MDB_NULL = '\x01'
+
+
+def _datetime(item):
+    if isinstance(item, datetime):
+        return item
+    return datetime.fromisoformat(item)
+
+
+def _decimal(item):
+    if isinstance(item, Decimal):
+        return item
+    return Decimal(str(item))
+
+
+def _bool(item):
+    if isinstance(item, str):
+        return item.strip().lower() not in ('0', 'false', '')
+    return bool(item)
+
+
+def _bytes(item):
+    if isinstance(item, str):
+        return bytes.fromhex(item)
+    return bytes(item)
+
+
+# conversión de los valores leídos como texto (mdbtools) o con los tipos de
+# sqlite a los tipos python de pyodbc
+CONVERTERS = {'BIT': _bool, 'BYTE': int, 'SMALLINT': int, 'INTEGER': int,
+              'COUNTER': int, 'LONG': int, 'REAL': float, 'DOUBLE': float,
+              'CURRENCY': _decimal, 'NUMERIC': _decimal,
+              'DATETIME': _datetime, 'BINARY': _bytes,
+              'LONGBINARY': _bytes}
+
+
+def open_reader(backend: str, dbaccess: str):
+    """
+    abre un lector de la db dbaccess con el backend backend, ver BACKENDS
+    """
+    if backend == 'pyodbc':
+        return PyodbcReader(dbaccess)
+    elif backend == 'mdbtools':
+        return MdbToolsReader(dbaccess)
+    elif backend == 'sqlite':
+        return SqliteReader(dbaccess)
+    raise ValueError(f'backend no válido: {backend}; debe ser uno de ' +\
+                     ', '.join(BACKENDS))
+
+
+class SourceReader(ABC):
+    """
+    Interfaz de los lectores; RANGES es True si el lector puede leer rangos
+        de la clave sin leer toda la tabla, ver db_export.RangeReader. Los
+        métodos son abstractos: un lector que no los define todos no se
+        puede crear
+    """
+    RANGES = False
+
+    @abstractmethod
+    def tables(self) -> list:
+        """
+        devuelve las tablas: lista de (nombre, tipo), tipo es 'TABLE',
+            'SYSTEM TABLE' o el tipo de otros objetos (VIEW...)
+        """
+
+
+    @abstractmethod
+    def columns(self, table: str=None) -> list:
+        """
+        devuelve las columnas de table o de todas las tablas si table es
+            None: lista de (tabla, columna, código odbc del tipo, tipo
+            access, tamaño, número de orden empezando por 1, número de
+            decimales o None si no se conoce)
+        """
+
+
+    @abstractmethod
+    def primary_key(self, table: str) -> list:
+        """
+        devuelve las columnas de la primary key de table
+        """
+
+
+    @abstractmethod
+    def relationships(self) -> list:
+        """
+        devuelve las columnas de las foreign keys ordenadas por foreign key
+            y columna: lista de (foreign key, tabla, columna, tabla
+            referenciada, columna referenciada)
+        """
+
+
+    @abstractmethod
+    def read(self, table: str, order: list=(), key: str=None, lo=None,
+             hi=None, after=None):
+        """
+        lee las filas de table; devuelve un objeto con el método
+            fetchmany(n), que devuelve listas de como máximo n filas
+        args
+        order: columnas por las que se ordenan las filas
+        key: columna por la que se filtran las filas: si lo y hi no son
+            None las filas con key entre lo y hi, ambos incluidos, y si
+            after no es None las filas con key mayor que after
+        """
+
+
+    @abstractmethod
+    def key_range(self, table: str, key: str) -> tuple:
+        """
+        devuelve (número de filas, mínimo de key, máximo de key) de table
+        """
+
+
+    @abstractmethod
+    def count(self, table: str) -> int:
+        """
+        devuelve el número de filas de table
+        """
+
+
+    def close(self):
+        pass
+
+
+class _SqlReader(SourceReader):
+    """
+    Lectura de las filas con sentencias select; los lectores que la
+        utilizan deben definir PARAM (marcador de los parámetros) y cur
+        (cursor db api) y, si los identificadores no se delimitan con
+        comillas dobles, quote
+    """
+    RANGES = True
+    PARAM = '?'
+
+    @staticmethod
+    def quote(name: str) -> str:
+        """
+        devuelve el identificador name delimitado para el sql del lector
+        """
+        return f'"{name}"'
+
+
+    def read(self, table: str, order: list=(), key: str=None, lo=None,
+             hi=None, after=None):
+        q = self.quote
+        select = f'select * from {q(table)}'
+        params = []
+        if key is not None and lo is not None and hi is not None:
+            select += f' where {q(key)} >= {self.PARAM} and ' +\
+                f'{q(key)} <= {self.PARAM}'
+            params = [lo, hi]
+        elif key is not None and after is not None:
+            select += f' where {q(key)} > {self.PARAM}'
+            params = [after]
+        if order:
+            select += ' order by ' + ', '.join([q(col) for col in order])
+        if params:
+            self.cur.execute(select + ';', params)
+        else:
+            self.cur.execute(select + ';')
+        return self
+
+
+    def fetchmany(self, n: int) -> list:
+        return self._convert(self.cur.fetchmany(n))
+
+
+    def _convert(self, rows: list) -> list:
+        return [list(row) for row in rows]
+
+
+    def key_range(self, table: str, key: str) -> tuple:
+        q = self.quote
+        select = f'select count(*), min({q(key)}), max({q(key)}) ' +\
+            f'from {q(table)};'
+        self.cur.execute(select)
+        return tuple(self.cur.fetchone())
+
+
+    def count(self, table: str) -> int:
+        self.cur.execute(f'select count(*) from {self.quote(table)};')
+        return self.cur.fetchone()[0]
+
+
+class PyodbcReader(_SqlReader):
+    """
+    Lector con el driver odbc de access
+    """
+
+    def __init__(self, dbaccess: str):
+        try:
+            import pyodbc
+        except ImportError:
+            raise ValueError('El backend pyodbc requiere el paquete pyodbc')
+        self.constr = f'DRIVER={ACCESS_DRIVER}; DBQ={dbaccess};'
+        self.con = pyodbc.connect(self.constr)
+        self.cur = self.con.cursor()
+
+
+    @staticmethod
+    def quote(name: str) -> str:
+        """
+        el sql de access (jet) delimita los identificadores con corchetes;
+            "name" sería una constante de texto
+        """
+        return f'[{name}]'
+
+
+    def tables(self) -> list:
+        return [(row.table_name, row.table_type) for row in self.cur.tables()]
+
+
+    def columns(self, table: str=None) -> list:
+        if table is None:
+            rows = self.cur.columns()
+        else:
+            rows = self.cur.columns(table)
+        return [(row.table_name, row.column_name, row.sql_data_type,
+                 row.type_name, row.column_size, row.ordinal_position,
+                 row.decimal_digits)
+                for row in rows]
+
+
+    def primary_key(self, table: str) -> list:
+        # el driver solo da la primary key a través de statistics
+        return [row[8] for row in self.cur.statistics(table)
+                if row[5] is not None and row[5].upper() == 'PRIMARYKEY']
+
+
+    def relationships(self) -> list:
+        """
+        lee la tabla MSysRelationships, ver la nota sobre permisos en
+            db_export
+        """
+        select = \
+        """
+        select szRelationship, szObject, szColumn, szReferencedObject,
+            szReferencedColumn
+        from MSysRelationships
+        order by szRelationship, icolumn
+        """
+
+        self.cur.execute(select)
+        return [tuple(row) for row in self.cur.fetchall()]
+
+
+    def _convert(self, rows: list) -> list:
+        # las filas de pyodbc ya admiten la asignación de valores
+        return rows
+
+
+    def close(self):
+        self.con.close()
+
+
+class SqliteReader(_SqlReader):
+    """
+    Lector de una db sqlite que imita a la db access
+    """
+
+    def __init__(self, dbaccess: str):
+        import sqlite3
+        self.con = sqlite3.connect(dbaccess, check_same_thread=False)
+        self.cur = self.con.cursor()
+        self.converters = {}
+
+
+    def tables(self) -> list:
+        select = \
+        """
+        select name, type from sqlite_master
+        where type in ('table', 'view') and name not like 'sqlite_%'
+        order by name;
+        """
+
+        self.cur.execute(select)
+        tables = []
+        for name, type_ in self.cur.fetchall():
+            if type_ == 'view':
+                tables.append((name, 'VIEW'))
+            elif name.lower().startswith('msys'):
+                tables.append((name, 'SYSTEM TABLE'))
+            else:
+                tables.append((name, 'TABLE'))
+        return tables
+
+
+    @staticmethod
+    def type_name(declared: str) -> tuple:
+        """
+        devuelve (tipo access, tamaño, número de decimales o None) de un
+            tipo declarado en sqlite
+        """
+        declared = declared.strip().upper()
+        size = None
+        scale = None
+        if '(' in declared:
+            declared, size = declared.split('(', 1)
+            declared = declared.strip()
+            size = [item.strip(' )') for item in size.split(',')]
+            if len(size) > 1 and size[1].isdigit():
+                scale = int(size[1])
+            size = int(size[0]) if size[0].isdigit() else None
+        type_name = SQLITE_TYPES.get(declared, declared)
+        if size is None:
+            size = COLUMN_SIZES.get(type_name, 255)
+        return type_name, size, scale
+
+
+    def columns(self, table: str=None) -> list:
+        if table is None:
+            names = [item[0] for item in self.tables()]
+        else:
+            names = [table]
+        columns = []
+        for name in names:
+            self.cur.execute(f'pragma table_info("{name}");')
+            for row in self.cur.fetchall():
+                type_name, size, scale = SqliteReader.type_name(row[2])
+                columns.append((name, row[1],
+                                SQL_DATA_TYPES.get(type_name, 12),
+                                type_name, size, row[0] + 1, scale))
+        return columns
+
+
+    def primary_key(self, table: str) -> list:
+        self.cur.execute(f'pragma table_info("{table}");')
+        pk = sorted([(row[5], row[1]) for row in self.cur.fetchall()
+                     if row[5]])
+        return [item[1] for item in pk]
+
+
+    def relationships(self) -> list:
+        select = \
+        """
+        select szRelationship, szObject, szColumn, szReferencedObject,
+            szReferencedColumn
+        from MSysRelationships
+        order by szRelationship, icolumn;
+        """
+
+        tables = self.tables()
+        if 'MSysRelationships' in [item[0] for item in tables]:
+            self.cur.execute(select)
+            return [tuple(row) for row in self.cur.fetchall()]
+        relationships = []
+        for name, type_ in tables:
+            if type_ != 'TABLE':
+                continue
+            self.cur.execute(f'pragma foreign_key_list("{name}");')
+            for row in self.cur.fetchall():
+                referenced_col = row[4]
+                if referenced_col is None:
+                    # referencia a la primary key de la tabla referenciada
+                    referenced_col = self.primary_key(row[2])[row[1]]
+                relationships.append((f'{name}_{row[0]:d}', name, row[3],
+                                      row[2], referenced_col, row[1]))
+        relationships.sort(key=lambda row: (row[0], row[5]))
+        return [row[:5] for row in relationships]
+
+
+    def read(self, table: str, order: list=(), key: str=None, lo=None,
+             hi=None, after=None):
+        if table not in self.converters:
+            self.converters[table] = [CONVERTERS.get(row[3])
+                                      for row in self.columns(table)]
+        self.table_converters = self.converters[table]
+        return super().read(table, order, key, lo, hi, after)
+
+
+    def _convert(self, rows: list) -> list:
+        converters = self.table_converters
+        return [[item if item is None or f is None else f(item)
+                 for f, item in zip(converters, row)] for row in rows]
+
+
+    def close(self):
+        self.con.close()
+
+
+class _RowStream():
+    """
+    filas de un iterator con el método fetchmany
+    """
+
+    def __init__(self, rows, process=None):
+        self.rows = iter(rows)
+        self.process = process
+
+
+    def fetchmany(self, n: int) -> list:
+        from itertools import islice
+        rows = list(islice(self.rows, n))
+        if not rows:
+            self.close()
+        return rows
+
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdout.close()
+            self.process.wait()
+            self.process = None
+
+
+class MdbToolsReader(SourceReader):
+    """
+    Lector con los programas de mdbtools: el catálogo se lee de la salida
+        de mdb-tables y mdb-schema y las filas se leen en streaming de la
+        salida csv de mdb-export; las foreign keys se leen exportando la
+        tabla MSysRelationships, que mdbtools lee sin necesidad de permisos
+    mdb-export no puede filtrar las filas: los filtros de read se aplican
+        en python y, si se pide un orden, la tabla se ordena en memoria; por
+        esto RANGES es False
+    """
+
+    def __init__(self, dbaccess: str):
+        from shutil import which
+        for program in ('mdb-tables', 'mdb-schema', 'mdb-export'):
+            if which(program) is None:
+                raise ValueError(f'El backend mdbtools requiere {program}')
+        self.dbaccess = dbaccess
+        self.schema = None
+        self.streams = []
+
+
+    def __run(self, args: list) -> str:
+        import subprocess
+        return subprocess.run(args, capture_output=True, check=True,
+                              text=True, encoding='utf-8').stdout
+
+
+    def tables(self) -> list:
+        user = self.__run(['mdb-tables', '-1', self.dbaccess]).splitlines()
+        every = self.__run(['mdb-tables', '-1', '-S',
+                            self.dbaccess]).splitlines()
+        user = [name for name in user if name]
+        return [(name, 'TABLE') for name in user] + \
+            [(name, 'SYSTEM TABLE') for name in every
+             if name and name not in user]
+
+
+    def __schema_get(self) -> dict:
+        """
+        lee con mdb-schema (backend access) las columnas de todas las
+            tablas: {tabla: [(columna, tipo access, tamaño, número de
+            decimales o None)]}
+        """
+        import re
+
+        if self.schema is not None:
+            return self.schema
+        table_re = re.compile(r'^CREATE TABLE \[(.+)\]\s*$')
+        column_re = re.compile(r'^\s+\[(.+)\]\s+(.+?),?\s*$')
+        mdb_types = sorted(MDB_TYPES, key=len, reverse=True)
+        schema = {}
+        columns = None
+        for line in self.__run(['mdb-schema', self.dbaccess,
+                                'access']).splitlines():
+            match = table_re.match(line)
+            if match:
+                columns = schema.setdefault(match.group(1), [])
+                continue
+            if columns is None:
+                continue
+            if line.strip().startswith(');'):
+                columns = None
+                continue
+            match = column_re.match(line)
+            if not match:
+                continue
+            declared = match.group(2)
+            mdb_type = [item for item in mdb_types
+                        if declared.startswith(item)]
+            type_name = MDB_TYPES[mdb_type[0]] if mdb_type else 'VARCHAR'
+            size = re.match(r'.*?\((\d+)(?:\s*,\s*(\d+))?\)', declared)
+            scale = None
+            if size:
+                if size.group(2) is not None:
+                    scale = int(size.group(2))
+                size = int(size.group(1))
+            else:
+                size = COLUMN_SIZES.get(type_name, 255)
+            columns.append((match.group(1), type_name, size, scale))
+        self.schema = schema
+        return schema
+
+
+    def columns(self, table: str=None) -> list:
+        schema = self.__schema_get()
+        if table is None:
+            names = list(schema)
+        else:
+            names = [table]
+        return [(name, col, SQL_DATA_TYPES.get(type_name, 12), type_name,
+                 size, i + 1, scale)
+                for name in names
+                for i, (col, type_name, size, scale) in
+                enumerate(schema.get(name, []))]
+
+
+    def primary_key(self, table: str) -> list:
+        """
+        la primary key se lee de las sentencias PRIMARY KEY de mdb-schema
+            con el backend postgres; los nombres se comparan en minúsculas
+            porque el backend puede cambiarlos
+        """
+        import re
+
+        stm = re.compile(r'ALTER TABLE\s+(.+?)\s+ADD CONSTRAINT\s+.+?' +\
+                         r'\s+PRIMARY KEY\s*\((.+?)\)')
+        output = self.__run(['mdb-schema', '-T', table, self.dbaccess,
+                             'postgres'])
+        columns = {item[0].lower(): item[0]
+                   for item in self.__schema_get().get(table, [])}
+        for match in stm.finditer(output):
+            pk = [col.strip().strip('"[]`') for col in
+                  match.group(2).split(',')]
+            return [columns.get(col.lower(), col) for col in pk]
+        return []
+
+
+    def __export(self, table: str, null: str=MDB_NULL):
+        """
+        lanza mdb-export con la tabla table y devuelve (proceso, iterator
+            con las filas del csv); la primera fila es la cabecera
+        """
+        import csv
+        from io import TextIOWrapper
+        import subprocess
+
+        args = ['mdb-export', '-0', null, '-D', MDB_DATE_FORMAT,
+                '-T', MDB_DATE_FORMAT, '-b', 'hex', self.dbaccess, table]
+        process = subprocess.Popen(args, stdout=subprocess.PIPE)
+        # newline='' para que csv lea los saltos de línea de los textos
+        return process, csv.reader(TextIOWrapper(process.stdout,
+                                                 encoding='utf-8',
+                                                 newline=''))
+
+
+    def relationships(self) -> list:
+        process, rows = self.__export('MSysRelationships', '')
+        try:
+            header = next(rows, [])
+            idx = [header.index(col) for col in
+                   ('szRelationship', 'szObject', 'szColumn',
+                    'szReferencedObject', 'szReferencedColumn', 'icolumn')]
+            rows = [[row[i] for i in idx] for row in rows]
+        finally:
+            process.stdout.close()
+            process.wait()
+        rows.sort(key=lambda row: (row[0], int(row[5] or 0)))
+        return [tuple(row[:5]) for row in rows]
+
+
+    def read(self, table: str, order: list=(), key: str=None, lo=None,
+             hi=None, after=None):
+        columns = self.__schema_get()[table]
+        names = [item[0] for item in columns]
+        converters = [CONVERTERS.get(item[1]) for item in columns]
+        process, rows = self.__export(table)
+        next(rows, None)
+
+        def convert():
+            for row in rows:
+                yield [None if item == MDB_NULL else
+                       (item if f is None else f(item))
+                       for f, item in zip(converters, row)]
+
+        values = convert()
+        if key is not None:
+            i = names.index(key)
+            if lo is not None and hi is not None:
+                values = (row for row in values if lo <= row[i] <= hi)
+            elif after is not None:
+                values = (row for row in values if row[i] > after)
+        if order:
+            idx = [names.index(col) for col in order]
+            values = sorted(values, key=lambda row: [row[i] for i in idx])
+        stream = _RowStream(values, process)
+        self.streams = [item for item in self.streams
+                        if item.process is not None] + [stream]
+        return stream
+
+
+    def key_range(self, table: str, key: str) -> tuple:
+        i = [item[0] for item in self.__schema_get()[table]].index(key)
+        stream = self.read(table)
+        n, kmin, kmax = 0, None, None
+        while True:
+            rows = stream.fetchmany(10000)
+            if not rows:
+                break
+            n += len(rows)
+            keys = [row[i] for row in rows]
+            kmin = min(keys) if kmin is None else min(kmin, min(keys))
+            kmax = max(keys) if kmax is None else max(kmax, max(keys))
+        return n, kmin, kmax
+
+
+    def count(self, table: str) -> int:
+        """
+        con mdb-count (mdbtools 0.9 o posterior) o, si no está instalado,
+            leyendo la tabla completa
+        """
+        from shutil import which
+        if which('mdb-count') is not None:
+            return int(self.__run(['mdb-count', self.dbaccess,
+                                   table]).strip())
+        stream = self.read(table)
+        n = 0
+        while True:
+            rows = stream.fetchmany(10000)
+            if not rows:
+                break
+            n += len(rows)
+        return n
+
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
+        self.streams = []
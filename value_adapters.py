@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+@solis
+
+Adaptadores de los valores leídos de la db access a los tipos postgres de
+    sus columnas (pg_type_name de la tabla columns de la db sqlite de
+    estructura)
+Cada tipo postgres tiene un formateador para el formato text de COPY
+    (TEXT_FORMATTERS) y, si lo necesita, otro para los ficheros csv
+    (CSV_FORMATTERS); ColumnAdapters elige una vez por tabla el de cada
+    columna y convierte los lotes de filas por columnas, sin comprobar el
+    tipo de cada valor
+Los numeric se escriben con la representación exacta de Decimal, sin pasar
+    por float, y los bytea (BINARY, LONGBINARY, GUID...) se convierten a
+    hexadecimal desde un memoryview, sin copiar los bytes
+Política de zona horaria de las columnas DATETIME (tz_policy); access no
+    guarda la zona horaria de sus fechas:
+    'session': las fechas se envían sin zona horaria y postgres las
+        interpreta en la zona horaria de su sesión (en los ficheros COPY
+        binarios, que llevan el instante, en la zona horaria de la sesión
+        de upsert o en la local en export_data_to_csv)
+    'local': las fechas están en la zona horaria local del equipo que
+        ejecuta la migración
+    'utc': las fechas están en UTC
+    nombre de zona IANA, ej. 'Europe/Madrid': las fechas están en esa zona
+    Salvo con 'session' las fechas se escriben con su desfase respecto a UTC,
+    de modo que el instante cargado no depende de la sesión de postgres
+"""
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+# valor nulo del formato text de COPY
+COPY_NULL = '\\N'
+
+# caracteres que hay que escapar en el formato text de COPY
+COPY_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n',
+                                   '\r': '\\r'})
+
+TZ_POLICIES = ('session', 'local', 'utc')
+
+# número máximo de horas cuyo desfase se guarda en ColumnAdapters
+_MAX_OFFSETS = 100000
+
+
+def policy_tz(tz_policy: str, session_tz=None):
+    """
+    devuelve la zona horaria (tzinfo) de tz_policy; None es la zona
+        horaria local; con 'session' devuelve session_tz
+    """
+    if tz_policy == 'session':
+        return session_tz
+    if tz_policy == 'local':
+        return None
+    if tz_policy == 'utc':
+        return timezone.utc
+    from zoneinfo import ZoneInfo
+    try:
+        return ZoneInfo(tz_policy)
+    except Exception:
+        raise ValueError(f'tz_policy no válido: {tz_policy}')
+
+
+def utc_offset(item: datetime, tz=None) -> int:
+    """
+    desfase en segundos respecto a UTC del datetime sin zona horaria item
+        en la zona tz o, si tz es None, en la zona horaria local
+    """
+    if tz is None:
+        naive = item.replace(microsecond=0)
+        return round((naive - datetime(1970, 1, 1)).total_seconds() -
+                     naive.timestamp())
+    offset = tz.utcoffset(item)
+    return offset.days * 86400 + offset.seconds
+
+
+def offset_str(secs: int) -> str:
+    """
+    desfase respecto a UTC en formato +HH:MM o +HH:MM:SS
+    """
+    sign = '-' if secs < 0 else '+'
+    hh, rest = divmod(abs(secs), 3600)
+    mm, ss = divmod(rest, 60)
+    if ss:
+        return f'{sign}{hh:02d}:{mm:02d}:{ss:02d}'
+    return f'{sign}{hh:02d}:{mm:02d}'
+
+
+def text_value(item) -> str:
+    """
+    valor de tipo desconocido en el formato text de COPY
+    """
+    if isinstance(item, str):
+        return item.translate(COPY_TEXT_ESCAPES)
+    elif isinstance(item, bool):
+        return 't' if item else 'f'
+    elif isinstance(item, (bytes, bytearray, memoryview)):
+        return bytea_text(item)
+    elif isinstance(item, date):
+        return item.isoformat(' ')
+    return str(item)
+
+
+def str_text(item) -> str:
+    if not isinstance(item, str):
+        item = str(item)
+    return item.translate(COPY_TEXT_ESCAPES)
+
+
+def bool_text(item) -> str:
+    return 't' if item else 'f'
+
+
+def bytea_hex(item) -> str:
+    """
+    bytea en formato hexadecimal \\x..., los str (GUID) en utf-8
+    """
+    if isinstance(item, str):
+        return '\\x' + item.encode('utf-8').hex()
+    return '\\x' + memoryview(item).hex()
+
+
+def bytea_text(item) -> str:
+    return '\\' + bytea_hex(item)
+
+
+def date_text(item) -> str:
+    if isinstance(item, datetime):
+        return item.isoformat(' ')
+    return item.isoformat() + ' 00:00:00'
+
+
+# formateadores del formato text de COPY según el tipo postgres
+TEXT_FORMATTERS = {'varchar': str_text,
+                   'text': str_text,
+                   'boolean': bool_text,
+                   'int2': str,
+                   'int4': str,
+                   'int8': str,
+                   'float4': str,
+                   'float8': str,
+                   # str de Decimal es exacto, el de float el más corto
+                   'numeric': str,
+                   'timestamptz': date_text,
+                   'bytea': bytea_text}
+
+# formateadores de los ficheros csv según el tipo postgres; los demás tipos
+#  los escribe el módulo csv
+CSV_FORMATTERS = {'boolean': bool_text,
+                  'bytea': bytea_hex}
+
+
+class ColumnAdapters():
+    """
+    Convierte los lotes de filas de una tabla al formato text de COPY, a
+        los valores de los ficheros csv o a los parámetros de las sentencias
+        insert, según los tipos postgres de sus columnas y la política de
+        zona horaria de las fechas
+    """
+
+    def __init__(self, pg_types: list, tz_policy: str='session',
+                 session_tz=None):
+        """
+        args
+        pg_types: tipo postgres de cada columna de la fila (pg_type_name,
+            los modificadores como varchar(n) o numeric(p,s) no cuentan);
+            los valores de los tipos desconocidos (None) se formatean según
+            su tipo python
+        tz_policy: política de zona horaria de los datetime sin zona, ver
+            el docstring del módulo
+        session_tz: zona horaria de la sesión postgres con tz_policy
+            'session', ver Migrate.session_tz
+        """
+        self.pg_types = [pg_type.lower().split('(')[0] if pg_type else None
+                         for pg_type in pg_types]
+        self.tz_policy = tz_policy
+        self.tz = policy_tz(tz_policy, session_tz)
+        self.explicit_tz = tz_policy != 'session'
+        self.__offsets = {}
+        date_format = self.date_text if self.explicit_tz else date_text
+        self.text_formatters = []
+        self.csv_formatters = []
+        for i, pg_type in enumerate(self.pg_types):
+            if pg_type == 'timestamptz':
+                self.text_formatters.append(date_format)
+                if self.explicit_tz:
+                    self.csv_formatters.append((i, date_format))
+            else:
+                self.text_formatters.append(TEXT_FORMATTERS.get(pg_type,
+                                                                text_value))
+                if pg_type in CSV_FORMATTERS:
+                    self.csv_formatters.append((i, CSV_FORMATTERS[pg_type]))
+        self.param_idx = [i for i, pg_type in enumerate(self.pg_types)
+                          if pg_type == 'timestamptz'] \
+            if self.explicit_tz else []
+
+
+    def date_text(self, item) -> str:
+        """
+        fecha con el desfase respecto a UTC de la zona horaria self.tz; el
+            desfase se calcula una vez por hora
+        """
+        if not isinstance(item, datetime):
+            item = datetime(item.year, item.month, item.day)
+        if item.tzinfo is not None:
+            return item.isoformat(' ')
+        key = (item.year, item.month, item.day, item.hour)
+        offset = self.__offsets.get(key)
+        if offset is None:
+            if len(self.__offsets) > _MAX_OFFSETS:
+                self.__offsets.clear()
+            offset = offset_str(utc_offset(item, self.tz))
+            self.__offsets[key] = offset
+        return item.isoformat(' ') + offset
+
+
+    def copy_text(self, rows: list) -> str:
+        """
+        devuelve rows en el formato text de COPY: columnas separadas por
+            tabuladores, null como \\N, los caracteres especiales escapados
+            con \\ y una línea por fila; las filas se convierten por
+            columnas
+        """
+        if not rows:
+            return ''
+        columns = []
+        for formatter, column in zip(self.text_formatters, zip(*rows)):
+            if None in column:
+                columns.append([COPY_NULL if item is None
+                                else formatter(item) for item in column])
+            else:
+                columns.append(list(map(formatter, column)))
+        return '\n'.join(map('\t'.join, zip(*columns))) + '\n'
+
+
+    def csv_values(self, rows: list) -> list:
+        """
+        convierte (modifica las filas) los valores de rows que el módulo
+            csv no escribe en un formato válido para COPY ... (format csv):
+            bytea en hexadecimal, boolean como t/f y, salvo con tz_policy
+            'session', las fechas con su desfase respecto a UTC; devuelve
+            rows
+        """
+        for i, formatter in self.csv_formatters:
+            for row in rows:
+                item = row[i]
+                if item is not None:
+                    row[i] = formatter(item)
+        return rows
+
+
+    def param_values(self, rows: list) -> list:
+        """
+        asigna (modifica las filas) la zona horaria de la política
+            tz_policy a las fechas sin zona de rows, que psycopg2 envía con
+            su desfase respecto a UTC; devuelve rows
+        """
+        for i in self.param_idx:
+            for row in rows:
+                item = row[i]
+                if item is None:
+                    continue
+                if not isinstance(item, datetime):
+                    item = datetime(item.year, item.month, item.day)
+                if item.tzinfo is None:
+                    if self.tz is None:
+                        item = item.astimezone()
+                    else:
+                        item = item.replace(tzinfo=self.tz)
+                row[i] = item
+        return rows